@@ -564,10 +564,14 @@ async def adduser_handler(message: Message):
         return
     parts = (message.text or "").split()
     if len(parts) < 2:
-        await message.answer("Format: /adduser <telegram_id> <days>")
+        await message.answer("Format: /adduser <telegram_id> <days> [tier]")
         return
     target_id = parts[1]
     days = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 30
+    tier = access_service.normalize_tier(parts[3]) if len(parts) > 3 else None
+    if len(parts) > 3 and tier is None:
+        await message.answer(f"Noma'lum tarif. Mavjud: {', '.join(access_service.known_tiers())}")
+        return
     expires = utcnow_naive() + timedelta(days=days)
 
     async with db_session() as db:
@@ -577,14 +581,36 @@ async def adduser_handler(message: Message):
         if row:
             row.expires_at = expires
             row.username = row.username or "User"
+            if tier is not None:
+                row.tier = tier
         else:
-            db.add(AllowedUser(id=target_id, username="User", expires_at=expires))
+            db.add(AllowedUser(id=target_id, username="User", expires_at=expires, tier=tier))
 
-    await message.answer(f"✅ Foydalanuvchi qo'shildi!\nID: {target_id}\nMuddat: {days} kun")
+    await message.answer(
+        f"✅ Foydalanuvchi qo'shildi!\nID: {target_id}\nMuddat: {days} kun"
+        + (f"\nTarif: {tier}" if tier else "")
+    )
     if not was_active and expires > now:
         await notify_access_granted(target_id)
 
 
+async def settier_handler(message: Message):
+    if not is_super_admin(message.from_user.username):
+        return
+    parts = (message.text or "").split()
+    tier = access_service.normalize_tier(parts[2]) if len(parts) > 2 else None
+    if tier is None:
+        await message.answer(
+            f"Format: /settier <telegram_id> <{'|'.join(access_service.known_tiers())}>"
+        )
+        return
+    target_id = parts[1]
+    if not await access_service.set_tier(target_id, tier):
+        await message.answer(f"Foydalanuvchi topilmadi: {target_id}")
+        return
+    await message.answer(f"✅ Tarif o'zgartirildi!\nID: {target_id}\nTarif: {tier}")
+
+
 async def ban_handler(message: Message):
     if not is_super_admin(message.from_user.username):
         return
@@ -705,6 +731,7 @@ async def on_import_groups_cmd(message: Message):
             g["title"],
             g.get("type", "chat"),
             g.get("access_hash"),
+            g.get("peer_account_id"),
         )
         added += 1
     await message.answer(f"Import tugadi: {added} ta")
@@ -736,6 +763,7 @@ async def on_import_group(callback: CallbackQuery):
             target["title"],
             target.get("type", "chat"),
             target.get("access_hash"),
+            target.get("peer_account_id"),
         )
         await callback.answer(f"Qo'shildi: {target['title']} ✅")
 
@@ -791,6 +819,7 @@ async def on_add_all_groups(callback: CallbackQuery):
             group["title"],
             kind,
             group.get("access_hash"),
+            group.get("peer_account_id"),
         )
 
     if added > 0:
@@ -1348,6 +1377,7 @@ async def main():
     dp.message.register(start_handler, Command("menu"))
     dp.message.register(cancel_handler, Command("cancel"))
     dp.message.register(adduser_handler, Command("adduser"))
+    dp.message.register(settier_handler, Command("settier"))
     dp.message.register(ban_handler, Command("ban"))
     dp.message.register(info_handler, Command("info"))
     dp.message.register(id_handler, Command("id"))
@@ -24,20 +24,35 @@ class Settings(BaseSettings):
     broadcast_concurrency: int = 8
     broadcast_job_attempts: int = 3
     broadcast_job_backoff_ms: int = 5000
-    broadcast_user_lock_ttl_ms: int = 600000
+    broadcast_user_lock_ttl_ms: int = 15000
 
     broadcast_per_account_concurrency: int = 1
     broadcast_attempts_per_job: int = 2
+    broadcast_claim_batch_size: int = 4
+    broadcast_outcome_flush_interval_ms: int = 200
+    broadcast_outcome_flush_batch_size: int = 50
+    broadcast_outcome_flush_max_attempts: int = 3
+    broadcast_seed_chunk_size: int = 1000
     broadcast_continuation_base_delay_ms: int = 1500
     broadcast_continuation_jitter_ms: int = 1500
     broadcast_interval_safety_seconds: int = 0
 
-    telegram_per_account_mpm: int = 6
+    telegram_per_account_mpm: int = 20
     telegram_per_account_min_delay_ms: int = 1000
     telegram_per_account_max_delay_ms: int = 2000
+    telegram_per_account_max_wait_ms: int = 15000
     telegram_global_mps: int = 125
+    telegram_per_dc_mps: int = 0
+    telegram_rate_limit_permit_batch: int = 1
+    telegram_rate_limit_redis_timeout_ms: int = 50
+    telegram_rate_limit_fallback_ratio: float = 0.25
+    telegram_rate_limit_fallback_workers: int = 4
     telegram_slowmode_default_seconds: int = 300
     telegram_slowmode_retry_seconds: int = 10
+    telegram_flood_wait_default_seconds: int = 60
+
+    userbot_client_pool_max_size: int = 64
+    userbot_client_idle_ttl_ms: int = 600000
 
     broadcast_max_retries: int = 3
     broadcast_retry_base_ms: int = 2000
@@ -48,15 +63,33 @@ class Settings(BaseSettings):
     broadcast_retry_storm_threshold: int = 100
     broadcast_stuck_inflight_threshold: int = 100
     broadcast_queue_lag_alert_ms: int = 180000
+    broadcast_queue_class_weights: str = "scheduled:6,continuation:3,retry:1"
+    broadcast_fair_share_enabled: bool = True
+    broadcast_fair_quantum: int = 40
+    broadcast_fair_active_window_ms: int = 120000
+    broadcast_tier_weights: str = "basic:1,premium:3"
+    broadcast_execution_mode: str = "jobs"
+    broadcast_actor_max_run_ms: int = 240000
+    broadcast_actor_max_idle_wait_ms: int = 60000
+    broadcast_worker_routing_enabled: bool = True
+    broadcast_worker_id: str = ""
+    broadcast_worker_heartbeat_ms: int = 5000
+    broadcast_worker_member_ttl_ms: int = 20000
+    broadcast_worker_drain_timeout_ms: int = 25000
 
     remote_groups_cache_ttl_ms: int = 60000
     remote_groups_min_refresh_ms: int = 180000
     remote_groups_failure_cooldown_ms: int = 120000
 
     scheduler_check_interval_ms: int = 5000
+    scheduler_idle_wake_max_ms: int = 60000
     scheduler_early_factor: float = 1.0
     scheduler_max_due_per_tick: int = 500
     scheduler_jitter_max_ms: int = 15000
+    scheduler_due_index_rebuild_ms: int = 300000
+    scheduler_shard_count: int = 16
+    scheduler_shard_lease_ms: int = 30000
+    scheduler_shard_tick_timeout_ms: int = 20000
 
 
 settings = Settings()
@@ -16,6 +16,7 @@ from app.logging_utils import configure_json_logging
 from app.metrics import global_prometheus_text, global_snapshot
 from app.models import Base, TelegramAccount
 from app.redis_client import redis_client
+from app.schema_upgrades import apply_schema_upgrades
 from app.schemas import HealthResponse, ReadyResponse, SendMessageDTO
 
 configure_json_logging()
@@ -26,6 +27,7 @@ logger = logging.getLogger("app.main")
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await apply_schema_upgrades(conn)
 
     if settings.bot_role.strip().lower() == "app":
         await scheduler_service.start()
@@ -123,6 +125,12 @@ async def metrics_prometheus() -> PlainTextResponse:
     return PlainTextResponse(payload)
 
 
+@app.get("/broadcast/progress/{user_id}/{campaign_id}")
+async def broadcast_progress(user_id: int, campaign_id: str) -> dict:
+    summary = await userbot_service.campaign_progress(user_id, campaign_id)
+    return {"ok": True, "userId": str(user_id), "campaignId": campaign_id, **summary}
+
+
 @app.post("/bot/send")
 async def send_message(payload: SendMessageDTO):
     if payload.user_id is None:
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint, Index
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint, Index, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -45,12 +45,35 @@ class UserGroup(Base):
     title: Mapped[str] = mapped_column(String)
     type: Mapped[str] = mapped_column(String, default="chat")
     access_hash: Mapped[str | None] = mapped_column(String, nullable=True)
+    peer_account_id: Mapped[str | None] = mapped_column(String, nullable=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class GroupPeerHash(Base):
+    """A channel's access hash as seen by one account; hashes are per account."""
+
+    __tablename__ = "group_peer_hashes"
+
+    group_pk: Mapped[int] = mapped_column(
+        Integer, ForeignKey("user_groups.pk", ondelete="CASCADE"), primary_key=True
+    )
+    account_id: Mapped[str] = mapped_column(
+        String, ForeignKey("telegram_accounts.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    access_hash: Mapped[str] = mapped_column(String)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class BroadcastConfig(Base):
     __tablename__ = "broadcast_configs"
+    __table_args__ = (
+        Index(
+            "ix_bc_active_next_run_at",
+            "next_run_at",
+            postgresql_where=text("is_active"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[str] = mapped_column(String, ForeignKey("users.id", ondelete="CASCADE"), unique=True)
@@ -58,6 +81,9 @@ class BroadcastConfig(Base):
     interval: Mapped[int | None] = mapped_column(Integer, nullable=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=False)
     last_run_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    next_run_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Bumped whenever message or interval changes; queued jobs carry it instead of the text.
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default=text("1"))
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
@@ -78,6 +104,7 @@ class AllowedUser(Base):
     first_name: Mapped[str | None] = mapped_column(String, nullable=True)
     last_name: Mapped[str | None] = mapped_column(String, nullable=True)
     expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    tier: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
@@ -114,5 +141,7 @@ class BroadcastAttempt(Base):
     terminal_reason_code: Mapped[str | None] = mapped_column(String, nullable=True)
     last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
     idempotency_key: Mapped[str] = mapped_column(String, unique=True)
+    # Fencing token of the user lock held by the claiming worker.
+    claim_fence: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,28 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+# ``create_all`` only creates missing tables; columns and indexes added to
+# existing tables are applied here. Every statement must be idempotent.
+SCHEMA_UPGRADES: tuple[str, ...] = (
+    "ALTER TABLE user_groups ADD COLUMN IF NOT EXISTS peer_account_id VARCHAR",
+    "ALTER TABLE broadcast_configs ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMP WITHOUT TIME ZONE",
+    (
+        "UPDATE broadcast_configs SET next_run_at = COALESCE("
+        "last_run_at + make_interval(secs => GREATEST(60, COALESCE(interval, 3600))), "
+        "timezone('utc', now())) "
+        "WHERE next_run_at IS NULL"
+    ),
+    (
+        "CREATE INDEX IF NOT EXISTS ix_bc_active_next_run_at "
+        "ON broadcast_configs (next_run_at) WHERE is_active"
+    ),
+    "ALTER TABLE allowed_users ADD COLUMN IF NOT EXISTS tier VARCHAR",
+    "ALTER TABLE broadcast_configs ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE broadcast_attempts ADD COLUMN IF NOT EXISTS claim_fence BIGINT",
+)
+
+
+async def apply_schema_upgrades(conn: AsyncConnection) -> None:
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
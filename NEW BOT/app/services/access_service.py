@@ -6,6 +6,7 @@ from sqlalchemy.exc import IntegrityError
 from app.db import db_session
 from app.config import settings
 from app.models import AllowedUser
+from app.utils import parse_weight_map
 
 
 class AccessService:
@@ -37,6 +38,24 @@ class AccessService:
     def expired_denied_message(self) -> str:
         return f"⚠️ Obuna vaqtingiz tugagan. Admin ga murojaat qiling: {self.admin_contact()}"
 
+    @staticmethod
+    def known_tiers() -> list[str]:
+        return list(parse_weight_map(settings.broadcast_tier_weights))
+
+    def normalize_tier(self, tier: str | None) -> str | None:
+        """The tier as stored, or None when it is not one of ``broadcast_tier_weights``."""
+        value = (tier or "").strip()
+        return value if value in self.known_tiers() else None
+
+    async def set_tier(self, user_id: str, tier: str | None) -> bool:
+        """Set a listed user's subscription tier; False when the user is not listed."""
+        async with db_session() as db:
+            user = await db.get(AllowedUser, str(user_id))
+            if not user:
+                return False
+            user.tier = tier
+        return True
+
     @staticmethod
     def utcnow_naive() -> datetime:
         return datetime.now(UTC).replace(tzinfo=None)
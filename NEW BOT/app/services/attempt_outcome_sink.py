@@ -0,0 +1,219 @@
+import asyncio
+import logging
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, ProgrammingError, StatementError
+
+from app.config import settings
+from app.db import db_session
+from app.logging_utils import log_event
+from app.metrics import inc_metric, metric_key
+from app.models import BroadcastAttempt
+
+# Not written: when present in an outcome it guards the update instead, so a
+# worker whose user lock was taken over cannot overwrite the new holder's rows.
+FENCE_COLUMN = "claim_fence"
+
+
+class AttemptOutcomeSink:
+    """Write-behind buffer for in-flight attempt transitions.
+
+    Outcomes are keyed by attempt id (last write wins) and flushed in bulk,
+    either on a short timer, when the buffer reaches its size threshold or
+    when a caller asks for an explicit flush. Every write keeps the
+    ``status == 'in-flight'`` guard, so a flushed outcome never overrides a
+    row that was recovered or re-claimed in the meantime; fenced outcomes
+    additionally require the row's ``claim_fence`` to match.
+
+    An outcome that was in ``max_flush_attempts`` failed batches is written
+    on its own instead, so one bad row cannot hold back the rest; if that
+    write fails on the row's data it is logged and dropped, and the row is
+    left in flight for stuck-attempt recovery.
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: int | None = None,
+        batch_size: int | None = None,
+        max_flush_attempts: int | None = None,
+    ):
+        self.logger = logging.getLogger("attempt_outcome_sink")
+        self.flush_interval_ms = max(
+            10,
+            int(
+                flush_interval_ms
+                if flush_interval_ms is not None
+                else settings.broadcast_outcome_flush_interval_ms
+            ),
+        )
+        self.batch_size = max(
+            1,
+            int(
+                batch_size
+                if batch_size is not None
+                else settings.broadcast_outcome_flush_batch_size
+            ),
+        )
+        self.max_flush_attempts = max(
+            1,
+            int(
+                max_flush_attempts
+                if max_flush_attempts is not None
+                else settings.broadcast_outcome_flush_max_attempts
+            ),
+        )
+        self._pending: dict[str, dict] = {}
+        # Failed batch writes per buffered attempt id.
+        self._failures: dict[str, int] = {}
+        self._flush_lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    def _ensure_flusher(self) -> None:
+        if self._closed:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+            try:
+                await self.flush()
+            except Exception:
+                self.logger.exception("Attempt outcome flush failed")
+
+    async def record(self, attempt_id: str, values: dict, fence: int | None = None) -> None:
+        values = dict(values)
+        if fence is not None:
+            values[FENCE_COLUMN] = int(fence)
+        self._pending[attempt_id] = values
+        if self._closed or len(self._pending) >= self.batch_size:
+            try:
+                await self.flush()
+            except Exception:
+                # Entries stay buffered; the timer retries them.
+                self._ensure_flusher()
+            return
+        self._ensure_flusher()
+
+    async def flush(self) -> int:
+        async with self._lock():
+            if not self._pending:
+                return 0
+            pending = self._pending
+            self._pending = {}
+            isolated = {
+                attempt_id: values
+                for attempt_id, values in pending.items()
+                if self._failures.get(attempt_id, 0) >= self.max_flush_attempts
+            }
+            batch = {
+                attempt_id: values
+                for attempt_id, values in pending.items()
+                if attempt_id not in isolated
+            }
+            written = await self._write_isolated(isolated)
+            try:
+                if batch:
+                    await self._write_batch(batch)
+            except Exception:
+                # Newer outcomes recorded during the failed write take precedence.
+                for attempt_id, values in batch.items():
+                    self._pending.setdefault(attempt_id, values)
+                    self._failures[attempt_id] = self._failures.get(attempt_id, 0) + 1
+                await inc_metric(metric_key("userbot.outcome_sink.flush_failed", service="userbot"))
+                log_event(
+                    self.logger,
+                    logging.ERROR,
+                    "attempt_outcome_flush_failed",
+                    batch_size=len(batch),
+                )
+                raise
+            for attempt_id in batch:
+                self._failures.pop(attempt_id, None)
+            written += len(batch)
+            await inc_metric(
+                metric_key("userbot.outcome_sink.flushed", service="userbot"), written
+            )
+            return written
+
+    @staticmethod
+    def is_row_error(error: Exception) -> bool:
+        """Whether a write failed on the row's data rather than on the database."""
+        if isinstance(error, (IntegrityError, DataError, ProgrammingError)):
+            return True
+        return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+    async def _write_isolated(self, outcomes: dict[str, dict]) -> int:
+        """Write outcomes one per transaction; drop those whose own data is rejected."""
+        written = 0
+        for attempt_id, values in outcomes.items():
+            try:
+                await self._write_batch({attempt_id: values})
+            except Exception as error:
+                if not self.is_row_error(error):
+                    self._pending.setdefault(attempt_id, values)
+                    continue
+                self._failures.pop(attempt_id, None)
+                await inc_metric(metric_key("userbot.outcome_sink.dropped", service="userbot"))
+                log_event(
+                    self.logger,
+                    logging.ERROR,
+                    "attempt_outcome_dropped",
+                    attempt_id=attempt_id,
+                    values=values,
+                    error=str(error),
+                )
+                continue
+            self._failures.pop(attempt_id, None)
+            written += 1
+        return written
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    @staticmethod
+    def group_batch(batch: dict[str, dict]) -> dict[tuple[str, ...], list[dict]]:
+        groups: dict[tuple[str, ...], list[dict]] = {}
+        for attempt_id, values in batch.items():
+            columns = tuple(sorted(values))
+            params = {"b_attempt_id": attempt_id}
+            params.update({f"v_{column}": values[column] for column in columns})
+            groups.setdefault(columns, []).append(params)
+        return groups
+
+    @staticmethod
+    def build_update_statement(columns: tuple[str, ...]):
+        table = BroadcastAttempt.__table__
+        stmt = update(table).where(
+            table.c.id == bindparam("b_attempt_id"),
+            table.c.status == "in-flight",
+        )
+        if FENCE_COLUMN in columns:
+            stmt = stmt.where(table.c.claim_fence == bindparam(f"v_{FENCE_COLUMN}"))
+        return stmt.values(
+            {
+                column: bindparam(f"v_{column}")
+                for column in columns
+                if column != FENCE_COLUMN
+            }
+        )
+
+    async def _write_batch(self, batch: dict[str, dict]) -> None:
+        async with db_session() as db:
+            for columns, params in self.group_batch(batch).items():
+                await db.execute(self.build_update_statement(columns), params)
@@ -1,49 +1,347 @@
+import asyncio
 import inspect
+import json
 import logging
 import random
-from datetime import UTC, datetime
+from collections import OrderedDict
+from datetime import UTC, datetime, timedelta
 
 from app.config import settings
 from app.db import db_session
 from app.logging_utils import log_event
 from app.metrics import inc_metric, metric_key, set_gauge_metric
-from app.models import BroadcastConfig
+from app.models import BroadcastAttempt, BroadcastConfig
 from app.redis_client import redis_client
-from app.services.broadcast_queue_service import BroadcastQueueService
+from app.services.broadcast_queue_service import (
+    BroadcastQueueService,
+    PRIORITY_RETRY,
+    job_timeout_s,
+)
+from app.services.campaign_actor import CampaignActor
+from app.services.campaign_due_index import CampaignDueIndex
+from app.services.fair_share import FairShareService
 from app.services.userbot_service import UserbotService
-from sqlalchemy import or_, select, update
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import defer
+
+
+USER_LOCK_KEY_PREFIX = "broadcast:user-lock:"
+USER_LOCK_FENCE_KEY_PREFIX = "broadcast:user-lock-fence:"
+USER_LOCK_WAITERS_KEY_PREFIX = "broadcast:user-lock-waiters:"
+
+# KEYS: lock, fence counter, waiters hash. ARGV: token, ttl ms, waiter field,
+# waiter payload, waiters ttl ms, fence floor. Returns the new fencing token
+# when the lock was free; otherwise parks the request in the waiters hash (one
+# entry per campaign, latest wins) and returns 0. An empty field parks
+# nothing. Fences are stored in Postgres, so a counter lost with a Redis
+# restart must resume above them: without a floor and without a counter it
+# returns -1 untouched, and the caller retries with the highest persisted one.
+ACQUIRE_USER_LOCK_SCRIPT = """
+if ARGV[6] == '' and redis.call('exists', KEYS[2]) == 0 then
+  return -1
+end
+if redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then
+  local fence = redis.call('incr', KEYS[2])
+  local floor = tonumber(ARGV[6]) or 0
+  if fence <= floor then
+    fence = floor + 1
+    redis.call('set', KEYS[2], fence)
+  end
+  return fence
+end
+if ARGV[3] ~= '' then
+  redis.call('hset', KEYS[3], ARGV[3], ARGV[4])
+  redis.call('pexpire', KEYS[3], ARGV[5])
+end
+return 0
+"""
+RENEW_USER_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+# KEYS: lock, waiters hash. ARGV: token, release flag. Drains the waiters
+# while still holding the lock, releasing it in the same step when asked, so
+# a request parked concurrently is either drained here or takes the lock.
+DRAIN_USER_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+  return {}
+end
+local waiters = redis.call('hvals', KEYS[2])
+redis.call('del', KEYS[2])
+if ARGV[2] == '1' then
+  redis.call('del', KEYS[1])
+end
+return waiters
+"""
 
 
 class BroadcastProcessorService:
+    message_cache_size = 1024
+
     def __init__(
         self, userbot_service: UserbotService, queue_service: BroadcastQueueService
     ):
         self.userbot_service = userbot_service
         self.queue_service = queue_service
         self.logger = logging.getLogger("broadcast_processor_service")
+        self.due_index = CampaignDueIndex()
+        self.fair_share = FairShareService()
+        # Set when the worker shuts down; actors hand their campaign back to the queue.
+        self.stopping = asyncio.Event()
+        self.actor = CampaignActor(userbot_service, self.stopping)
+        # Message text per (config id, version); a version's text never changes.
+        self._message_cache: OrderedDict[tuple[int, int], str] = OrderedDict()
+
+    def begin_drain(self) -> None:
+        """Wind running jobs down: lanes stop claiming and actors return at once.
+
+        Each job still finishes the sends in hand, releases what it claimed
+        and queues its continuation, so another worker resumes the campaign.
+        """
+        self.stopping.set()
+        self.userbot_service.draining.set()
+
+    @staticmethod
+    def user_lock_ttl_ms() -> int:
+        return max(3000, int(settings.broadcast_user_lock_ttl_ms))
+
+    def user_waiters_ttl_ms(self) -> int:
+        # Outlives a crashed holder until arq retries its job (after the job
+        # timeout) or another run of the user takes the lock and drains them.
+        return max(60000, self.user_lock_ttl_ms() * 4, job_timeout_s() * 1000 + 60000)
+
+    async def acquire_user_lock(
+        self, user_id: str, token: str, waiter: dict | None = None
+    ) -> int:
+        """Take the user's lease; returns its fencing token, or 0 if it is held.
 
-    async def acquire_user_lock(self, user_id: str, token: str) -> bool:
-        key = f"broadcast:user-lock:{user_id}"
-        maybe_result = redis_client.set(
-            key, token, px=max(60000, settings.broadcast_user_lock_ttl_ms), nx=True
+        With ``waiter`` the request is parked for the current holder in the
+        same atomic step, instead of being retried by the caller.
+        """
+        floor = ""
+        while True:
+            maybe_result = redis_client.eval(
+                ACQUIRE_USER_LOCK_SCRIPT,
+                3,
+                f"{USER_LOCK_KEY_PREFIX}{user_id}",
+                f"{USER_LOCK_FENCE_KEY_PREFIX}{user_id}",
+                f"{USER_LOCK_WAITERS_KEY_PREFIX}{user_id}",
+                token,
+                self.user_lock_ttl_ms(),
+                str(waiter.get("campaignId") or "") if waiter else "",
+                json.dumps(waiter) if waiter else "",
+                self.user_waiters_ttl_ms(),
+                floor,
+            )
+            if inspect.isawaitable(maybe_result):
+                result = await maybe_result
+            else:
+                result = maybe_result
+            if int(result or 0) >= 0 or floor != "":
+                return max(0, int(result or 0))
+            await inc_metric(metric_key("processor.lock.fence_reseeded", service="processor"))
+            floor = str(await self.persisted_fence(user_id))
+
+    @staticmethod
+    async def persisted_fence(user_id: str) -> int:
+        """Highest fencing token stamped on any of the user's attempts."""
+        async with db_session() as db:
+            fence = (
+                await db.execute(
+                    select(func.max(BroadcastAttempt.claim_fence)).where(
+                        BroadcastAttempt.user_id == str(user_id)
+                    )
+                )
+            ).scalar()
+        return int(fence or 0)
+
+    async def renew_user_lock(self, user_id: str, token: str) -> bool:
+        result = redis_client.eval(
+            RENEW_USER_LOCK_SCRIPT,
+            1,
+            f"{USER_LOCK_KEY_PREFIX}{user_id}",
+            token,
+            self.user_lock_ttl_ms(),
         )
-        if inspect.isawaitable(maybe_result):
-            result = await maybe_result
-        else:
-            result = maybe_result
+        if inspect.isawaitable(result):
+            result = await result
         return bool(result)
 
-    async def release_user_lock(self, user_id: str, token: str) -> None:
-        key = f"broadcast:user-lock:{user_id}"
-        script = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
-        result = redis_client.eval(script, 1, key, token)
+    async def hold_user_lock(self, user_id: str, token: str, lost: asyncio.Event) -> None:
+        """Heartbeat the lease every third of its TTL; set ``lost`` once it lapses."""
+        ttl_ms = self.user_lock_ttl_ms()
+        deadline = asyncio.get_running_loop().time() + ttl_ms / 1000
+        while True:
+            await asyncio.sleep(ttl_ms / 3000)
+            try:
+                renewed = await self.renew_user_lock(user_id, token)
+            except Exception:
+                # Transient Redis errors are retried until the lease would have expired.
+                renewed = None
+            now = asyncio.get_running_loop().time()
+            if renewed:
+                deadline = now + ttl_ms / 1000
+                continue
+            if renewed is False or now >= deadline:
+                lost.set()
+                await inc_metric(metric_key("processor.lock.lost", service="processor"))
+                log_event(self.logger, logging.WARNING, "broadcast_user_lock_lost", user_id=user_id)
+                return
+
+    async def drain_user_waiters(
+        self, user_id: str, token: str, release: bool = False
+    ) -> list[dict]:
+        result = redis_client.eval(
+            DRAIN_USER_LOCK_SCRIPT,
+            2,
+            f"{USER_LOCK_KEY_PREFIX}{user_id}",
+            f"{USER_LOCK_WAITERS_KEY_PREFIX}{user_id}",
+            token,
+            "1" if release else "0",
+        )
         if inspect.isawaitable(result):
-            await result
+            result = await result
+        waiters = []
+        for raw in result or []:
+            try:
+                waiters.append(json.loads(raw))
+            except (TypeError, ValueError):
+                continue
+        return waiters
+
+    async def release_user_lock(self, user_id: str, token: str) -> list[dict]:
+        """Release the lease, returning requests that were parked behind it."""
+        return await self.drain_user_waiters(user_id, token, release=True)
+
+    async def park_user_waiters(self, user_id: str, waiters: list[dict]) -> None:
+        """Put drained requests back for the next holder, e.g. when handing off failed."""
+        key = f"{USER_LOCK_WAITERS_KEY_PREFIX}{user_id}"
+        await redis_client.hset(
+            key,
+            mapping={str(waiter.get("campaignId") or ""): json.dumps(waiter) for waiter in waiters},
+        )
+        await redis_client.pexpire(key, self.user_waiters_ttl_ms())
+
+    async def release_and_hand_off(
+        self,
+        user_id: str,
+        token: str,
+        campaign_id: str,
+        config_version: int | None,
+        message: str,
+        cycle_anchor: datetime | None = None,
+    ) -> None:
+        """Release the lease and pass on parked requests; never raises."""
+        try:
+            waiters = await self.release_user_lock(user_id, token) or []
+        except Exception:
+            # Waiters stay parked and the lease lapses; the next holder drains them.
+            await inc_metric(metric_key("processor.lock.release_failed", service="processor"))
+            self.logger.warning("user lock release failed user_id=%s", user_id)
+            return
+        await self.hand_off_waiters(
+            user_id, waiters, campaign_id, config_version, message, cycle_anchor
+        )
+
+    async def hand_off_waiters(
+        self,
+        user_id: str,
+        waiters: list[dict],
+        campaign_id: str,
+        config_version: int | None,
+        message: str,
+        cycle_anchor: datetime | None = None,
+    ) -> int:
+        """Absorb waiters the finished run already covered; queue one follow-on for the rest.
+
+        A waiter is covered when it is for the same campaign and config and
+        was queued no later than the run's ``cycle_anchor``; a later cycle
+        that arrived while the run overran gets its own follow-on. Waiters
+        whose follow-on cannot be queued are parked again.
+        """
+        handed_off = 0
+        failed: list[dict] = []
+        for waiter in waiters:
+            waiter_queued_dt = self.parse_iso(waiter.get("queuedAt") or "")
+            same_run = (
+                str(waiter.get("campaignId") or "") == str(campaign_id)
+                and (
+                    waiter.get("configVersion") == config_version
+                    if "configVersion" in waiter
+                    else str(waiter.get("message", "")) == str(message)
+                )
+                and (
+                    cycle_anchor is None
+                    or waiter_queued_dt is None
+                    or waiter_queued_dt <= cycle_anchor
+                )
+            )
+            if same_run:
+                await inc_metric(metric_key("processor.lock_waiters.absorbed", service="processor"))
+                continue
+            interval_seconds = int(waiter.get("intervalSeconds") or 0)
+            try:
+                await self.queue_service.enqueue_continuation(
+                    user_id=user_id,
+                    message=waiter.get("message"),
+                    campaign_id=str(waiter.get("campaignId") or ""),
+                    queued_at=str(waiter.get("queuedAt") or self.utcnow_naive().isoformat()),
+                    interval_seconds=interval_seconds if interval_seconds > 0 else None,
+                    delay_ms=0,
+                    priority_class=PRIORITY_RETRY,
+                    config_version=waiter.get("configVersion"),
+                )
+            except Exception:
+                failed.append(waiter)
+                continue
+            await inc_metric(metric_key("processor.lock_waiters.handed_off", service="processor"))
+            handed_off += 1
+        if failed:
+            await inc_metric(
+                metric_key("processor.lock_waiters.reparked", service="processor"), len(failed)
+            )
+            try:
+                await self.park_user_waiters(user_id, failed)
+            except Exception:
+                self.logger.error(
+                    "user lock waiters lost user_id=%s campaign_ids=%s",
+                    user_id,
+                    [str(waiter.get("campaignId") or "") for waiter in failed],
+                )
+        return handed_off
+
+    async def resolve_message(self, config_id: int, version: int) -> str:
+        key = (config_id, version)
+        cached = self._message_cache.get(key)
+        if cached is not None:
+            self._message_cache.move_to_end(key)
+            await inc_metric(metric_key("processor.message_cache.hit", service="processor"))
+            return cached
+        await inc_metric(metric_key("processor.message_cache.miss", service="processor"))
+        async with db_session() as db:
+            message = (
+                await db.execute(select(BroadcastConfig.message).where(BroadcastConfig.id == config_id))
+            ).scalar()
+        message = message or ""
+        self._message_cache[key] = message
+        while len(self._message_cache) > max(1, self.message_cache_size):
+            self._message_cache.popitem(last=False)
+        return message
+
+    @staticmethod
+    def actor_mode() -> bool:
+        return settings.broadcast_execution_mode.strip().lower() == "actor"
 
     @staticmethod
     def resolve_cycle_anchor(queued_dt: datetime | None, started_at: datetime) -> datetime:
         return queued_dt if queued_dt is not None else started_at
 
+    @staticmethod
+    def parse_iso(value: str) -> datetime | None:
+        try:
+            normalized = str(value).replace("Z", "+00:00")
+            dt = datetime.fromisoformat(normalized)
+            return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
+        except Exception:
+            return None
+
     @staticmethod
     def utcnow_naive() -> datetime:
         return datetime.now(UTC).replace(tzinfo=None)
@@ -65,6 +363,8 @@ class BroadcastProcessorService:
 
         user_id = str(payload.get("userId"))
         message = payload.get("message", "")
+        payload_version = payload.get("configVersion")
+        config_version: int | None = None
         campaign_id = payload.get("campaignId", "")
         queued_at = str(payload.get("queuedAt") or self.utcnow_naive().isoformat())
         payload_interval_seconds = int(payload.get("intervalSeconds") or 0)
@@ -79,15 +379,7 @@ class BroadcastProcessorService:
         )
         await inc_metric(metric_key("processor.started", service="processor"))
 
-        def parse_iso(value: str) -> datetime | None:
-            try:
-                normalized = str(value).replace("Z", "+00:00")
-                dt = datetime.fromisoformat(normalized)
-                return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
-            except Exception:
-                return None
-
-        queued_dt = parse_iso(queued_at)
+        queued_dt = self.parse_iso(queued_at)
         lag_ms = 0
         if queued_dt is not None:
             lag_ms = max(0, int((started_at - queued_dt).total_seconds() * 1000))
@@ -97,7 +389,9 @@ class BroadcastProcessorService:
                 cfg = (
                     (
                         await db.execute(
-                            select(BroadcastConfig).where(
+                            select(BroadcastConfig)
+                            .options(defer(BroadcastConfig.message))
+                            .where(
                                 BroadcastConfig.user_id == user_id,
                                 BroadcastConfig.id == campaign_db_id,
                             )
@@ -119,7 +413,15 @@ class BroadcastProcessorService:
                     "lagMs": lag_ms,
                 }
 
-            if (cfg.message or "") != str(message):
+            config_version = int(cfg.version or 1)
+            if payload_version is not None:
+                is_stale = int(payload_version) != config_version
+            else:
+                # Payloads queued before config versions carry the text itself.
+                is_stale = await self.resolve_message(campaign_db_id, config_version) != str(
+                    message
+                )
+            if is_stale:
                 return {
                     "success": True,
                     "count": 0,
@@ -146,20 +448,64 @@ class BroadcastProcessorService:
                     "lagMs": lag_ms,
                 }
 
+            message = await self.resolve_message(campaign_db_id, config_version)
+
+        # Follow-ups reference the config the same way the scheduler does.
+        follow_up_message = message if config_version is None else None
+        attempt_budget = max(1, settings.broadcast_attempts_per_job)
+        credit: int | None = None
+        if settings.broadcast_fair_share_enabled:
+            credit = await self.fair_share.admit(user_id)
+            if credit <= 0:
+                retry_delay = self.queue_service.continuation_delay_ms()
+                await self.queue_service.enqueue_continuation(
+                    user_id=user_id,
+                    message=follow_up_message,
+                    campaign_id=campaign_id,
+                    queued_at=queued_at,
+                    interval_seconds=payload_interval_seconds
+                    if payload_interval_seconds > 0
+                    else None,
+                    delay_ms=retry_delay,
+                    config_version=config_version,
+                )
+                await inc_metric(metric_key("processor.fair_share.deferred", service="processor"))
+                log_event(
+                    self.logger,
+                    logging.INFO,
+                    "broadcast_process_fair_share_deferred",
+                    user_id=user_id,
+                    campaign_id=campaign_id,
+                    retry_delay_ms=retry_delay,
+                )
+                return {
+                    "success": True,
+                    "count": 0,
+                    "errors": [],
+                    "outcome": "fair-share-deferred",
+                    "continuationEnqueued": True,
+                    "continuationDelayMs": retry_delay,
+                    "continuationReason": "fair-share",
+                    "scheduledAt": queued_at,
+                    "startedAt": started_at.isoformat(),
+                    "lagMs": lag_ms,
+                }
+            attempt_budget = min(attempt_budget, credit)
+
         token = f"{campaign_id}-{random.randint(10000, 99999)}"
-        lock = await self.acquire_user_lock(user_id, token)
-        if not lock:
-            retry_delay = max(2000, self.queue_service.continuation_delay_ms())
-            await self.queue_service.enqueue_send(
-                user_id=user_id,
-                message=message,
-                campaign_id=campaign_id,
-                queued_at=queued_at,
-                interval_seconds=payload_interval_seconds
-                if payload_interval_seconds > 0
-                else None,
-                delay_ms=retry_delay,
-            )
+        waiter = {
+            "userId": user_id,
+            "campaignId": campaign_id,
+            "queuedAt": queued_at,
+            "intervalSeconds": payload_interval_seconds or None,
+        }
+        if config_version is not None:
+            waiter["configVersion"] = config_version
+        else:
+            waiter["message"] = message
+        fence = await self.acquire_user_lock(user_id, token, waiter=waiter)
+        if not fence:
+            # Parked for the holder, which runs or absorbs it before releasing.
             await inc_metric(metric_key("processor.lock_busy", service="processor"))
             log_event(
                 self.logger,
@@ -167,7 +513,6 @@ class BroadcastProcessorService:
                 "broadcast_process_lock_busy",
                 user_id=user_id,
                 campaign_id=campaign_id,
-                retry_delay_ms=retry_delay,
             )
             return {
                 "success": True,
@@ -175,28 +520,47 @@ class BroadcastProcessorService:
                 "errors": [],
                 "error": "user-lock-busy",
                 "outcome": "lock-busy",
-                "continuationEnqueued": True,
-                "continuationDelayMs": retry_delay,
-                "continuationReason": "lock-busy-retry",
+                "continuationEnqueued": False,
+                "waiterQueued": True,
+                "continuationReason": "lock-waiter",
                 "scheduledAt": queued_at,
                 "startedAt": started_at.isoformat(),
                 "lagMs": lag_ms,
             }
 
+        # Waiters, including any left by a holder that died, stay in Redis
+        # until the release drains them atomically, so a crash loses none.
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self.hold_user_lock(user_id, token, lease_lost))
         try:
-            result = await self.userbot_service.broadcast_message(
-                user_id=int(user_id),
-                message_text=message,
-                campaign_id=campaign_id,
-                queued_at=queued_at,
-                max_attempts_per_run=max(1, settings.broadcast_attempts_per_job),
-            )
+            if self.actor_mode():
+                result = await self.actor.run(
+                    user_id=int(user_id),
+                    message_text=message,
+                    campaign_id=campaign_id,
+                    queued_at=queued_at,
+                    attempts_per_slice=max(1, settings.broadcast_attempts_per_job),
+                    run_budget=credit,
+                    fence=int(fence),
+                    lease_lost=lease_lost,
+                )
+            else:
+                result = await self.userbot_service.broadcast_message(
+                    user_id=int(user_id),
+                    message_text=message,
+                    campaign_id=campaign_id,
+                    queued_at=queued_at,
+                    max_attempts_per_run=attempt_budget,
+                    fence=int(fence),
+                    lease_lost=lease_lost,
+                )
             continuation_enqueued = False
             continuation_delay_ms = None
             continuation_reason = None
 
             if campaign_db_id is not None and int(result.count or 0) > 0:
                 cycle_anchor = self.resolve_cycle_anchor(queued_dt, started_at)
+                next_run_at = cycle_anchor + timedelta(seconds=max(60, int(cfg.interval or 60)))
                 async with db_session() as db:
                     await db.execute(
                         update(BroadcastConfig)
@@ -208,8 +572,17 @@ class BroadcastProcessorService:
                                 BroadcastConfig.last_run_at < cycle_anchor,
                             ),
                         )
-                        .values(last_run_at=cycle_anchor)
+                        .values(
+                            last_run_at=cycle_anchor,
+                            next_run_at=func.greatest(
+                                func.coalesce(BroadcastConfig.next_run_at, next_run_at),
+                                next_run_at,
+                            ),
+                        )
                     )
+                await self.due_index.schedule(
+                    campaign_db_id, user_id, next_run_at, only_later=True
+                )
 
             if not result.success:
                 summary = result.summary or {}
@@ -236,20 +609,32 @@ class BroadcastProcessorService:
                         else:
                             delay = max(5000, self.queue_service.continuation_delay_ms() * 3)
                         continuation_reason = "default-deferred"
-                    await self.queue_service.enqueue_send(
+                    pacing_delay_ms = int(summary.get("accountPacingDelayMs", 0) or 0)
+                    if ready_pending_count > 0 and pacing_delay_ms > delay:
+                        # Ready work is only waiting on account pacing; come back when a slot frees.
+                        delay = pacing_delay_ms
+                        continuation_reason = "account-pacing"
+                    await self.queue_service.enqueue_continuation(
                         user_id=user_id,
-                        message=message,
+                        message=follow_up_message,
                         campaign_id=campaign_id,
                         queued_at=queued_at,
                         interval_seconds=payload_interval_seconds
                         if payload_interval_seconds > 0
                         else None,
                         delay_ms=delay,
+                        config_version=config_version,
                     )
                     continuation_enqueued = True
                     continuation_delay_ms = delay
 
             summary = result.summary or {}
+            if settings.broadcast_fair_share_enabled:
+                await self.fair_share.settle(
+                    user_id,
+                    used=int(summary.get("attemptsThisRun", 0) or 0),
+                    next_job_in_ms=continuation_delay_ms if continuation_enqueued else None,
+                )
             failed = int(summary.get("failed", 0) or 0)
             sent_count = int(result.count or 0)
             pending = int(summary.get("pending", 0) or 0)
@@ -316,6 +701,9 @@ class BroadcastProcessorService:
                 "lagMs": lag_ms,
             }
         finally:
+            heartbeat.cancel()
+            # Wait it out so no renewal can land after the release below.
+            await asyncio.gather(heartbeat, return_exceptions=True)
             log_event(
                 self.logger,
                 logging.INFO,
@@ -323,4 +711,11 @@ class BroadcastProcessorService:
                 user_id=user_id,
                 campaign_id=campaign_id,
             )
-            await self.release_user_lock(user_id, token)
+            await self.release_and_hand_off(
+                user_id,
+                token,
+                campaign_id,
+                config_version,
+                message,
+                self.resolve_cycle_anchor(queued_dt, started_at),
+            )
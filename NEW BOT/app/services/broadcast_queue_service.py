@@ -2,19 +2,181 @@ import asyncio
 import logging
 import random
 import uuid
+from dataclasses import dataclass
 
 from arq import create_pool
 from arq.connections import RedisSettings
+from arq.constants import (
+    default_queue_name,
+    in_progress_key_prefix,
+    job_key_prefix,
+    result_key_prefix,
+)
+from arq.jobs import serialize_job
+from arq.utils import timestamp_ms
 
 from app.config import settings
 from app.logging_utils import log_event
 from app.metrics import inc_metric, metric_key, set_gauge_metric
+from app.services.worker_routing import WorkerRouter
+from app.utils import parse_weight_map
+
+JOB_FUNCTION = "process_broadcast_job"
+
+# Fresh scheduled runs keep arq's default queue; follow-ups get their own so a
+# retry storm cannot delay the first send of a newly due campaign.
+PRIORITY_SCHEDULED = "scheduled"
+PRIORITY_CONTINUATION = "continuation"
+PRIORITY_RETRY = "retry"
+PRIORITY_CLASSES = (PRIORITY_SCHEDULED, PRIORITY_CONTINUATION, PRIORITY_RETRY)
+
+
+def queue_name_for(priority_class: str) -> str:
+    if priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"unknown priority class: {priority_class}")
+    if priority_class == PRIORITY_SCHEDULED:
+        return default_queue_name
+    return f"{default_queue_name}:{priority_class}"
+
+
+def job_timeout_s() -> int:
+    """arq job timeout; an actor-mode job may keep its campaign for broadcast_actor_max_run_ms."""
+    return max(300, settings.broadcast_actor_max_run_ms // 1000 + 60)
+
+
+def class_weights(raw: str | None = None) -> dict[str, int]:
+    """Parse ``class:weight`` pairs; classes left out default to weight 1."""
+    parsed = parse_weight_map(settings.broadcast_queue_class_weights if raw is None else raw)
+    return {priority_class: parsed.get(priority_class, 1) for priority_class in PRIORITY_CLASSES}
+
+# Bulk form of arq's enqueue_job: KEYS[1] is the queue, then a job key and a
+# result key per job; ARGV holds job id, score, expiry ms and the serialized
+# job per job. A job is skipped (0) when either key exists, which is the same
+# dedupe arq applies, and written with PSETEX + ZADD (1) otherwise.
+ENQUEUE_MANY_SCRIPT = """
+local results = {}
+local job_count = (#KEYS - 1) / 2
+for i = 1, job_count do
+  local job_key = KEYS[2 * i]
+  local result_key = KEYS[2 * i + 1]
+  local base = (i - 1) * 4
+  if redis.call('EXISTS', job_key, result_key) == 0 then
+    redis.call('PSETEX', job_key, ARGV[base + 3], ARGV[base + 4])
+    redis.call('ZADD', KEYS[1], ARGV[base + 2], ARGV[base + 1])
+    results[i] = 1
+  else
+    results[i] = 0
+  end
+end
+return results
+"""
+
+
+CONTINUATION_MARKER_KEY_PREFIX = "broadcast:continuation:"
+
+# At most one pending continuation per (user, campaign). KEYS: queue, marker,
+# new job key, new result key. ARGV: new job id, score, now ms, expires extra
+# ms, serialized job, job key prefix, in-progress key prefix, shared class
+# queue. The marker holds "<queue>|<job id>"; the job is looked up there and
+# in the shared queue, where a dead or departed worker's jobs are moved. If it
+# is still queued and not yet running, its payload is replaced and its score
+# only ever moves earlier, in whichever queue it sits; otherwise a new job is
+# written to KEYS[1] and the marker repointed. Returns {created, job id, score}.
+ENQUEUE_CONTINUATION_SCRIPT = """
+local current = redis.call('GET', KEYS[2])
+local score = tonumber(ARGV[2])
+local now_ms = tonumber(ARGV[3])
+local extra_ms = tonumber(ARGV[4])
+if current then
+  local current_queue, current_id = string.match(current, '^(.*)|(.*)$')
+  if not current_id then
+    current_queue, current_id = KEYS[1], current
+  end
+  local queue = nil
+  local current_score = nil
+  for _, candidate in ipairs({current_queue, ARGV[8]}) do
+    current_score = redis.call('ZSCORE', candidate, current_id)
+    if current_score then
+      queue = candidate
+      break
+    end
+  end
+  local current_job_key = ARGV[6] .. current_id
+  if queue and redis.call('EXISTS', current_job_key) == 1
+      and redis.call('EXISTS', ARGV[7] .. current_id) == 0 then
+    current_score = tonumber(current_score)
+    if score < current_score then
+      redis.call('ZADD', queue, score, current_id)
+    else
+      score = current_score
+    end
+    local ttl = math.max(1, score - now_ms) + extra_ms
+    redis.call('PSETEX', current_job_key, ttl, ARGV[5])
+    redis.call('SET', KEYS[2], queue .. '|' .. current_id, 'PX', ttl)
+    return {0, current_id, tostring(score)}
+  end
+end
+local ttl = math.max(1, score - now_ms) + extra_ms
+redis.call('PSETEX', KEYS[3], ttl, ARGV[5])
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+redis.call('SET', KEYS[2], KEYS[1] .. '|' .. ARGV[1], 'PX', ttl)
+return {1, ARGV[1], tostring(score)}
+"""
+
+# Depth, ready count and oldest ready score over KEYS (queues). ARGV: now ms,
+# in-progress key prefix. arq keeps a running job in its queue until it
+# finishes, so jobs with an in-progress key count towards depth only; the
+# oldest score is -1 when nothing is ready.
+QUEUE_STATS_SCRIPT = """
+local depth = 0
+local ready = 0
+local oldest = -1
+for _, queue in ipairs(KEYS) do
+  depth = depth + redis.call('ZCARD', queue)
+  local due = redis.call('ZRANGEBYSCORE', queue, '-inf', ARGV[1], 'WITHSCORES')
+  for i = 1, #due, 2 do
+    if redis.call('EXISTS', ARGV[2] .. due[i]) == 0 then
+      ready = ready + 1
+      local score = tonumber(due[i + 1])
+      if oldest < 0 or score < oldest then
+        oldest = score
+      end
+    end
+  end
+end
+return {depth, ready, tostring(oldest)}
+"""
+
+
+@dataclass
+class QueueStats:
+    depth: int
+    ready: int
+    oldest_ready_lag_ms: int
+
+
+@dataclass
+class EnqueueSpec:
+    user_id: str
+    message: str | None
+    campaign_id: str
+    queued_at: str
+    interval_seconds: int | None = None
+    delay_ms: int = 0
+    job_id: str | None = None
+    config_version: int | None = None
 
 
 class BroadcastQueueService:
+    enqueue_batch_size = 500
+
     def __init__(self):
         self.redis_pool = None
         self.logger = logging.getLogger("broadcast_queue_service")
+        self._enqueue_many_script = None
+        self._enqueue_continuation_script = None
+        self._queue_stats_script = None
+        self.router = WorkerRouter()
 
     async def get_pool(self):
         if self.redis_pool is None:
@@ -24,27 +186,26 @@ class BroadcastQueueService:
     async def enqueue_send(
         self,
         user_id: str,
-        message: str,
+        message: str | None,
         campaign_id: str,
         queued_at: str,
         interval_seconds: int | None = None,
         delay_ms: int = 0,
         job_id: str | None = None,
+        priority_class: str = PRIORITY_SCHEDULED,
+        config_version: int | None = None,
     ) -> str | None:
         pool = await self.get_pool()
-        resolved_job_id = job_id or f"bc-{campaign_id}-{uuid.uuid4().hex[:10]}"
+        resolved_job_id = job_id or self.new_job_id(campaign_id)
         _defer_by = delay_ms / 1000 if delay_ms > 0 else None
         queued = await pool.enqueue_job(
-            "process_broadcast_job",
-            {
-                "userId": user_id,
-                "message": message,
-                "campaignId": campaign_id,
-                "queuedAt": queued_at,
-                "intervalSeconds": int(interval_seconds) if interval_seconds is not None else None,
-            },
+            JOB_FUNCTION,
+            self.build_payload(
+                user_id, message, campaign_id, queued_at, interval_seconds, config_version
+            ),
             _defer_by=_defer_by,
             _job_id=resolved_job_id,
+            _queue_name=await self.router.queue_for(user_id, queue_name_for(priority_class)),
         )
         if queued is None:
             await inc_metric(metric_key("queue.enqueue.result", service="queue", outcome="duplicate"))
@@ -70,13 +231,269 @@ class BroadcastQueueService:
         )
         return resolved_job_id
 
+    @staticmethod
+    def new_job_id(campaign_id: str) -> str:
+        return f"bc-{campaign_id}-{uuid.uuid4().hex[:10]}"
+
+    @staticmethod
+    def build_payload(
+        user_id: str,
+        message: str | None,
+        campaign_id: str,
+        queued_at: str,
+        interval_seconds: int | None = None,
+        config_version: int | None = None,
+    ) -> dict:
+        payload = {
+            "userId": user_id,
+            "campaignId": campaign_id,
+            "queuedAt": queued_at,
+            "intervalSeconds": int(interval_seconds) if interval_seconds is not None else None,
+        }
+        # Campaign jobs reference the config by version; the text is only
+        # carried when there is no stored config to resolve it from.
+        if config_version is not None:
+            payload["configVersion"] = int(config_version)
+        else:
+            payload["message"] = message or ""
+        return payload
+
+    @staticmethod
+    def build_enqueue_many_call(
+        specs: list[EnqueueSpec],
+        job_ids: list[str],
+        queue_name: str,
+        enqueue_time_ms: int,
+        expires_extra_ms: int,
+        serializer=None,
+    ) -> tuple[list[str], list]:
+        keys: list[str] = [queue_name]
+        args: list = []
+        for spec, job_id in zip(specs, job_ids):
+            score = enqueue_time_ms + max(0, int(spec.delay_ms))
+            keys.extend([job_key_prefix + job_id, result_key_prefix + job_id])
+            args.extend(
+                [
+                    job_id,
+                    score,
+                    score - enqueue_time_ms + expires_extra_ms,
+                    serialize_job(
+                        JOB_FUNCTION,
+                        (
+                            BroadcastQueueService.build_payload(
+                                spec.user_id,
+                                spec.message,
+                                spec.campaign_id,
+                                spec.queued_at,
+                                spec.interval_seconds,
+                                spec.config_version,
+                            ),
+                        ),
+                        {},
+                        None,
+                        enqueue_time_ms,
+                        serializer=serializer,
+                    ),
+                ]
+            )
+        return keys, args
+
+    async def enqueue_many(
+        self, specs: list[EnqueueSpec], priority_class: str = PRIORITY_SCHEDULED
+    ) -> list[str | None]:
+        """Enqueue several jobs with one script call per batch.
+
+        Returns the job id for each spec in order, or None where a job with
+        that id already exists (same dedupe as ``enqueue_send``).
+        """
+        if not specs:
+            return []
+        pool = await self.get_pool()
+        if self._enqueue_many_script is None:
+            self._enqueue_many_script = pool.register_script(ENQUEUE_MANY_SCRIPT)
+
+        base_queue = queue_name_for(priority_class)
+        by_queue: dict[str, list[int]] = {}
+        for index, spec in enumerate(specs):
+            queue_name = await self.router.queue_for(spec.user_id, base_queue)
+            by_queue.setdefault(queue_name, []).append(index)
+
+        results: list[str | None] = [None] * len(specs)
+        batch_size = max(1, int(self.enqueue_batch_size))
+        for queue_name, indexes in by_queue.items():
+            for start in range(0, len(indexes), batch_size):
+                chunk = indexes[start : start + batch_size]
+                batch = [specs[index] for index in chunk]
+                job_ids = [spec.job_id or self.new_job_id(spec.campaign_id) for spec in batch]
+                keys, args = self.build_enqueue_many_call(
+                    batch,
+                    job_ids,
+                    queue_name=queue_name,
+                    enqueue_time_ms=timestamp_ms(),
+                    expires_extra_ms=pool.expires_extra_ms,
+                    serializer=pool.job_serializer,
+                )
+                flags = await self._enqueue_many_script(keys=keys, args=args)
+                for index, job_id, flag in zip(chunk, job_ids, flags):
+                    results[index] = job_id if int(flag) == 1 else None
+
+        queued_count = sum(1 for job_id in results if job_id is not None)
+        duplicate_count = len(results) - queued_count
+        if queued_count:
+            await inc_metric(
+                metric_key("queue.enqueue.result", service="queue", outcome="success"), queued_count
+            )
+            await set_gauge_metric(
+                metric_key("queue.last_enqueue_delay_ms", service="queue"),
+                int(specs[-1].delay_ms),
+            )
+        if duplicate_count:
+            await inc_metric(
+                metric_key("queue.enqueue.result", service="queue", outcome="duplicate"),
+                duplicate_count,
+            )
+        log_event(
+            self.logger,
+            logging.INFO,
+            "broadcast_enqueued_batch",
+            requested=len(specs),
+            queued=queued_count,
+            duplicates=duplicate_count,
+        )
+        return results
+
+    @staticmethod
+    def continuation_marker_key(user_id: str, campaign_id: str) -> str:
+        return f"{CONTINUATION_MARKER_KEY_PREFIX}{user_id}:{campaign_id}"
+
+    async def enqueue_continuation(
+        self,
+        user_id: str,
+        message: str | None,
+        campaign_id: str,
+        queued_at: str,
+        interval_seconds: int | None = None,
+        delay_ms: int = 0,
+        priority_class: str = PRIORITY_CONTINUATION,
+        config_version: int | None = None,
+    ) -> str:
+        """Enqueue a follow-up run, coalesced with any pending one for the same campaign.
+
+        Returns the id of the job that will run: a new one, or the already
+        queued one whose run time was moved earlier if ``delay_ms`` asks for it.
+        """
+        pool = await self.get_pool()
+        if self._enqueue_continuation_script is None:
+            self._enqueue_continuation_script = pool.register_script(ENQUEUE_CONTINUATION_SCRIPT)
+
+        spec = EnqueueSpec(
+            user_id=user_id,
+            message=message,
+            campaign_id=campaign_id,
+            queued_at=queued_at,
+            interval_seconds=interval_seconds,
+            delay_ms=delay_ms,
+            config_version=config_version,
+        )
+        job_id = self.continuation_job_id(user_id, campaign_id)
+        shared_queue_name = queue_name_for(priority_class)
+        queue_name = await self.router.queue_for(user_id, shared_queue_name)
+        enqueue_time_ms = timestamp_ms()
+        job_keys, job_args = self.build_enqueue_many_call(
+            [spec],
+            [job_id],
+            queue_name=queue_name,
+            enqueue_time_ms=enqueue_time_ms,
+            expires_extra_ms=pool.expires_extra_ms,
+            serializer=pool.job_serializer,
+        )
+        created, resolved_job_id, _score = await self._enqueue_continuation_script(
+            keys=[
+                queue_name,
+                self.continuation_marker_key(user_id, campaign_id),
+                *job_keys[1:],
+            ],
+            args=[
+                job_id,
+                job_args[1],
+                enqueue_time_ms,
+                pool.expires_extra_ms,
+                job_args[3],
+                job_key_prefix,
+                in_progress_key_prefix,
+                shared_queue_name,
+            ],
+        )
+        if isinstance(resolved_job_id, bytes):
+            resolved_job_id = resolved_job_id.decode()
+        outcome = "created" if int(created) == 1 else "coalesced"
+        await inc_metric(
+            metric_key(
+                "queue.continuation.result",
+                service="queue",
+                outcome=outcome,
+                queue=priority_class,
+            )
+        )
+        log_event(
+            self.logger,
+            logging.INFO,
+            "broadcast_continuation_enqueued",
+            user_id=user_id,
+            campaign_id=campaign_id,
+            job_id=resolved_job_id,
+            delay_ms=delay_ms,
+            outcome=outcome,
+            priority_class=priority_class,
+        )
+        return str(resolved_job_id)
+
+    async def queue_stats(self, priority_class: str = PRIORITY_SCHEDULED) -> QueueStats:
+        """Depth of a class's arq queues, jobs already past their run time and the oldest one's lag.
+
+        Counts the shared class queue together with every live worker's queue.
+        Jobs that are already running are not ready, however long they take.
+        """
+        pool = await self.get_pool()
+        if self._queue_stats_script is None:
+            self._queue_stats_script = pool.register_script(QUEUE_STATS_SCRIPT)
+        queue_names = await self.router.class_queues(queue_name_for(priority_class))
+        now_ms = timestamp_ms()
+        depth, ready, oldest = await self._queue_stats_script(
+            keys=queue_names, args=[now_ms, in_progress_key_prefix]
+        )
+        oldest = int(float(oldest))
+        stats = QueueStats(
+            depth=int(depth),
+            ready=int(ready),
+            oldest_ready_lag_ms=max(0, now_ms - oldest) if oldest >= 0 else 0,
+        )
+        await set_gauge_metric(
+            metric_key("queue.depth", service="queue", queue=priority_class), stats.depth
+        )
+        await set_gauge_metric(
+            metric_key("queue.ready", service="queue", queue=priority_class), stats.ready
+        )
+        await set_gauge_metric(
+            metric_key("queue.oldest_ready_lag_ms", service="queue", queue=priority_class),
+            stats.oldest_ready_lag_ms,
+        )
+        return stats
+
+    async def queue_stats_by_class(self) -> dict[str, QueueStats]:
+        return {
+            priority_class: await self.queue_stats(priority_class)
+            for priority_class in PRIORITY_CLASSES
+        }
+
     @staticmethod
     def scheduled_job_id(user_id: str, campaign_id: str, run_slot: int) -> str:
         return f"bc-sched-{campaign_id}-{user_id}-{run_slot}"
 
     @staticmethod
-    def continuation_job_id(user_id: str, campaign_id: str, due_slot_minute: int) -> str:
-        return f"bc-cont-{campaign_id}-{user_id}-{due_slot_minute}"
+    def continuation_job_id(user_id: str, campaign_id: str) -> str:
+        # Unique per follow-up: arq keeps result keys, so a reused id would be deduped.
+        return f"bc-cont-{campaign_id}-{user_id}-{uuid.uuid4().hex[:10]}"
 
     def continuation_delay_ms(self) -> int:
         jitter = random.randint(0, max(0, settings.broadcast_continuation_jitter_ms))
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+
+from app.config import settings
+from app.logging_utils import log_event
+from app.metrics import inc_metric, metric_key
+from app.services.userbot_service import BroadcastExecutionResult, UserbotService
+
+
+class CampaignActor:
+    """Runs a campaign cycle in-process instead of one queue job per slice.
+
+    Config, accounts and targets are loaded and seeded once; the actor then
+    sends slice after slice, sleeping until the next attempt is due or an
+    account pacing slot frees up. Attempt rows are flushed to Postgres after
+    every slice, so stopping at any point loses nothing: when the run budget
+    is spent, the next wait is too long to hold a worker slot, the lease is
+    lost or ``stopping`` is set, the actor returns and the caller queues a
+    continuation that resumes from the database.
+    """
+
+    def __init__(self, userbot_service: UserbotService, stopping: asyncio.Event):
+        self.userbot_service = userbot_service
+        self.stopping = stopping
+        self.logger = logging.getLogger("campaign_actor")
+
+    @staticmethod
+    def next_wait_ms(summary: dict) -> int | None:
+        """Wait before the next slice, or None when the cycle has nothing left."""
+        if int(summary.get("pending", 0) or 0) == 0 and int(summary.get("inFlight", 0) or 0) == 0:
+            return None
+        if int(summary.get("readyPendingCount", 0) or 0) > 0:
+            return int(summary.get("accountPacingDelayMs", 0) or 0)
+        next_due_ms = int(summary.get("nextDueInMs", 0) or 0)
+        if next_due_ms > 0:
+            return next_due_ms
+        return max(250, settings.broadcast_continuation_base_delay_ms)
+
+    async def run(
+        self,
+        user_id: int,
+        message_text: str,
+        campaign_id: str,
+        queued_at: str | None,
+        attempts_per_slice: int,
+        run_budget: int | None = None,
+        fence: int | None = None,
+        lease_lost: asyncio.Event | None = None,
+    ) -> BroadcastExecutionResult:
+        prepared = await self.userbot_service.prepare_broadcast(
+            user_id, message_text, campaign_id, queued_at, fence
+        )
+        if isinstance(prepared, BroadcastExecutionResult):
+            return prepared
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(1000, settings.broadcast_actor_max_run_ms) / 1000
+        max_idle_wait_ms = max(0, int(settings.broadcast_actor_max_idle_wait_ms))
+        sent = 0
+        attempts = 0
+        slices = 0
+        errors: list = []
+        stop_reason = "cycle-complete"
+        while True:
+            slice_budget = max(1, int(attempts_per_slice))
+            if run_budget is not None:
+                slice_budget = min(slice_budget, run_budget - attempts)
+            result = await self.userbot_service.run_broadcast_slice(
+                prepared, slice_budget, fence=fence, lease_lost=lease_lost
+            )
+            slices += 1
+            summary = result.summary or {}
+            slice_attempts = int(summary.get("attemptsThisRun", 0) or 0)
+            sent += int(result.count or 0)
+            attempts += slice_attempts
+            errors.extend(result.errors or [])
+            await inc_metric(metric_key("processor.actor.slice", service="processor"))
+
+            wait_ms = self.next_wait_ms(summary)
+            if result.error or wait_ms is None:
+                stop_reason = "cycle-complete" if not result.error else "error"
+                break
+            if lease_lost is not None and lease_lost.is_set():
+                stop_reason = "lease-lost"
+                break
+            if self.stopping.is_set():
+                stop_reason = "stopping"
+                break
+            if slice_attempts == 0:
+                # Nothing was claimable (e.g. rows held by another run); back off
+                # instead of re-querying in a tight loop.
+                wait_ms = max(wait_ms, max(250, settings.broadcast_continuation_base_delay_ms))
+            if run_budget is not None and attempts >= run_budget:
+                stop_reason = "budget"
+                break
+            if wait_ms > max_idle_wait_ms or loop.time() + wait_ms / 1000 >= deadline:
+                stop_reason = "long-wait"
+                break
+            try:
+                # Cooperative yield: other actors and jobs run while this one waits.
+                await asyncio.wait_for(self.stopping.wait(), timeout=wait_ms / 1000)
+                stop_reason = "stopping"
+                break
+            except asyncio.TimeoutError:
+                pass
+
+        summary = dict(summary)
+        summary["sentThisRun"] = sent
+        summary["attemptsThisRun"] = attempts
+        summary["actorSlices"] = slices
+        summary["actorStopReason"] = stop_reason
+        await inc_metric(
+            metric_key("processor.actor.stopped", service="processor", reason=stop_reason)
+        )
+        log_event(
+            self.logger,
+            logging.INFO,
+            "campaign_actor_stopped",
+            user_id=user_id,
+            campaign_id=campaign_id,
+            slices=slices,
+            sent=sent,
+            reason=stop_reason,
+        )
+        return BroadcastExecutionResult(
+            success=result.success,
+            count=sent,
+            errors=errors,
+            error=result.error,
+            summary=summary,
+        )
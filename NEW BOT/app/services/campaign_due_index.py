@@ -0,0 +1,233 @@
+import json
+import logging
+from collections.abc import Iterable, Sequence
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import select
+
+from app.db import db_session
+from app.logging_utils import log_event
+from app.metrics import inc_metric, metric_key
+from app.models import BroadcastConfig, TelegramAccount
+from app.redis_client import redis_client
+from app.services.scheduler_shards import (
+    shard_clause,
+    shard_count,
+    shard_for_user,
+)
+
+
+DUE_INDEX_KEY_PREFIX = "broadcast:due:"
+# Wakes the scheduler replica owning the user's shard: {"userId": ...}.
+CONFIG_EVENTS_CHANNEL = "broadcast:scheduler:config-events"
+
+
+class CampaignDueIndex:
+    """Per-shard Redis ZSETs of campaign ids scored by next due time (epoch ms).
+
+    The score is the later of the campaign's ``next_run_at`` and the
+    moment one of the user's accounts is usable again; campaigns that are
+    inactive or have no active account are left out. Writers keep it current
+    on config, run and account changes, and the scheduler rebuilds it from
+    the database periodically so a missed update is only ever temporary.
+    """
+
+    def __init__(self, key_prefix: str = DUE_INDEX_KEY_PREFIX):
+        self.logger = logging.getLogger("campaign_due_index")
+        self.key_prefix = key_prefix
+
+    def shard_key(self, shard: int) -> str:
+        return f"{self.key_prefix}{shard}"
+
+    def key_for_user(self, user_id: str) -> str:
+        return self.shard_key(shard_for_user(user_id))
+
+    @staticmethod
+    def utcnow_naive() -> datetime:
+        return datetime.now(UTC).replace(tzinfo=None)
+
+    @staticmethod
+    def to_epoch_ms(value: datetime) -> int:
+        return int(value.replace(tzinfo=UTC).timestamp() * 1000)
+
+    @staticmethod
+    def next_due_at(
+        last_run_at: datetime | None, interval_seconds: int, now: datetime
+    ) -> datetime:
+        if last_run_at is None:
+            return now
+        return last_run_at + timedelta(seconds=max(60, int(interval_seconds)))
+
+    @staticmethod
+    def account_available_at(
+        accounts: Iterable[TelegramAccount], now: datetime
+    ) -> datetime | None:
+        earliest: datetime | None = None
+        for account in accounts:
+            if (
+                not account.is_flood_wait
+                or account.flood_wait_until is None
+                or account.flood_wait_until <= now
+            ):
+                return now
+            if earliest is None or account.flood_wait_until < earliest:
+                earliest = account.flood_wait_until
+        return earliest
+
+    @staticmethod
+    def compute_due_at(
+        config: BroadcastConfig,
+        accounts: Sequence[TelegramAccount],
+        now: datetime,
+    ) -> datetime | None:
+        if not config.is_active or config.message is None or config.interval is None:
+            return None
+        available_at = CampaignDueIndex.account_available_at(accounts, now)
+        if available_at is None:
+            return None
+        due_at = config.next_run_at or CampaignDueIndex.next_due_at(
+            config.last_run_at, int(config.interval), now
+        )
+        return max(due_at, available_at)
+
+    async def _load_scores(
+        self, configs: Sequence[BroadcastConfig]
+    ) -> dict[str, tuple[str, int | None]]:
+        if not configs:
+            return {}
+        user_ids = {config.user_id for config in configs}
+        async with db_session() as db:
+            accounts = (
+                await db.execute(
+                    select(TelegramAccount).where(
+                        TelegramAccount.user_id.in_(user_ids),
+                        TelegramAccount.is_active.is_(True),
+                    )
+                )
+            ).scalars().all()
+        by_user: dict[str, list[TelegramAccount]] = {}
+        for account in accounts:
+            by_user.setdefault(account.user_id, []).append(account)
+
+        now = self.utcnow_naive()
+        scores: dict[str, tuple[str, int | None]] = {}
+        for config in configs:
+            due_at = self.compute_due_at(config, by_user.get(config.user_id, []), now)
+            scores[str(config.id)] = (
+                self.key_for_user(config.user_id),
+                self.to_epoch_ms(due_at) if due_at is not None else None,
+            )
+        return scores
+
+    async def _apply(self, scores: dict[str, tuple[str, int | None]], removed: list[str]) -> None:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for member, (key, score) in scores.items():
+                if score is None:
+                    pipe.zrem(key, member)
+                else:
+                    pipe.zadd(key, {member: score})
+            if removed:
+                # The owning user is unknown for deleted rows; clear every shard.
+                for shard in range(shard_count()):
+                    pipe.zrem(self.shard_key(shard), *removed)
+            await pipe.execute()
+
+    async def schedule(
+        self,
+        config_id: int | str,
+        user_id: str,
+        due_at: datetime,
+        only_later: bool = False,
+    ) -> None:
+        try:
+            await redis_client.zadd(
+                self.key_for_user(user_id),
+                {str(config_id): self.to_epoch_ms(due_at)},
+                gt=only_later,
+            )
+        except Exception:
+            await inc_metric(metric_key("scheduler.due_index.write_failed", service="scheduler"))
+            self.logger.warning("due index schedule failed config_id=%s", config_id)
+
+    async def refresh_configs(self, config_ids: Iterable[int | str]) -> None:
+        ids = sorted({int(config_id) for config_id in config_ids if str(config_id).isdigit()})
+        if not ids:
+            return
+        try:
+            async with db_session() as db:
+                configs = (
+                    await db.execute(select(BroadcastConfig).where(BroadcastConfig.id.in_(ids)))
+                ).scalars().all()
+            scores = await self._load_scores(configs)
+            removed = [str(config_id) for config_id in ids if str(config_id) not in scores]
+            await self._apply(scores, removed)
+        except Exception:
+            await inc_metric(metric_key("scheduler.due_index.write_failed", service="scheduler"))
+            self.logger.warning("due index refresh failed config_ids=%s", ids)
+
+    async def refresh_user(self, user_id: str) -> None:
+        try:
+            async with db_session() as db:
+                config_ids = (
+                    await db.execute(
+                        select(BroadcastConfig.id).where(BroadcastConfig.user_id == str(user_id))
+                    )
+                ).scalars().all()
+        except Exception:
+            self.logger.warning("due index user lookup failed user_id=%s", user_id)
+            return
+        await self.refresh_configs(config_ids)
+        try:
+            # A new or unblocked account can make a campaign due before the scheduler's next wake.
+            await redis_client.publish(CONFIG_EVENTS_CHANNEL, json.dumps({"userId": str(user_id)}))
+        except Exception:
+            self.logger.warning("scheduler wakeup publish failed user_id=%s", user_id)
+
+    async def next_due_ms(self, shards: Iterable[int]) -> int | None:
+        """Earliest score across ``shards``, or None when they are all empty."""
+        shards = list(shards)
+        if not shards:
+            return None
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for shard in shards:
+                pipe.zrange(self.shard_key(shard), 0, 0, withscores=True)
+            heads = await pipe.execute()
+        scores = [int(head[0][1]) for head in heads if head]
+        return min(scores) if scores else None
+
+    async def due_count(self, shard: int, now: datetime) -> int:
+        return int(await redis_client.zcount(self.shard_key(shard), "-inf", self.to_epoch_ms(now)))
+
+    async def due_ids(self, shard: int, now: datetime, limit: int) -> list[int]:
+        members = await redis_client.zrangebyscore(
+            self.shard_key(shard), "-inf", self.to_epoch_ms(now), start=0, num=max(1, int(limit))
+        )
+        return [int(member) for member in members if str(member).isdigit()]
+
+    async def rebuild(self, shard: int) -> int:
+        async with db_session() as db:
+            configs = (
+                await db.execute(
+                    select(BroadcastConfig).where(
+                        BroadcastConfig.is_active.is_(True),
+                        shard_clause(BroadcastConfig.user_id, [shard]),
+                    )
+                )
+            ).scalars().all()
+        scores = await self._load_scores(configs)
+        present = {member: score for member, (_, score) in scores.items() if score is not None}
+        key = self.shard_key(shard)
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if present:
+                pipe.zadd(key, present)
+            await pipe.execute()
+        log_event(
+            self.logger,
+            logging.INFO,
+            "scheduler_due_index_rebuilt",
+            shard=shard,
+            indexed=len(present),
+            scanned=len(configs),
+        )
+        return len(present)
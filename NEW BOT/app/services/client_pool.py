@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.config import settings
+from app.metrics import inc_metric, metric_key, set_gauge_metric
+
+
+@dataclass
+class PooledClient:
+    client: Any
+    refs: int = 0
+    last_used_at: float = field(default_factory=time.monotonic)
+
+
+class ClientPool:
+    """Bounded LRU pool of started Telegram clients, keyed by account id.
+
+    Starting a client is single-flight per account: concurrent callers for
+    the same account share one start, different accounts start in parallel.
+    Callers hold a reference for as long as they use a client; only
+    unreferenced clients are stopped, either when they have been idle for
+    ``idle_ttl_ms`` or when the pool grows past ``max_size``. The pool may
+    temporarily exceed ``max_size`` while every client is in use.
+    """
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        idle_ttl_ms: int | None = None,
+        on_evict: Callable[[str], None] | None = None,
+    ):
+        self.logger = logging.getLogger("client_pool")
+        self.max_size = max(
+            1,
+            int(max_size if max_size is not None else settings.userbot_client_pool_max_size),
+        )
+        self.idle_ttl_ms = max(
+            1000,
+            int(idle_ttl_ms if idle_ttl_ms is not None else settings.userbot_client_idle_ttl_ms),
+        )
+        self.on_evict = on_evict
+        self._entries: OrderedDict[str, PooledClient] = OrderedDict()
+        self._starting: dict[str, asyncio.Task] = {}
+        self._sweeper: asyncio.Task | None = None
+        # Cache hits are counted in process and flushed by the sweeper.
+        self._unflushed_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def _sweep_loop(self) -> None:
+        while self._entries:
+            await asyncio.sleep(self.idle_ttl_ms / 2000)
+            try:
+                await self.evict()
+            except Exception:
+                self.logger.exception("Client pool sweep failed")
+
+    def _checkout(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.refs += 1
+        entry.last_used_at = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry.client
+
+    async def acquire(
+        self, key: str, factory: Callable[[], Awaitable[Any | None]]
+    ) -> Any | None:
+        # Fast path: no locks, no awaits before handing out a started client.
+        client = self._checkout(key)
+        if client is not None:
+            self._unflushed_hits += 1
+            return client
+
+        while True:
+            task = self._starting.get(key)
+            if task is None:
+                task = asyncio.create_task(self._start(key, factory))
+                self._starting[key] = task
+            else:
+                await inc_metric(metric_key("userbot.client_pool.coalesced", service="userbot"))
+            # Shielded so a cancelled caller does not abort the start for others.
+            if not await asyncio.shield(task):
+                return None
+            client = self._checkout(key)
+            if client is not None:
+                if len(self._entries) > self.max_size:
+                    await self.evict()
+                return client
+
+    async def _start(self, key: str, factory: Callable[[], Awaitable[Any | None]]) -> bool:
+        try:
+            await inc_metric(metric_key("userbot.client_pool.miss", service="userbot"))
+            started_at = time.monotonic()
+            client = await factory()
+            if client is None:
+                return False
+            start_ms = int((time.monotonic() - started_at) * 1000)
+            await inc_metric(metric_key("userbot.client_pool.started", service="userbot"))
+            await set_gauge_metric(
+                metric_key("userbot.client_pool.last_start_ms", service="userbot"), start_ms
+            )
+            self._entries[key] = PooledClient(client=client)
+            self._ensure_sweeper()
+            return True
+        finally:
+            self._starting.pop(key, None)
+
+    async def release(self, key: str, client: Any) -> None:
+        entry = self._entries.get(key)
+        if entry is None or entry.client is not client:
+            return
+        entry.refs = max(0, entry.refs - 1)
+        entry.last_used_at = time.monotonic()
+        if len(self._entries) > self.max_size:
+            await self.evict()
+
+    @asynccontextmanager
+    async def lease(self, key: str, factory: Callable[[], Awaitable[Any | None]]):
+        client = await self.acquire(key, factory)
+        try:
+            yield client
+        finally:
+            if client is not None:
+                await self.release(key, client)
+
+    def eviction_candidates(self, now: float | None = None) -> list[str]:
+        now = time.monotonic() if now is None else now
+        idle_cutoff = now - self.idle_ttl_ms / 1000
+        candidates: list[str] = []
+        overflow = len(self._entries) - self.max_size
+        # Entries are kept in LRU order, oldest first.
+        for key, entry in self._entries.items():
+            if entry.refs > 0:
+                continue
+            if entry.last_used_at <= idle_cutoff:
+                candidates.append(key)
+            elif overflow > len(candidates):
+                candidates.append(key)
+        return candidates
+
+    async def flush_metrics(self) -> None:
+        hits, self._unflushed_hits = self._unflushed_hits, 0
+        if hits:
+            await inc_metric(metric_key("userbot.client_pool.hit", service="userbot"), hits)
+
+    async def evict(self) -> int:
+        await self.flush_metrics()
+        evicted = 0
+        for key in self.eviction_candidates():
+            entry = self._entries.get(key)
+            if entry is None or entry.refs > 0:
+                continue
+            del self._entries[key]
+            if self.on_evict is not None:
+                self.on_evict(key)
+            await self._stop(entry.client)
+            await inc_metric(metric_key("userbot.client_pool.evicted", service="userbot"))
+            evicted += 1
+        await set_gauge_metric(
+            metric_key("userbot.client_pool.size", service="userbot"), len(self._entries)
+        )
+        return evicted
+
+    async def _stop(self, client: Any) -> None:
+        try:
+            await client.stop()
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for task in list(self._starting.values()):
+            task.cancel()
+        self._starting.clear()
+        await self.flush_metrics()
+        entries = list(self._entries.items())
+        self._entries.clear()
+        for key, entry in entries:
+            if self.on_evict is not None:
+                self.on_evict(key)
+            await self._stop(entry.client)
@@ -0,0 +1,166 @@
+import logging
+import time
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.db import db_session
+from app.metrics import inc_metric, metric_key
+from app.models import AllowedUser
+from app.redis_client import redis_client
+from app.utils import parse_weight_map
+
+
+FAIR_SHARE_KEY_PREFIX = "broadcast:fair:"
+
+# Deficit round robin over user ids. KEYS: credit hash, weight hash, active
+# ZSET scored by when each user's next job is expected, credit holders ZSET
+# (same scores), round counter, hash of the round each user was last
+# refilled in. ARGV: user, weight, quantum, now ms, stale window ms, grace
+# ms. A user with credit runs; one without waits while another user that is
+# ready now still holds credit. Once none does, a round starts: the counter
+# is bumped and every active user becomes a holder again, and each user gets
+# its quantum * weight when it is next admitted (carry-over capped at one
+# round so idle users cannot bank credit). Admission never walks the users.
+ADMIT_SCRIPT = """
+local user = ARGV[1]
+local share = tonumber(ARGV[3]) * tonumber(ARGV[2])
+local now_ms = tonumber(ARGV[4])
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now_ms - tonumber(ARGV[5]))
+for _, member in ipairs(stale) do
+  redis.call('ZREM', KEYS[3], member)
+  redis.call('ZREM', KEYS[4], member)
+  redis.call('HDEL', KEYS[1], member)
+  redis.call('HDEL', KEYS[2], member)
+  redis.call('HDEL', KEYS[6], member)
+end
+redis.call('ZADD', KEYS[3], now_ms, user)
+redis.call('ZADD', KEYS[4], 'XX', now_ms, user)
+redis.call('HSET', KEYS[2], user, ARGV[2])
+local function refill()
+  local round = tonumber(redis.call('GET', KEYS[5]) or '0')
+  local credit = tonumber(redis.call('HGET', KEYS[1], user) or '0')
+  if tonumber(redis.call('HGET', KEYS[6], user) or '-1') < round then
+    credit = math.min(credit + share, share)
+    redis.call('HSET', KEYS[1], user, credit)
+    redis.call('HSET', KEYS[6], user, round)
+  end
+  return credit
+end
+local credit = refill()
+if credit > 0 then
+  redis.call('ZADD', KEYS[4], now_ms, user)
+  return credit
+end
+redis.call('ZREM', KEYS[4], user)
+if redis.call('ZCOUNT', KEYS[4], '-inf', now_ms + tonumber(ARGV[6])) > 0 then
+  return 0
+end
+redis.call('INCR', KEYS[5])
+redis.call('ZUNIONSTORE', KEYS[4], 1, KEYS[3])
+credit = refill()
+if credit <= 0 then
+  redis.call('ZREM', KEYS[4], user)
+end
+return credit
+"""
+
+# KEYS: as for ADMIT_SCRIPT. ARGV: user, attempts used, next expected job ms
+# (-1 when the user has no more work).
+SETTLE_SCRIPT = """
+local credit = redis.call('HINCRBY', KEYS[1], ARGV[1], -tonumber(ARGV[2]))
+if tonumber(ARGV[3]) < 0 then
+  redis.call('ZREM', KEYS[3], ARGV[1])
+  redis.call('ZREM', KEYS[4], ARGV[1])
+  redis.call('HDEL', KEYS[1], ARGV[1])
+  redis.call('HDEL', KEYS[2], ARGV[1])
+  redis.call('HDEL', KEYS[6], ARGV[1])
+  return 1
+end
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+if credit > 0 then
+  redis.call('ZADD', KEYS[4], ARGV[3], ARGV[1])
+else
+  redis.call('ZREM', KEYS[4], ARGV[1])
+end
+return 1
+"""
+
+
+class FairShareService:
+    """Shares worker send attempts across users by deficit round robin.
+
+    Credit is counted in send attempts and refilled per round in proportion
+    to the user's subscription tier weight. A job whose user has spent its
+    credit while another ready user still has some is deferred instead of
+    run, so one heavy campaign cannot occupy every worker slot. Redis
+    failures fail open.
+    """
+
+    weight_cache_ttl_s = 60.0
+
+    def __init__(self, key_prefix: str = FAIR_SHARE_KEY_PREFIX):
+        self.logger = logging.getLogger("fair_share")
+        self.key_prefix = key_prefix
+        self._weights: dict[str, tuple[int, float]] = {}
+
+    def keys(self) -> list[str]:
+        return [
+            f"{self.key_prefix}credit",
+            f"{self.key_prefix}weight",
+            f"{self.key_prefix}active",
+            f"{self.key_prefix}holders",
+            f"{self.key_prefix}round",
+            f"{self.key_prefix}refilled",
+        ]
+
+    @staticmethod
+    def weight_for_tier(tier: str | None) -> int:
+        return parse_weight_map(settings.broadcast_tier_weights).get(str(tier or ""), 1)
+
+    async def user_weight(self, user_id: str) -> int:
+        now = time.monotonic()
+        cached = self._weights.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        async with db_session() as db:
+            tier = (
+                await db.execute(select(AllowedUser.tier).where(AllowedUser.id == str(user_id)))
+            ).scalar()
+        weight = self.weight_for_tier(tier)
+        self._weights[user_id] = (weight, now + self.weight_cache_ttl_s)
+        return weight
+
+    async def admit(self, user_id: str) -> int:
+        """Attempts the user may spend now; 0 means defer the job."""
+        fallback = max(1, int(settings.broadcast_attempts_per_job))
+        try:
+            weight = await self.user_weight(user_id)
+            credit = await redis_client.eval(
+                ADMIT_SCRIPT,
+                6,
+                *self.keys(),
+                str(user_id),
+                weight,
+                max(1, int(settings.broadcast_fair_quantum)),
+                int(time.time() * 1000),
+                max(1000, int(settings.broadcast_fair_active_window_ms)),
+                max(250, int(settings.broadcast_continuation_base_delay_ms)),
+            )
+        except Exception:
+            await inc_metric(metric_key("processor.fair_share.error", service="processor"))
+            self.logger.warning("fair share admit failed user_id=%s", user_id)
+            return fallback
+        return max(0, int(credit or 0))
+
+    async def settle(self, user_id: str, used: int, next_job_in_ms: int | None) -> None:
+        next_job_at_ms = (
+            -1 if next_job_in_ms is None else int(time.time() * 1000) + max(0, int(next_job_in_ms))
+        )
+        try:
+            await redis_client.eval(
+                SETTLE_SCRIPT, 6, *self.keys(), str(user_id), max(0, int(used)), next_job_at_ms
+            )
+        except Exception:
+            await inc_metric(metric_key("processor.fair_share.error", service="processor"))
+            self.logger.warning("fair share settle failed user_id=%s", user_id)
@@ -24,7 +24,15 @@ class GroupService:
             query = query.order_by(UserGroup.created_at.desc())
             return list((await db.execute(query)).scalars().all())
 
-    async def add_group(self, user_id: str, group_id: str, title: str, kind: str, access_hash: str | None = None) -> None:
+    async def add_group(
+        self,
+        user_id: str,
+        group_id: str,
+        title: str,
+        kind: str,
+        access_hash: str | None = None,
+        peer_account_id: str | None = None,
+    ) -> None:
         normalized_group_id = self._normalize_group_id(group_id, kind)
         async with db_session() as db:
             existing = (
@@ -33,7 +41,9 @@ class GroupService:
             if existing:
                 existing.title = title
                 existing.type = kind
-                existing.access_hash = access_hash
+                if access_hash is not None:
+                    existing.access_hash = access_hash
+                    existing.peer_account_id = peer_account_id
                 existing.is_active = True
             else:
                 db.add(
@@ -43,6 +53,7 @@ class GroupService:
                         title=title,
                         type=kind,
                         access_hash=access_hash,
+                        peer_account_id=peer_account_id,
                         is_active=True,
                     )
                 )
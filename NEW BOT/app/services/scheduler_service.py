@@ -1,8 +1,12 @@
 import asyncio
+import json
 import logging
-from datetime import UTC, datetime
+import math
+import time
+from datetime import UTC, datetime, timedelta
 
-from sqlalchemy import exists, or_, select
+from sqlalchemy import bindparam, exists, or_, select, update
+from sqlalchemy.orm import defer
 
 from app.config import settings
 from app.db import db_session
@@ -10,30 +14,59 @@ from app.logging_utils import log_event
 from app.metrics import inc_metric, metric_key, set_gauge_metric
 from app.models import BroadcastConfig, TelegramAccount
 from app.redis_client import redis_client
-from app.services.broadcast_queue_service import BroadcastQueueService
+from app.services.broadcast_queue_service import (
+    PRIORITY_SCHEDULED,
+    BroadcastQueueService,
+    EnqueueSpec,
+    QueueStats,
+)
+from app.services.campaign_due_index import CONFIG_EVENTS_CHANNEL, CampaignDueIndex
+from app.services.scheduler_shards import (
+    ShardLeaseManager,
+    shard_clause,
+    shard_for_user,
+)
 from app.utils import deterministic_jitter_ms
 
 
+# Floor between ticks so an entry that stays due (e.g. enqueue keeps failing) cannot spin the loop.
+MIN_WAKE_INTERVAL_MS = 200
+
+
 class SchedulerService:
     def __init__(self, queue_service: BroadcastQueueService):
         self.queue_service = queue_service
         self.logger = logging.getLogger("scheduler_service")
         self._task: asyncio.Task | None = None
+        self._listener_task: asyncio.Task | None = None
+        self._lease_task: asyncio.Task | None = None
         self._running = False
-        self.lock_key = "broadcast:scheduler:lock"
-        self.lock_ttl_ms = 55000
+        self._wake = asyncio.Event()
+        self.due_index = CampaignDueIndex()
+        self.shards = ShardLeaseManager()
+        self._last_index_rebuild_ms: dict[int, int] = {}
+        self._throttled = False
 
     async def start(self) -> None:
         if self._task:
             return
         self._running = True
+        self._listener_task = asyncio.create_task(self._listen_for_config_events())
+        self._lease_task = asyncio.create_task(self._lease_loop())
         self._task = asyncio.create_task(self._loop())
 
     async def stop(self) -> None:
         self._running = False
+        if self._listener_task:
+            self._listener_task.cancel()
+            self._listener_task = None
+        if self._lease_task:
+            self._lease_task.cancel()
+            self._lease_task = None
         if self._task:
             self._task.cancel()
             self._task = None
+        await self.shards.release_all()
 
     async def _loop(self) -> None:
         while self._running:
@@ -43,100 +76,338 @@ class SchedulerService:
                 await inc_metric(metric_key("scheduler.loop.error", service="scheduler"))
                 log_event(self.logger, logging.ERROR, "scheduler_loop_iteration_failed")
                 self.logger.exception("Scheduler loop iteration failed")
-            await asyncio.sleep(max(1, settings.scheduler_check_interval_ms // 1000))
+            await self.wait_for_next_tick()
+
+    async def _lease_loop(self) -> None:
+        """Renew shard leases between ticks; a change in ownership wakes the scheduler."""
+        interval_s = max(1000, int(settings.scheduler_shard_lease_ms)) / 3000
+        while self._running:
+            await asyncio.sleep(interval_s)
+            before = set(self.shards.owned)
+            try:
+                owned = await self.shards.rebalance()
+            except Exception:
+                await inc_metric(metric_key("scheduler.shard.rebalance_failed", service="scheduler"))
+                self.logger.warning("Scheduler shard rebalance failed; retrying")
+                continue
+            if owned != before:
+                self.wake()
+
+    async def next_wake_delay_ms(self) -> int:
+        """Time until the earliest indexed due campaign.
+
+        Config events, due index updates and shard changes wake the loop
+        sooner, so with nothing due it sleeps up to
+        ``scheduler_idle_wake_max_ms``. Under backpressure, or with the due
+        index unavailable, it falls back to polling at the check interval.
+        """
+        check_ms = max(MIN_WAKE_INTERVAL_MS, int(settings.scheduler_check_interval_ms))
+        idle_ms = max(check_ms, int(settings.scheduler_idle_wake_max_ms))
+        if not self.shards.owned:
+            return idle_ms
+        if self._throttled:
+            # While backpressure holds admissions, overdue entries would otherwise wake us at once.
+            return check_ms
+        try:
+            next_due_ms = await self.due_index.next_due_ms(sorted(self.shards.owned))
+        except Exception:
+            return check_ms
+        if next_due_ms is None:
+            return idle_ms
+        delay_ms = next_due_ms - int(time.time() * 1000)
+        return min(idle_ms, max(MIN_WAKE_INTERVAL_MS, delay_ms))
+
+    async def wait_for_next_tick(self) -> bool:
+        """Sleep until the next due campaign or a config event; True if woken by an event."""
+        delay_ms = await self.next_wake_delay_ms()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=delay_ms / 1000)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self._wake.clear()
+        return woken
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def handle_config_event(self, data: str | bytes) -> bool:
+        try:
+            user_id = str(json.loads(data).get("userId") or "")
+        except (TypeError, ValueError, AttributeError):
+            return False
+        if not user_id:
+            return False
+        # Before the first rebalance ownership is unknown; a spare tick is cheap.
+        if self.shards.owned and shard_for_user(user_id) not in self.shards.owned:
+            return False
+        self.wake()
+        return True
+
+    async def _listen_for_config_events(self) -> None:
+        while self._running:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CONFIG_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    if self.handle_config_event(message.get("data")):
+                        await inc_metric(metric_key("scheduler.wake.config_event", service="scheduler"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await inc_metric(metric_key("scheduler.config_events.error", service="scheduler"))
+                self.logger.warning("Scheduler config event subscription failed; retrying")
+                await asyncio.sleep(max(1, settings.scheduler_check_interval_ms // 1000))
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def publish_config_change(self, user_id: str) -> None:
+        try:
+            await redis_client.publish(CONFIG_EVENTS_CHANNEL, json.dumps({"userId": str(user_id)}))
+        except Exception:
+            # Scheduler still picks the change up on its next capped wake.
+            await inc_metric(metric_key("scheduler.config_events.publish_failed", service="scheduler"))
+            self.logger.warning("config change publish failed user_id=%s", user_id)
 
     @staticmethod
     def utcnow_naive() -> datetime:
         return datetime.now(UTC).replace(tzinfo=None)
 
-    async def acquire_lock(self, token: str) -> bool:
-        result = await redis_client.set(self.lock_key, token, px=self.lock_ttl_ms, nx=True)
-        return bool(result)
-
-    async def release_lock(self, token: str) -> None:
-        script = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
-        await redis_client.eval(script, 1, self.lock_key, token)
-
     async def check_and_run(self) -> None:
-        token = f"scheduler-{self.utcnow_naive().timestamp()}"
-        if not await self.acquire_lock(token):
+        owned = sorted(await self.shards.rebalance())
+        if not owned:
             return
 
+        admit_limit = await self.admission_limit()
+        self._throttled = admit_limit < settings.scheduler_max_due_per_tick
+        shard_limit = math.ceil(admit_limit / len(owned)) if admit_limit > 0 else 0
+        timeout = max(1000, settings.scheduler_shard_tick_timeout_ms) / 1000
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(self.run_shard(shard, limit=shard_limit), timeout=timeout)
+                for shard in owned
+            ),
+            return_exceptions=True,
+        )
+        for shard, result in zip(owned, results):
+            if not isinstance(result, BaseException):
+                continue
+            # One slow or failing shard must not hold up the others.
+            outcome = "timeout" if isinstance(result, asyncio.TimeoutError) else "error"
+            await inc_metric(
+                metric_key("scheduler.shard.tick_failed", service="scheduler", outcome=outcome)
+            )
+            log_event(
+                self.logger,
+                logging.ERROR,
+                "scheduler_shard_tick_failed",
+                shard=shard,
+                outcome=outcome,
+                error=str(result),
+            )
+
+    @staticmethod
+    def admitted_per_tick(stats: QueueStats, max_per_tick: int, lag_budget_ms: int) -> int:
+        """Scale admissions down linearly as the oldest ready job's lag nears the budget."""
+        max_per_tick = max(1, int(max_per_tick))
+        lag_budget_ms = max(1, int(lag_budget_ms))
+        if stats.oldest_ready_lag_ms >= lag_budget_ms:
+            return 0
+        headroom = (lag_budget_ms - stats.oldest_ready_lag_ms) / lag_budget_ms
+        return max(1, math.ceil(max_per_tick * headroom))
+
+    async def admission_limit(self) -> int:
+        max_per_tick = max(1, int(settings.scheduler_max_due_per_tick))
         try:
-            due = await self.get_due_configs(settings.scheduler_max_due_per_tick)
-            if not due:
-                return
-
-            now = self.utcnow_naive()
-            queued_count = 0
-            for config in due:
-                safe_interval = max(60, int(config.interval or 60))
-                run_slot = int(now.timestamp() // safe_interval)
-                delay = deterministic_jitter_ms(config.user_id, run_slot, settings.scheduler_jitter_max_ms)
-                scheduled_job_id = self.queue_service.scheduled_job_id(
-                    user_id=config.user_id,
-                    campaign_id=str(config.id),
-                    run_slot=run_slot,
-                )
-                queued_job_id = await self.queue_service.enqueue_send(
+            # Every class is sampled for its gauges; only scheduled runs gate admissions.
+            stats = (await self.queue_service.queue_stats_by_class())[PRIORITY_SCHEDULED]
+        except Exception:
+            # Without queue visibility keep scheduling; workers still dedupe per run slot.
+            await inc_metric(metric_key("scheduler.backpressure.stats_failed", service="scheduler"))
+            return max_per_tick
+        limit = self.admitted_per_tick(stats, max_per_tick, settings.broadcast_queue_lag_alert_ms)
+        await set_gauge_metric(metric_key("scheduler.backpressure.admit_limit", service="scheduler"), limit)
+        if limit < max_per_tick:
+            log_event(
+                self.logger,
+                logging.WARNING,
+                "scheduler_backpressure_applied",
+                admit_limit=limit,
+                queue_depth=stats.depth,
+                queue_ready=stats.ready,
+                oldest_ready_lag_ms=stats.oldest_ready_lag_ms,
+            )
+        return limit
+
+    async def run_shard(self, shard: int, limit: int | None = None) -> int:
+        await self.rebuild_due_index_if_stale(shard)
+        limit = settings.scheduler_max_due_per_tick if limit is None else limit
+        if limit <= 0:
+            await self.record_deferred(shard, 0)
+            return 0
+        due = await self.get_due_configs(limit, shard)
+        if len(due) >= limit:
+            await self.record_deferred(shard, len(due))
+        if not due:
+            return 0
+
+        now = self.utcnow_naive()
+        next_runs: dict[int, tuple[str, datetime]] = {}
+        specs: list[EnqueueSpec] = []
+        now_ts = now.timestamp()
+        for config in due:
+            safe_interval = max(60, int(config.interval or 60))
+            run_slot = int(now_ts // safe_interval)
+            delay = deterministic_jitter_ms(config.user_id, run_slot, settings.scheduler_jitter_max_ms)
+            specs.append(
+                EnqueueSpec(
                     user_id=config.user_id,
-                    message=config.message or "",
+                    message=None,
+                    config_version=int(config.version or 1),
                     campaign_id=str(config.id),
                     queued_at=now.isoformat(),
                     interval_seconds=int(config.interval or 0),
                     delay_ms=delay,
-                    job_id=scheduled_job_id,
+                    job_id=self.queue_service.scheduled_job_id(
+                        user_id=config.user_id,
+                        campaign_id=str(config.id),
+                        run_slot=run_slot,
+                    ),
                 )
-                if queued_job_id is not None:
-                    queued_count += 1
-
-            if queued_count > 0:
-                await inc_metric(metric_key("scheduler.jobs.enqueued", service="scheduler"), queued_count)
-                await set_gauge_metric(metric_key("scheduler.last_enqueued_count", service="scheduler"), queued_count)
-                log_event(
-                    self.logger,
-                    logging.INFO,
-                    "scheduler_jobs_enqueued",
-                    queued_count=queued_count,
+            )
+            # Not due again before the next run slot; a completed run moves it further.
+            next_runs[config.id] = (
+                config.user_id,
+                now + timedelta(seconds=(run_slot + 1) * safe_interval - now_ts),
+            )
+
+        queued_job_ids = await self.queue_service.enqueue_many(specs)
+        queued_count = sum(1 for job_id in queued_job_ids if job_id is not None)
+        await self.defer_until_next_slot(next_runs)
+
+        if queued_count > 0:
+            await inc_metric(metric_key("scheduler.jobs.enqueued", service="scheduler"), queued_count)
+            await set_gauge_metric(metric_key("scheduler.last_enqueued_count", service="scheduler"), queued_count)
+            log_event(
+                self.logger,
+                logging.INFO,
+                "scheduler_jobs_enqueued",
+                shard=shard,
+                queued_count=queued_count,
+            )
+        return queued_count
+
+    async def record_deferred(self, shard: int, admitted: int) -> None:
+        try:
+            due_count = await self.due_index.due_count(shard, self.utcnow_naive())
+        except Exception:
+            return
+        deferred = max(0, due_count - admitted)
+        if deferred > 0:
+            await inc_metric(
+                metric_key("scheduler.backpressure.deferred", service="scheduler"), deferred
+            )
+
+    async def rebuild_due_index_if_stale(self, shard: int) -> None:
+        now_ms = int(time.time() * 1000)
+        last_rebuild_ms = self._last_index_rebuild_ms.get(shard, 0)
+        if now_ms - last_rebuild_ms < max(1000, settings.scheduler_due_index_rebuild_ms):
+            return
+        try:
+            await self.due_index.rebuild(shard)
+            self._last_index_rebuild_ms[shard] = now_ms
+        except Exception:
+            await inc_metric(metric_key("scheduler.due_index.rebuild_failed", service="scheduler"))
+            self.logger.exception("Due index rebuild failed")
+
+    @staticmethod
+    def build_due_query(
+        now: datetime,
+        limit: int,
+        config_ids: list[int] | None = None,
+        shards: list[int] | None = None,
+    ):
+        query = select(BroadcastConfig).where(
+            BroadcastConfig.is_active.is_(True),
+            BroadcastConfig.message.is_not(None),
+            BroadcastConfig.interval.is_not(None),
+            BroadcastConfig.next_run_at <= now,
+            exists(
+                select(TelegramAccount.id).where(
+                    TelegramAccount.user_id == BroadcastConfig.user_id,
+                    TelegramAccount.is_active.is_(True),
+                    or_(
+                        TelegramAccount.is_flood_wait.is_(False),
+                        TelegramAccount.flood_wait_until.is_(None),
+                        TelegramAccount.flood_wait_until <= now,
+                    ),
                 )
-        finally:
-            await self.release_lock(token)
+            ),
+        )
+        if config_ids is not None:
+            query = query.where(BroadcastConfig.id.in_(config_ids))
+        if shards is not None:
+            query = query.where(shard_clause(BroadcastConfig.user_id, shards))
+        # Served by the partial index on next_run_at, so LIMIT only counts due rows.
+        # The message text is never enqueued, so it is not loaded either.
+        return (
+            query.options(defer(BroadcastConfig.message))
+            .order_by(BroadcastConfig.next_run_at.asc())
+            .limit(max(1, limit))
+        )
 
-    async def get_due_configs(self, limit: int) -> list[BroadcastConfig]:
+    async def get_due_configs(self, limit: int, shard: int) -> list[BroadcastConfig]:
         now = self.utcnow_naive()
-        due: list[BroadcastConfig] = []
-        async with db_session() as db:
-            rows = (
-                await db.execute(
-                    select(BroadcastConfig)
-                    .where(
-                        BroadcastConfig.is_active.is_(True),
-                        BroadcastConfig.message.is_not(None),
-                        BroadcastConfig.interval.is_not(None),
-                        exists(
-                            select(TelegramAccount.id).where(
-                                TelegramAccount.user_id == BroadcastConfig.user_id,
-                                TelegramAccount.is_active.is_(True),
-                                or_(
-                                    TelegramAccount.is_flood_wait.is_(False),
-                                    TelegramAccount.flood_wait_until.is_(None),
-                                    TelegramAccount.flood_wait_until <= now,
-                                ),
-                            )
-                        ),
-                    )
-                    .order_by(BroadcastConfig.last_run_at.asc().nullsfirst())
-                    .limit(max(1, limit))
+        try:
+            due_ids = await self.due_index.due_ids(shard, now, limit)
+        except Exception:
+            # Without the index, fall back to the indexed next_run_at scan.
+            await inc_metric(metric_key("scheduler.due_index.read_failed", service="scheduler"))
+            async with db_session() as db:
+                return list(
+                    (await db.execute(self.build_due_query(now, limit, shards=[shard])))
+                    .scalars()
+                    .all()
                 )
-            ).scalars().all()
+        if not due_ids:
+            return []
 
-            for row in rows:
-                if row.interval is None:
-                    continue
-                if self.is_due(row.last_run_at, int(row.interval), now=now):
-                    due.append(row)
+        async with db_session() as db:
+            due = list(
+                (await db.execute(self.build_due_query(now, limit, due_ids))).scalars().all()
+            )
+        # Index entries that turned out not to be due are re-scored from the DB.
+        due_row_ids = {row.id for row in due}
+        stale_ids = [config_id for config_id in due_ids if config_id not in due_row_ids]
+        if stale_ids:
+            await self.due_index.refresh_configs(stale_ids)
         return due
 
+    async def defer_until_next_slot(self, next_runs: dict[int, tuple[str, datetime]]) -> None:
+        if not next_runs:
+            return
+        table = BroadcastConfig.__table__
+        async with db_session() as db:
+            await db.execute(
+                update(table)
+                .where(
+                    table.c.id == bindparam("b_id"),
+                    table.c.next_run_at < bindparam("v_next_run_at"),
+                )
+                .values(next_run_at=bindparam("v_next_run_at")),
+                [
+                    {"b_id": config_id, "v_next_run_at": next_run_at}
+                    for config_id, (_, next_run_at) in next_runs.items()
+                ],
+            )
+        for config_id, (user_id, next_run_at) in next_runs.items():
+            await self.due_index.schedule(config_id, user_id, next_run_at, only_later=True)
+
     @staticmethod
     def is_due(last_run_at: datetime | None, interval_seconds: int, now: datetime | None = None) -> bool:
         if last_run_at is None:
@@ -158,17 +429,28 @@ class SchedulerService:
                 await db.execute(select(BroadcastConfig).where(BroadcastConfig.user_id == user_id))
             ).scalars().first()
             if not config:
-                config = BroadcastConfig(user_id=user_id, message=message or "", interval=interval or 3600, is_active=bool(is_active))
+                config = BroadcastConfig(user_id=user_id, message=message or "", interval=interval or 3600, is_active=bool(is_active), version=1)
                 db.add(config)
-                return config
-
-            if message is not None:
-                config.message = message
-            if interval is not None:
-                config.interval = interval
-            if is_active is not None:
-                config.is_active = is_active
-            return config
+            else:
+                changed = (message is not None and message != config.message) or (
+                    interval is not None and interval != config.interval
+                )
+                if message is not None:
+                    config.message = message
+                if interval is not None:
+                    config.interval = interval
+                if changed:
+                    # Jobs queued for the previous content are rejected as stale.
+                    config.version = int(config.version or 1) + 1
+                if is_active is not None:
+                    config.is_active = is_active
+            config.next_run_at = CampaignDueIndex.next_due_at(
+                config.last_run_at, int(config.interval or 3600), self.utcnow_naive()
+            )
+
+        await self.due_index.refresh_configs([config.id])
+        await self.publish_config_change(user_id)
+        return config
 
     async def get_config(self, user_id: str) -> BroadcastConfig | None:
         async with db_session() as db:
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import uuid
+
+from sqlalchemy import BigInteger, case, cast, func, literal
+from sqlalchemy.dialects.postgresql import BIT
+
+from app.config import settings
+from app.metrics import inc_metric, metric_key, set_gauge_metric
+from app.redis_client import redis_client
+
+
+MEMBERS_KEY = "broadcast:scheduler:members"
+SHARD_LEASE_KEY_PREFIX = "broadcast:scheduler:shard:"
+
+RENEW_LEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+RELEASE_LEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+def shard_count() -> int:
+    return max(1, int(settings.scheduler_shard_count))
+
+
+# At most 18 digits, so the value always fits a BIGINT.
+NUMERIC_USER_ID_PATTERN = "^-?[0-9]{1,18}$"
+
+
+def shard_for_user(user_id: str | int, count: int | None = None) -> int:
+    """Shard of a user id, computed the same way as ``shard_clause``.
+
+    Numeric (Telegram) ids use the absolute value modulo the count, since
+    Postgres ``%`` keeps the sign of a negative dividend and Python's does
+    not. Any other id uses the first 32 bits of its md5, which both sides
+    can compute exactly.
+    """
+    count = shard_count() if count is None else max(1, int(count))
+    raw = str(user_id)
+    if re.fullmatch(NUMERIC_USER_ID_PATTERN, raw):
+        return abs(int(raw)) % count
+    return int(hashlib.md5(raw.encode()).hexdigest()[:8], 16) % count
+
+
+def shard_clause(user_id_column, shards: list[int], count: int | None = None):
+    """SQL filter matching ``shard_for_user``."""
+    count = shard_count() if count is None else max(1, int(count))
+    # CASE keeps the cast from running on rows the pattern rejects.
+    shard = case(
+        (
+            user_id_column.op("~")(NUMERIC_USER_ID_PATTERN),
+            func.abs(cast(user_id_column, BigInteger)) % count,
+        ),
+        else_=cast(
+            cast(literal("x") + func.substr(func.md5(user_id_column), 1, 8), BIT(32)),
+            BigInteger,
+        )
+        % count,
+    )
+    return shard.in_(shards)
+
+
+def preferred_shards(member_id: str, members: list[str], count: int) -> list[int]:
+    ordered = sorted(set(members) | {member_id})
+    index = ordered.index(member_id)
+    return [shard for shard in range(count) if shard % len(ordered) == index]
+
+
+class ShardLeaseManager:
+    """Spreads scheduler shards across live app replicas.
+
+    Each replica heartbeats into a members ZSET; shard ``s`` belongs to the
+    ``s % len(members)``-th live member in sorted order. Ownership is a
+    renewable lease key per shard, so a replica that dies loses its shards
+    after ``scheduler_shard_lease_ms`` and a joining replica receives its share
+    once the current holder hands it over on its next tick.
+    """
+
+    def __init__(self, member_id: str | None = None):
+        self.logger = logging.getLogger("scheduler_shards")
+        self.member_id = member_id or f"scheduler-{uuid.uuid4().hex[:12]}"
+        self.owned: set[int] = set()
+        # The scheduler tick and the lease loop both rebalance.
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def lease_key(shard: int) -> str:
+        return f"{SHARD_LEASE_KEY_PREFIX}{shard}"
+
+    async def live_members(self, now_ms: int) -> list[str]:
+        lease_ms = max(1000, int(settings.scheduler_shard_lease_ms))
+        await redis_client.zadd(MEMBERS_KEY, {self.member_id: now_ms})
+        await redis_client.zremrangebyscore(MEMBERS_KEY, "-inf", now_ms - lease_ms)
+        return [str(member) for member in await redis_client.zrange(MEMBERS_KEY, 0, -1)]
+
+    async def rebalance(self) -> set[int]:
+        async with self._lock:
+            return await self._rebalance()
+
+    async def _rebalance(self) -> set[int]:
+        now_ms = int(time.time() * 1000)
+        lease_ms = max(1000, int(settings.scheduler_shard_lease_ms))
+        count = shard_count()
+        wanted = set(preferred_shards(self.member_id, await self.live_members(now_ms), count))
+
+        for shard in sorted(self.owned - wanted):
+            await redis_client.eval(RELEASE_LEASE_SCRIPT, 1, self.lease_key(shard), self.member_id)
+            self.owned.discard(shard)
+            await inc_metric(metric_key("scheduler.shard.released", service="scheduler"))
+
+        for shard in sorted(wanted):
+            key = self.lease_key(shard)
+            if shard in self.owned:
+                renewed = await redis_client.eval(
+                    RENEW_LEASE_SCRIPT, 1, key, self.member_id, lease_ms
+                )
+                if not renewed:
+                    self.owned.discard(shard)
+                    await inc_metric(metric_key("scheduler.shard.lost", service="scheduler"))
+                continue
+            if await redis_client.set(key, self.member_id, px=lease_ms, nx=True):
+                self.owned.add(shard)
+                await inc_metric(metric_key("scheduler.shard.acquired", service="scheduler"))
+
+        await set_gauge_metric(
+            metric_key("scheduler.shard.owned", service="scheduler"), len(self.owned)
+        )
+        return set(self.owned)
+
+    async def release_all(self) -> None:
+        for shard in sorted(self.owned):
+            try:
+                await redis_client.eval(
+                    RELEASE_LEASE_SCRIPT, 1, self.lease_key(shard), self.member_id
+                )
+            except Exception:
+                self.logger.warning("shard lease release failed shard=%s", shard)
+        self.owned.clear()
+        try:
+            await redis_client.zrem(MEMBERS_KEY, self.member_id)
+        except Exception:
+            self.logger.warning("scheduler member removal failed member_id=%s", self.member_id)
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import time
+
+from app.config import settings
+from app.metrics import inc_metric, metric_key
+from app.redis_client import redis_client
+from app.services.worker_routing import MEMBERS_KEY, member_ttl_ms
+
+
+GLOBAL_LIMIT_KEY = "broadcast:rate:global"
+DC_LIMIT_KEY_PREFIX = "broadcast:rate:dc:"
+WORKER_COUNT_REFRESH_S = 30.0
+
+# GCRA: the key stores the theoretical arrival time (TAT) in ms. A request
+# for N permits is admitted when the new TAT stays within the burst
+# tolerance; otherwise the script returns how long to wait and changes nothing.
+GCRA_SCRIPT = """
+local emission_ms = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local permits = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now_ms = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now_ms then
+  tat = now_ms
+end
+local new_tat = tat + emission_ms * permits
+local allow_at = new_tat - emission_ms * burst
+if allow_at > now_ms then
+  return math.ceil(allow_at - now_ms)
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now_ms) + 1000)
+return 0
+"""
+
+
+class LocalTokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float | None = None):
+        self.rate_per_sec = max(0.001, float(rate_per_sec))
+        self.capacity = max(1.0, float(capacity if capacity is not None else rate_per_sec))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def set_rate(self, rate_per_sec: float) -> None:
+        self.rate_per_sec = max(0.001, float(rate_per_sec))
+        self.capacity = max(1.0, self.rate_per_sec)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def try_acquire(self, permits: int = 1) -> float:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_sec
+        )
+        self.updated_at = now
+        if self.tokens >= permits:
+            self.tokens -= permits
+            return 0.0
+        return (permits - self.tokens) / self.rate_per_sec
+
+
+class TelegramSendLimiter:
+    """Cluster-wide send limiter shared by every worker through Redis.
+
+    Covers ``telegram_global_mps`` and, when configured, a per-DC rate.
+    Permits can be reserved in batches to save round-trips; if Redis is
+    slow or unavailable the limiter degrades to an in-process bucket running
+    at ``telegram_rate_limit_fallback_ratio`` of the configured rate split
+    across the last known number of live workers, so the fallback stays
+    under the budget cluster-wide.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("telegram_rate_limiter")
+        self._local_buckets: dict[str, LocalTokenBucket] = {}
+        self._batched_permits: dict[str, tuple[int, float]] = {}
+        self._worker_count: int | None = None
+        self._worker_count_checked_at = float("-inf")
+
+    async def _refresh_worker_count(self) -> None:
+        now = time.monotonic()
+        if now - self._worker_count_checked_at < WORKER_COUNT_REFRESH_S:
+            return
+        self._worker_count_checked_at = now
+        now_ms = int(time.time() * 1000)
+        try:
+            count = await asyncio.wait_for(
+                redis_client.zcount(MEMBERS_KEY, now_ms - member_ttl_ms(), "+inf"),
+                timeout=max(1, settings.telegram_rate_limit_redis_timeout_ms) / 1000,
+            )
+        except Exception:
+            return
+        if int(count or 0) > 0:
+            self._worker_count = int(count)
+
+    def fallback_rate(self, rate: int) -> float:
+        workers = self._worker_count or max(1, int(settings.telegram_rate_limit_fallback_workers))
+        return rate * max(0.0, settings.telegram_rate_limit_fallback_ratio) / workers
+
+    async def acquire(self, dc_id: int | None = None) -> None:
+        await self._refresh_worker_count()
+        await self._acquire_key(GLOBAL_LIMIT_KEY, settings.telegram_global_mps)
+        if dc_id is not None and settings.telegram_per_dc_mps > 0:
+            await self._acquire_key(f"{DC_LIMIT_KEY_PREFIX}{dc_id}", settings.telegram_per_dc_mps)
+
+    def _take_batched_permit(self, key: str) -> bool:
+        remaining, expires_at = self._batched_permits.get(key, (0, 0.0))
+        if remaining <= 0 or expires_at <= time.monotonic():
+            self._batched_permits.pop(key, None)
+            return False
+        self._batched_permits[key] = (remaining - 1, expires_at)
+        return True
+
+    async def _reserve_remote(self, key: str, rate: int, permits: int) -> int:
+        emission_ms = 1000 / rate
+        result = await asyncio.wait_for(
+            redis_client.eval(GCRA_SCRIPT, 1, key, emission_ms, max(1, rate), permits),
+            timeout=max(1, settings.telegram_rate_limit_redis_timeout_ms) / 1000,
+        )
+        return int(result or 0)
+
+    def _local_wait_seconds(self, key: str, rate: int) -> float:
+        local_rate = max(0.1, self.fallback_rate(rate))
+        bucket = self._local_buckets.get(key)
+        if bucket is None:
+            bucket = LocalTokenBucket(local_rate)
+            self._local_buckets[key] = bucket
+        elif bucket.rate_per_sec != local_rate:
+            bucket.set_rate(local_rate)
+        return bucket.try_acquire(1)
+
+    async def _acquire_key(self, key: str, rate: int) -> None:
+        if rate <= 0:
+            return
+        while True:
+            if self._take_batched_permit(key):
+                return
+
+            batch = max(1, min(int(settings.telegram_rate_limit_permit_batch), int(rate)))
+            try:
+                wait_ms = await self._reserve_remote(key, rate, batch)
+            except asyncio.TimeoutError:
+                # Redis may have applied the reservation before the timeout hit,
+                # so count this as the permit and only pace locally; retrying
+                # would spend a second one.
+                await inc_metric(
+                    metric_key("userbot.rate_limit.redis_timeout", service="userbot")
+                )
+                wait_seconds = self._local_wait_seconds(key, rate)
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+                return
+            except Exception:
+                wait_seconds = self._local_wait_seconds(key, rate)
+                if wait_seconds <= 0:
+                    await inc_metric(
+                        metric_key("userbot.rate_limit.local_fallback", service="userbot")
+                    )
+                    return
+                await asyncio.sleep(wait_seconds)
+                continue
+
+            if wait_ms <= 0:
+                if batch > 1:
+                    # Reserved permits only stay valid for the window they cover.
+                    self._batched_permits[key] = (batch - 1, time.monotonic() + batch / rate)
+                return
+            await asyncio.sleep(wait_ms / 1000)
+
+
+ACCOUNT_PACE_KEY_PREFIX = "broadcast:pace:account:"
+
+# Per-account pacing: the key holds the next permitted send time (epoch ms).
+# ARGV[1] is the gap to reserve after the granted slot, ARGV[2] the longest
+# wait the caller accepts. Returns {granted, wait_ms}; nothing is reserved
+# when the wait is too long or the gap is 0 (peek).
+ACCOUNT_PACE_SCRIPT = """
+local gap_ms = tonumber(ARGV[1])
+local max_wait_ms = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now_ms = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local next_at = tonumber(redis.call('GET', KEYS[1]) or '0')
+local slot = math.max(now_ms, next_at)
+local wait_ms = slot - now_ms
+if wait_ms > max_wait_ms or gap_ms <= 0 then
+  return {0, wait_ms}
+end
+local reserved_until = slot + gap_ms
+redis.call('SET', KEYS[1], tostring(reserved_until), 'PX', reserved_until - now_ms + 60000)
+return {1, wait_ms}
+"""
+
+# Pushes an account's next permitted send time out to at least now + ARGV[1]
+# ms (used for account-level FloodWait). Never moves an existing time earlier.
+ACCOUNT_BLOCK_SCRIPT = """
+local block_ms = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now_ms = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local blocked_until = now_ms + block_ms
+local next_at = tonumber(redis.call('GET', KEYS[1]) or '0')
+if blocked_until > next_at then
+  redis.call('SET', KEYS[1], tostring(blocked_until), 'PX', block_ms + 60000)
+end
+return 1
+"""
+
+
+class AccountPacer:
+    """Hands out send slots per Telegram account, shared across workers.
+
+    Each granted slot pushes the account's next permitted send time forward
+    by ``max(60s / telegram_per_account_mpm, jittered min/max delay)``, so
+    every job and worker using the account observes the same cadence.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("account_pacer")
+        self._local_next_at_ms: dict[str, int] = {}
+
+    @staticmethod
+    def gap_ms() -> int:
+        mpm = max(0, int(settings.telegram_per_account_mpm))
+        mpm_gap = int(60000 / mpm) if mpm > 0 else 0
+        min_delay = max(0, int(settings.telegram_per_account_min_delay_ms))
+        max_delay = max(min_delay, int(settings.telegram_per_account_max_delay_ms))
+        return max(mpm_gap, random.randint(min_delay, max_delay))
+
+    def _local_reserve(self, account_id: str, gap_ms: int, max_wait_ms: int) -> tuple[bool, int]:
+        now_ms = int(time.time() * 1000)
+        slot = max(now_ms, self._local_next_at_ms.get(account_id, 0))
+        wait_ms = slot - now_ms
+        if wait_ms > max_wait_ms or gap_ms <= 0:
+            return False, wait_ms
+        self._local_next_at_ms[account_id] = slot + gap_ms
+        return True, wait_ms
+
+    async def _run(self, account_id: str, gap_ms: int, max_wait_ms: int) -> tuple[bool, int]:
+        try:
+            granted, wait_ms = await asyncio.wait_for(
+                redis_client.eval(
+                    ACCOUNT_PACE_SCRIPT,
+                    1,
+                    f"{ACCOUNT_PACE_KEY_PREFIX}{account_id}",
+                    gap_ms,
+                    max_wait_ms,
+                ),
+                timeout=max(1, settings.telegram_rate_limit_redis_timeout_ms) / 1000,
+            )
+            return bool(int(granted)), max(0, int(wait_ms))
+        except Exception:
+            await inc_metric(metric_key("userbot.account_pacer.local_fallback", service="userbot"))
+            return self._local_reserve(account_id, gap_ms, max_wait_ms)
+
+    async def peek(self, account_id: str) -> int:
+        _, wait_ms = await self._run(account_id, 0, 0)
+        return wait_ms
+
+    async def reserve(self, account_id: str, max_wait_ms: int) -> tuple[bool, int]:
+        gap_ms = self.gap_ms()
+        if gap_ms <= 0:
+            return True, 0
+        return await self._run(account_id, gap_ms, max(0, int(max_wait_ms)))
+
+    async def block_for(self, account_id: str, block_ms: int) -> None:
+        block_ms = max(0, int(block_ms))
+        if block_ms <= 0:
+            return
+        now_ms = int(time.time() * 1000)
+        self._local_next_at_ms[account_id] = max(
+            self._local_next_at_ms.get(account_id, 0), now_ms + block_ms
+        )
+        try:
+            await asyncio.wait_for(
+                redis_client.eval(
+                    ACCOUNT_BLOCK_SCRIPT,
+                    1,
+                    f"{ACCOUNT_PACE_KEY_PREFIX}{account_id}",
+                    block_ms,
+                ),
+                timeout=max(1, settings.telegram_rate_limit_redis_timeout_ms) / 1000,
+            )
+        except Exception:
+            self.logger.warning("account block not stored in redis account_id=%s", account_id)
@@ -1,11 +1,10 @@
 import asyncio
 import logging
-import random
 import uuid
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from collections.abc import Sequence
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 
 from pyrogram import Client
@@ -17,16 +16,23 @@ from pyrogram.errors import (
     SessionPasswordNeeded,
 )
 from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from app.config import settings
 from app.db import db_session
+from app.metrics import inc_metric, metric_key
 from app.models import (
     BroadcastAttempt,
     BroadcastConfig,
+    GroupPeerHash,
     TelegramAccount,
     User,
     UserGroup,
 )
+from app.services.attempt_outcome_sink import AttemptOutcomeSink
+from app.services.campaign_due_index import CampaignDueIndex
+from app.services.client_pool import ClientPool
+from app.services.telegram_rate_limiter import AccountPacer, TelegramSendLimiter
 from app.utils import (
     build_attempt_idempotency_key,
     classify_telegram_error,
@@ -35,6 +41,9 @@ from app.utils import (
     utcnow,
 )
 
+# asyncpg sends bind parameters with a 16-bit count.
+POSTGRES_MAX_BIND_PARAMS = 32767
+
 
 @dataclass
 class BroadcastExecutionResult:
@@ -45,14 +54,47 @@ class BroadcastExecutionResult:
     summary: dict | None = None
 
 
+@dataclass
+class BroadcastRunState:
+    """Per-cycle campaign state loaded once and reused by every send slice."""
+
+    user_id: int
+    message_text: str
+    campaign_id: str
+    queued_at: str | None
+    cycle_interval_seconds: int
+    account_ids: list[str]
+    target_groups: list[UserGroup]
+    # Accounts withdrawn on FloodWait, by monotonic time they may send again.
+    flood_blocked_until: dict[str, float] = field(default_factory=dict)
+
+    def flood_blocked_ms(self) -> dict[str, int]:
+        """Remaining FloodWait per still-blocked account; expired blocks are dropped."""
+        now = time.monotonic()
+        for account_id, until in list(self.flood_blocked_until.items()):
+            if until <= now:
+                del self.flood_blocked_until[account_id]
+        return {
+            account_id: max(1, int((until - now) * 1000))
+            for account_id, until in self.flood_blocked_until.items()
+        }
+
+
 class UserbotService:
     def __init__(self):
         self.logger = logging.getLogger("userbot_service")
         self.login_temp: dict[int, dict] = {}
         self.login_clients: dict[int, Client] = {}
-        self.connected_clients: dict[str, Client] = {}
         self.peer_cache_warmed: set[str] = set()
-        self.client_lock = asyncio.Lock()
+        # Stored access hashes per account, by group pk; loaded when a client starts.
+        self.peer_hashes: dict[str, dict[int, str]] = {}
+        self.client_pool = ClientPool(on_evict=self.forget_account_peers)
+        self.outcome_sink = AttemptOutcomeSink()
+        self.send_limiter = TelegramSendLimiter()
+        self.account_pacer = AccountPacer()
+        self.due_index = CampaignDueIndex()
+        # Set on worker shutdown: lanes finish the send in hand and claim nothing more.
+        self.draining = asyncio.Event()
 
         self.remote_groups_cache: dict[str, dict] = {}
         self.remote_groups_inflight: dict[str, asyncio.Task] = {}
@@ -385,53 +427,181 @@ class UserbotService:
                         is_flood_wait=False,
                     )
                 )
+        await self.due_index.refresh_user(str(user_id))
+
+    @staticmethod
+    def is_channel_peer(group: UserGroup) -> bool:
+        return str(group.type or "") == "supergroup" or str(group.id).startswith("-100")
 
-    async def get_connected_client(
-        self, user_id: int, account_id: str
-    ) -> Client | None:
-        async with self.client_lock:
-            cached = self.connected_clients.get(account_id)
-            if cached:
-                return cached
+    @staticmethod
+    def known_access_hash(
+        group: UserGroup, account_id: str, hashes: dict[int, str] | None = None
+    ) -> str | None:
+        """The group's access hash for ``account_id``, if one is stored.
+
+        ``hashes`` holds the account's rows from ``group_peer_hashes``; the
+        hash saved on the group itself only counts for the account it came from.
+        """
+        access_hash = (hashes or {}).get(group.pk)
+        if access_hash:
+            return access_hash
+        if group.access_hash and group.peer_account_id == account_id:
+            return group.access_hash
+        return None
 
-            async with db_session() as db:
-                account = await db.get(TelegramAccount, account_id)
-                if not account or not account.is_active:
-                    return None
-
-                client = Client(
-                    name=f"acc_{account.id}",
-                    api_id=settings.tg_api_id,
-                    api_hash=settings.tg_api_hash,
-                    session_string=account.session_string,
-                    in_memory=True,
-                    sleep_threshold=0,
-                    no_updates=True,
+    @staticmethod
+    def build_known_peers(
+        groups: Sequence[UserGroup], account_id: str, hashes: dict[int, str] | None = None
+    ) -> tuple[list[tuple[int, int, str, None, None]], list[UserGroup]]:
+        """Split target groups into peer rows to seed and channels still unresolved.
+
+        Basic groups resolve without an access hash. A channel's hash is only
+        valid for the account that obtained it, so hashes learned through
+        another account count as unresolved.
+        """
+        peers: list[tuple[int, int, str, None, None]] = []
+        unresolved: list[UserGroup] = []
+        for group in groups:
+            if not UserbotService.is_channel_peer(group):
+                continue
+            access_hash = UserbotService.known_access_hash(group, account_id, hashes)
+            if access_hash:
+                try:
+                    peers.append((int(group.id), int(access_hash), "supergroup", None, None))
+                    continue
+                except ValueError:
+                    pass
+            unresolved.append(group)
+        return peers, unresolved
+
+    def forget_account_peers(self, account_id: str) -> None:
+        self.peer_cache_warmed.discard(account_id)
+        self.peer_hashes.pop(account_id, None)
+
+    async def load_peer_hashes(self, account_id: str) -> dict[int, str]:
+        async with db_session() as db:
+            rows = (
+                await db.execute(
+                    select(GroupPeerHash.group_pk, GroupPeerHash.access_hash).where(
+                        GroupPeerHash.account_id == account_id
+                    )
                 )
-                await client.start()
-                if account_id not in self.peer_cache_warmed:
-                    try:
-                        async for _ in client.get_dialogs():
-                            pass
-                        self.peer_cache_warmed.add(account_id)
-                    except Exception as e:
-                        self.logger.warning(
-                            "peer cache warmup failed account_id=%s error=%s",
-                            account_id,
-                            str(e),
+            ).all()
+        hashes = {int(group_pk): str(access_hash) for group_pk, access_hash in rows}
+        self.peer_hashes[account_id] = hashes
+        return hashes
+
+    @staticmethod
+    async def _stored_access_hash(client: Client, chat_id: int | str) -> str | None:
+        try:
+            peer = await client.storage.get_peer_by_id(int(chat_id))
+        except Exception:
+            return None
+        access_hash = getattr(peer, "access_hash", None)
+        return str(access_hash) if access_hash is not None else None
+
+    async def remember_peer_hashes(
+        self, client: Client, account_id: str, groups: Sequence[UserGroup]
+    ) -> int:
+        rows: list[dict] = []
+        hashes = self.peer_hashes.setdefault(account_id, {})
+        now = utcnow()
+        for group in groups:
+            access_hash = await self._stored_access_hash(client, group.id)
+            if access_hash is None:
+                continue
+            hashes[group.pk] = access_hash
+            rows.append(
+                {
+                    "group_pk": group.pk,
+                    "account_id": account_id,
+                    "access_hash": access_hash,
+                    "updated_at": now,
+                }
+            )
+        if not rows:
+            return 0
+        stmt = pg_insert(GroupPeerHash).values(rows)
+        async with db_session() as db:
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[GroupPeerHash.group_pk, GroupPeerHash.account_id],
+                    set_={
+                        "access_hash": stmt.excluded.access_hash,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+            )
+        return len(rows)
+
+    async def _start_client(self, account_id: str) -> Client | None:
+        async with db_session() as db:
+            account = await db.get(TelegramAccount, account_id)
+            if not account or not account.is_active:
+                return None
+            target_groups = (
+                (
+                    await db.execute(
+                        select(UserGroup).where(
+                            UserGroup.user_id == account.user_id,
+                            UserGroup.is_active.is_(True),
                         )
-                self.connected_clients[account_id] = client
-                return client
+                    )
+                )
+                .scalars()
+                .all()
+            )
 
-    async def cleanup_broadcast_clients(self) -> None:
-        async with self.client_lock:
-            for _, cli in self.connected_clients.items():
-                try:
-                    await cli.stop()
-                except Exception:
+        client = Client(
+            name=f"acc_{account.id}",
+            api_id=settings.tg_api_id,
+            api_hash=settings.tg_api_hash,
+            session_string=account.session_string,
+            in_memory=True,
+            sleep_threshold=0,
+            no_updates=True,
+        )
+        await client.start()
+
+        hashes = await self.load_peer_hashes(account_id)
+        known_peers, unresolved = self.build_known_peers(target_groups, account_id, hashes)
+        if known_peers:
+            await client.storage.update_peers(known_peers)
+        if unresolved and account_id not in self.peer_cache_warmed:
+            # Only page through dialogs when some channel target has no usable hash.
+            try:
+                async for _ in client.get_dialogs():
                     pass
-            self.connected_clients = {}
-            self.peer_cache_warmed.clear()
+                self.peer_cache_warmed.add(account_id)
+                await self.remember_peer_hashes(client, account_id, unresolved)
+            except Exception as e:
+                self.logger.warning(
+                    "peer cache warmup failed account_id=%s error=%s",
+                    account_id,
+                    str(e),
+                )
+        return client
+
+    def connected_client(self, user_id: int, account_id: str):
+        """Lease a started client for ``account_id``; yields None if unavailable."""
+        return self.client_pool.lease(account_id, lambda: self._start_client(account_id))
+
+    @staticmethod
+    async def _client_dc_id(client: Client) -> int | None:
+        try:
+            return int(await client.storage.dc_id())
+        except Exception:
+            return None
+
+    async def drain(self) -> None:
+        """Stop claiming, flush buffered outcome writes and stop every pyrogram client."""
+        self.draining.set()
+        await self.outcome_sink.close()
+        await self.cleanup_broadcast_clients()
+
+    async def cleanup_broadcast_clients(self) -> None:
+        await self.client_pool.close()
+        self.peer_cache_warmed.clear()
 
     async def get_remote_groups(self, user_id: int) -> list[dict]:
         key = str(user_id)
@@ -499,54 +669,62 @@ class UserbotService:
         if not account:
             return []
 
-        client = await self.get_connected_client(user_id, account.id)
-        if not client:
-            return []
-
-        dialogs = [d async for d in client.get_dialogs()]
-        result: list[dict] = []
-        seen = set()
-        for d in dialogs:
-            chat = d.chat
-            if not chat:
-                continue
-            type_value = str(chat.type).lower()
-            is_group = type_value == "group" or type_value.endswith(".group")
-            is_supergroup = type_value == "supergroup" or type_value.endswith(
-                ".supergroup"
-            )
-            if not (is_group or is_supergroup):
-                continue
-            gid = self._normalize_remote_group_id(chat.id, chat.type)
-            if gid in seen:
-                continue
-            seen.add(gid)
-            result.append(
-                {
-                    "id": gid,
-                    "title": chat.title or gid,
-                    "type": "supergroup" if is_supergroup else "group",
-                    "access_hash": None,
-                }
-            )
-        return result
+        async with self.connected_client(user_id, account.id) as client:
+            if not client:
+                return []
+            dialogs = [d async for d in client.get_dialogs()]
+
+            result: list[dict] = []
+            seen = set()
+            for d in dialogs:
+                chat = d.chat
+                if not chat:
+                    continue
+                type_value = str(chat.type).lower()
+                is_group = type_value == "group" or type_value.endswith(".group")
+                is_supergroup = type_value == "supergroup" or type_value.endswith(
+                    ".supergroup"
+                )
+                if not (is_group or is_supergroup):
+                    continue
+                gid = self._normalize_remote_group_id(chat.id, chat.type)
+                if gid in seen:
+                    continue
+                seen.add(gid)
+                access_hash = (
+                    await self._stored_access_hash(client, gid) if is_supergroup else None
+                )
+                result.append(
+                    {
+                        "id": gid,
+                        "title": chat.title or gid,
+                        "type": "supergroup" if is_supergroup else "group",
+                        "access_hash": access_hash,
+                        "peer_account_id": account.id if access_hash else None,
+                    }
+                )
+            return result
 
     async def send_message_to_user(
         self, user_id: int, telegram_account_id: str, to: str, message: str
     ) -> dict:
-        client = await self.get_connected_client(user_id, telegram_account_id)
-        if not client:
-            return {"success": False, "error": "No active account"}
-        try:
-            await client.send_message(chat_id=to, text=message)
-            return {"success": True}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        async with self.connected_client(user_id, telegram_account_id) as client:
+            if not client:
+                return {"success": False, "error": "No active account"}
+            try:
+                await client.send_message(chat_id=to, text=message)
+                return {"success": True}
+            except Exception as e:
+                return {"success": False, "error": str(e)}
 
     async def recover_stuck_inflight_attempts(
-        self, user_id: int, campaign_id: str
+        self, user_id: int, campaign_id: str, fence: int | None = None
     ) -> int:
         cutoff = now_plus_ms(-settings.broadcast_inflight_stuck_ms)
+        stuck = BroadcastAttempt.started_at <= cutoff
+        if fence is not None:
+            # Rows claimed under an older lock belong to a holder that is gone.
+            stuck = or_(stuck, func.coalesce(BroadcastAttempt.claim_fence, 0) < fence)
         async with db_session() as db:
             result = await db.execute(
                 update(BroadcastAttempt)
@@ -554,7 +732,7 @@ class UserbotService:
                     BroadcastAttempt.user_id == str(user_id),
                     BroadcastAttempt.campaign_id == campaign_id,
                     BroadcastAttempt.status == "in-flight",
-                    BroadcastAttempt.started_at <= cutoff,
+                    stuck,
                 )
                 .values(
                     status="pending",
@@ -564,6 +742,246 @@ class UserbotService:
             )
             return result.rowcount or 0
 
+    @staticmethod
+    def build_claim_statement(
+        user_id: int,
+        campaign_id: str,
+        account_id: str,
+        available_account_ids: list[str],
+        limit: int,
+        now: datetime,
+        fence: int | None = None,
+    ):
+        fence_filters = []
+        claim_values = {}
+        if fence is not None:
+            # A holder with an older fence must not take rows a newer one touched.
+            fence_filters.append(func.coalesce(BroadcastAttempt.claim_fence, 0) <= fence)
+            claim_values["claim_fence"] = fence
+        ready_ids = (
+            select(BroadcastAttempt.id)
+            .where(
+                BroadcastAttempt.user_id == str(user_id),
+                BroadcastAttempt.campaign_id == campaign_id,
+                BroadcastAttempt.status == "pending",
+                or_(
+                    BroadcastAttempt.assigned_account_id == account_id,
+                    BroadcastAttempt.assigned_account_id.is_(None),
+                    BroadcastAttempt.assigned_account_id.not_in(available_account_ids),
+                ),
+                or_(
+                    BroadcastAttempt.next_attempt_at.is_(None),
+                    BroadcastAttempt.next_attempt_at <= now,
+                ),
+                *fence_filters,
+            )
+            .order_by(
+                BroadcastAttempt.sequence.asc(),
+                BroadcastAttempt.created_at.asc(),
+            )
+            .limit(max(1, int(limit)))
+            .with_for_update(skip_locked=True)
+        )
+        return (
+            update(BroadcastAttempt)
+            .where(
+                BroadcastAttempt.id.in_(ready_ids),
+                BroadcastAttempt.status == "pending",
+            )
+            .values(
+                status="in-flight",
+                started_at=now,
+                assigned_account_id=account_id,
+                **claim_values,
+            )
+            .returning(BroadcastAttempt)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def claim_attempts(
+        self,
+        user_id: int,
+        campaign_id: str,
+        account_id: str,
+        available_account_ids: list[str],
+        limit: int,
+        fence: int | None = None,
+    ) -> list[BroadcastAttempt]:
+        stmt = self.build_claim_statement(
+            user_id=user_id,
+            campaign_id=campaign_id,
+            account_id=account_id,
+            available_account_ids=available_account_ids,
+            limit=limit,
+            now=utcnow(),
+            fence=fence,
+        )
+        async with db_session() as db:
+            claimed = list((await db.execute(stmt)).scalars().all())
+        # RETURNING order is not guaranteed; keep lanes sending in sequence order.
+        claimed.sort(key=lambda a: (a.sequence, a.created_at or datetime.min))
+        return claimed
+
+    async def release_claimed_attempts(
+        self, attempt_ids: list[str], fence: int | None = None
+    ) -> int:
+        if not attempt_ids:
+            return 0
+        fence_filters = [] if fence is None else [BroadcastAttempt.claim_fence == fence]
+        async with db_session() as db:
+            result = await db.execute(
+                update(BroadcastAttempt)
+                .where(
+                    BroadcastAttempt.id.in_(attempt_ids),
+                    BroadcastAttempt.status == "in-flight",
+                    *fence_filters,
+                )
+                .values(
+                    status="pending",
+                    started_at=None,
+                    next_attempt_at=utcnow(),
+                )
+            )
+            return result.rowcount or 0
+
+    async def mark_account_flood_wait(self, account_id: str, wait_seconds: int) -> datetime:
+        wait_seconds = max(1, int(wait_seconds))
+        flood_wait_until = now_plus_ms(wait_seconds * 1000)
+        async with db_session() as db:
+            account_user_id = await db.scalar(
+                update(TelegramAccount)
+                .where(
+                    TelegramAccount.id == account_id,
+                    or_(
+                        TelegramAccount.is_flood_wait.is_(False),
+                        TelegramAccount.flood_wait_until.is_(None),
+                        TelegramAccount.flood_wait_until < flood_wait_until,
+                    ),
+                )
+                .values(is_flood_wait=True, flood_wait_until=flood_wait_until)
+                .returning(TelegramAccount.user_id)
+            )
+        await self.account_pacer.block_for(account_id, wait_seconds * 1000)
+        if account_user_id is not None:
+            await self.due_index.refresh_user(account_user_id)
+        await inc_metric(metric_key("userbot.account.flood_wait", service="userbot"))
+        self.logger.warning(
+            "account flood wait account_id=%s seconds=%s until=%s",
+            account_id,
+            wait_seconds,
+            flood_wait_until.isoformat(),
+        )
+        return flood_wait_until
+
+    @staticmethod
+    def build_progress_statement(user_id: int, campaign_id: str, now: datetime):
+        is_pending = BroadcastAttempt.status == "pending"
+        return select(
+            func.count(BroadcastAttempt.id).filter(BroadcastAttempt.status == "sent"),
+            func.count(BroadcastAttempt.id).filter(
+                BroadcastAttempt.status == "failed-terminal"
+            ),
+            func.count(BroadcastAttempt.id).filter(is_pending),
+            func.count(BroadcastAttempt.id).filter(BroadcastAttempt.status == "in-flight"),
+            func.min(BroadcastAttempt.next_attempt_at).filter(
+                is_pending,
+                BroadcastAttempt.next_attempt_at > now,
+            ),
+            func.count(BroadcastAttempt.id).filter(
+                is_pending,
+                or_(
+                    BroadcastAttempt.next_attempt_at.is_(None),
+                    BroadcastAttempt.next_attempt_at <= now,
+                ),
+            ),
+            func.count(BroadcastAttempt.id).filter(
+                is_pending,
+                BroadcastAttempt.terminal_reason_code == "retriable-rate-limit",
+            ),
+        ).where(
+            BroadcastAttempt.user_id == str(user_id),
+            BroadcastAttempt.campaign_id == campaign_id,
+        )
+
+    @staticmethod
+    def summarize_progress(row: Sequence, now: datetime) -> dict:
+        (
+            sent,
+            failed,
+            pending,
+            in_flight,
+            min_pending_next_attempt,
+            ready_pending_count,
+            provider_constrained_pending,
+        ) = row
+        next_due_in_ms = 0
+        if min_pending_next_attempt is not None:
+            delta = (min_pending_next_attempt - now).total_seconds() * 1000
+            next_due_in_ms = max(0, int(delta))
+        return {
+            "sent": int(sent or 0),
+            "failed": int(failed or 0),
+            "pending": int(pending or 0),
+            "inFlight": int(in_flight or 0),
+            "nextDueInMs": next_due_in_ms,
+            "readyPendingCount": int(ready_pending_count or 0),
+            "providerConstrainedDelay": int(provider_constrained_pending or 0) > 0,
+        }
+
+    async def campaign_progress(self, user_id: int, campaign_id: str) -> dict:
+        now = utcnow()
+        async with db_session() as db:
+            row = (
+                await db.execute(self.build_progress_statement(user_id, campaign_id, now))
+            ).one()
+        return self.summarize_progress(row, now)
+
+    @staticmethod
+    def build_seed_rows(
+        user_id: int,
+        campaign_id: str,
+        target_groups: Sequence[UserGroup],
+        available_account_ids: list[str],
+        max_retries: int,
+        now: datetime,
+    ) -> list[dict]:
+        rows: list[dict] = []
+        for idx, group in enumerate(sorted(target_groups, key=lambda x: x.id)):
+            rows.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_id": str(user_id),
+                    "campaign_id": campaign_id,
+                    "target_group_id": group.id,
+                    "assigned_account_id": available_account_ids[
+                        idx % len(available_account_ids)
+                    ],
+                    "sequence": idx + 1,
+                    "status": "pending",
+                    "retry_count": 0,
+                    "max_retries": max_retries,
+                    "idempotency_key": build_attempt_idempotency_key(campaign_id, group.id),
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+        return rows
+
+    @staticmethod
+    def seed_chunk_size(column_count: int) -> int:
+        """Configured seed chunk size, clamped so one INSERT stays under the bind limit."""
+        limit = POSTGRES_MAX_BIND_PARAMS // max(1, int(column_count))
+        return max(1, min(int(settings.broadcast_seed_chunk_size), limit))
+
+    @staticmethod
+    def build_seed_statement(rows: list[dict]):
+        return (
+            pg_insert(BroadcastAttempt)
+            .values(rows)
+            .on_conflict_do_nothing()
+            .returning(BroadcastAttempt.id)
+        )
+
     async def seed_campaign_attempts_if_needed(
         self,
         user_id: int,
@@ -571,7 +989,7 @@ class UserbotService:
         target_groups: Sequence[UserGroup],
         available_account_ids: list[str],
         max_retries: int,
-    ) -> None:
+    ) -> dict:
         async with db_session() as db:
             rows = (
                 await db.execute(
@@ -589,34 +1007,35 @@ class UserbotService:
             )
 
             if total_existing > 0 and active_existing > 0:
-                return
-
-            for idx, group in enumerate(sorted(target_groups, key=lambda x: x.id)):
-                account_id = available_account_ids[idx % len(available_account_ids)]
-                idem = build_attempt_idempotency_key(campaign_id, group.id)
-                exists = (
-                    await db.execute(
-                        select(BroadcastAttempt.id).where(
-                            BroadcastAttempt.idempotency_key == idem
-                        )
-                    )
-                ).scalar_one_or_none()
-                if exists:
-                    continue
-                db.add(
-                    BroadcastAttempt(
-                        id=str(uuid.uuid4()),
-                        user_id=str(user_id),
-                        campaign_id=campaign_id,
-                        target_group_id=group.id,
-                        assigned_account_id=account_id,
-                        sequence=idx + 1,
-                        status="pending",
-                        retry_count=0,
-                        max_retries=max_retries,
-                        idempotency_key=idem,
-                    )
-                )
+                return {"inserted": 0, "existing": total_existing, "skipped": True}
+
+            seed_rows = self.build_seed_rows(
+                user_id=user_id,
+                campaign_id=campaign_id,
+                target_groups=target_groups,
+                available_account_ids=available_account_ids,
+                max_retries=max_retries,
+                now=utcnow(),
+            )
+            # The idempotency_key / (campaign_id, target_group_id) unique
+            # constraints make re-seeding a no-op for rows that already exist.
+            inserted = 0
+            chunk_size = self.seed_chunk_size(len(seed_rows[0]) if seed_rows else 1)
+            for start in range(0, len(seed_rows), chunk_size):
+                chunk = seed_rows[start : start + chunk_size]
+                result = await db.execute(self.build_seed_statement(chunk))
+                inserted += len(result.all())
+
+        existing = len(seed_rows) - inserted
+        if inserted > 0:
+            self.logger.info(
+                "campaign attempts seeded user_id=%s campaign_id=%s inserted=%s existing=%s",
+                user_id,
+                campaign_id,
+                inserted,
+                existing,
+            )
+        return {"inserted": inserted, "existing": existing, "skipped": False}
 
     async def broadcast_message(
         self,
@@ -625,18 +1044,32 @@ class UserbotService:
         campaign_id: str,
         queued_at: str | None,
         max_attempts_per_run: int,
+        fence: int | None = None,
+        lease_lost: asyncio.Event | None = None,
     ) -> BroadcastExecutionResult:
-        max_retries = settings.broadcast_max_retries
-        retry_base_ms = settings.broadcast_retry_base_ms
-        retry_max_ms = settings.broadcast_retry_max_ms
-        retry_jitter_ratio = settings.broadcast_retry_jitter_ratio
-
-        per_account_delay_min_ms = max(0, int(settings.telegram_per_account_min_delay_ms))
-        per_account_delay_max_ms = max(
-            per_account_delay_min_ms,
-            int(getattr(settings, "telegram_per_account_max_delay_ms", per_account_delay_min_ms)),
+        prepared = await self.prepare_broadcast(
+            user_id, message_text, campaign_id, queued_at, fence
+        )
+        if isinstance(prepared, BroadcastExecutionResult):
+            return prepared
+        return await self.run_broadcast_slice(
+            prepared, max_attempts_per_run, fence=fence, lease_lost=lease_lost
         )
 
+    async def prepare_broadcast(
+        self,
+        user_id: int,
+        message_text: str,
+        campaign_id: str,
+        queued_at: str | None,
+        fence: int | None = None,
+    ) -> BroadcastRunState | BroadcastExecutionResult:
+        """Load config, accounts and targets, recycle the cycle and seed attempts.
+
+        Returns an early result when there is nothing to send.
+        """
+        max_retries = settings.broadcast_max_retries
+
         async with db_session() as db:
             campaign_db_id = int(campaign_id) if str(campaign_id).isdigit() else None
             config = (
@@ -749,100 +1182,129 @@ class UserbotService:
             return BroadcastExecutionResult(success=True, count=0, errors=[])
 
         available_ids = [a.id for a in active_accounts]
-        await self.recover_stuck_inflight_attempts(user_id, campaign_id)
+        await self.recover_stuck_inflight_attempts(user_id, campaign_id, fence)
         await self.seed_campaign_attempts_if_needed(
             user_id, campaign_id, list(target_groups), available_ids, max_retries
         )
+        return BroadcastRunState(
+            user_id=user_id,
+            message_text=message_text,
+            campaign_id=campaign_id,
+            queued_at=queued_at,
+            cycle_interval_seconds=cycle_interval_seconds,
+            account_ids=available_ids,
+            target_groups=list(target_groups),
+        )
 
-        target_by_id = {g.id: g for g in target_groups}
-
-        rate_lock = asyncio.Lock()
-        timestamps: list[float] = []
+    async def run_broadcast_slice(
+        self,
+        state: BroadcastRunState,
+        max_attempts_per_run: int,
+        fence: int | None = None,
+        lease_lost: asyncio.Event | None = None,
+    ) -> BroadcastExecutionResult:
+        """Claim and send up to ``max_attempts_per_run`` attempts with one lane per account."""
+        user_id = state.user_id
+        message_text = state.message_text
+        campaign_id = state.campaign_id
+        queued_at = state.queued_at
+        cycle_interval_seconds = state.cycle_interval_seconds
+        available_ids = list(state.account_ids)
+        target_groups = state.target_groups
+        pacing_max_wait_ms = max(0, int(settings.telegram_per_account_max_wait_ms))
 
-        async def acquire_global_slot() -> None:
-            async with rate_lock:
-                while True:
-                    now = datetime.utcnow().timestamp()
-                    while timestamps and now - timestamps[0] >= 1:
-                        timestamps.pop(0)
-                    if len(timestamps) < settings.telegram_global_mps:
-                        timestamps.append(now)
-                        return
-                    await asyncio.sleep(max(0.001, 1 - (now - timestamps[0])))
+        target_by_id = {g.id: g for g in target_groups}
+        # Accounts blocked in an earlier slice stay out until their wait ends.
+        flood_blocked: dict[str, int] = state.flood_blocked_ms()
+        available_ids = [a for a in available_ids if a not in flood_blocked]
+        live_account_ids = list(available_ids)
 
         budget_lock = asyncio.Lock()
         sent_count_lock = asyncio.Lock()
         attempts_claimed = 0
         sent_this_run = 0
 
-        async def reserve_slot() -> bool:
+        claim_batch_size = max(1, int(settings.broadcast_claim_batch_size))
+
+        async def reserve_slots(requested: int) -> int:
+            nonlocal attempts_claimed
+            async with budget_lock:
+                remaining = max(1, max_attempts_per_run) - attempts_claimed
+                granted = max(0, min(requested, remaining))
+                attempts_claimed += granted
+                return granted
+
+        async def return_slots(count: int) -> None:
             nonlocal attempts_claimed
+            if count <= 0:
+                return
             async with budget_lock:
-                if attempts_claimed >= max(1, max_attempts_per_run):
-                    return False
-                attempts_claimed += 1
-                return True
+                attempts_claimed = max(0, attempts_claimed - count)
+
+        async def record_outcome(attempt_id: str, values: dict) -> None:
+            await self.outcome_sink.record(attempt_id, values, fence=fence)
 
         async def run_attempt(attempt: BroadcastAttempt, account_id: str) -> None:
+            async with self.connected_client(user_id, account_id) as client:
+                await send_attempt(attempt, account_id, client)
+
+        async def send_attempt(
+            attempt: BroadcastAttempt, account_id: str, client: Client | None
+        ) -> None:
             nonlocal sent_this_run
-            client = await self.get_connected_client(user_id, account_id)
             if not client:
-                async with db_session() as db:
-                    await db.execute(
-                        update(BroadcastAttempt)
-                        .where(
-                            BroadcastAttempt.id == attempt.id,
-                            BroadcastAttempt.status == "in-flight",
-                        )
-                        .values(
-                            status="pending",
-                            next_attempt_at=now_plus_ms(30000),
-                            last_error=f"Client unavailable for account {account_id}",
-                        )
-                    )
+                await record_outcome(
+                    attempt.id,
+                    dict(
+                        status="pending",
+                        next_attempt_at=now_plus_ms(30000),
+                        last_error=f"Client unavailable for account {account_id}",
+                    ),
+                )
                 return
 
             target = target_by_id.get(attempt.target_group_id)
             if not target:
-                async with db_session() as db:
-                    await db.execute(
-                        update(BroadcastAttempt)
-                        .where(
-                            BroadcastAttempt.id == attempt.id,
-                            BroadcastAttempt.status == "in-flight",
-                        )
-                        .values(
-                            status="failed-terminal",
-                            terminal_reason_code="missing-target",
-                            last_error="Target group not found",
-                        )
-                    )
+                await record_outcome(
+                    attempt.id,
+                    dict(
+                        status="failed-terminal",
+                        terminal_reason_code="missing-target",
+                        last_error="Target group not found",
+                    ),
+                )
                 return
 
             try:
-                await acquire_global_slot()
+                await self.send_limiter.acquire(await self._client_dc_id(client))
                 await client.send_message(chat_id=int(target.id), text=message_text)
                 cycle_next_due = self.compute_cycle_next_due(
                     queued_at=queued_at,
                     cycle_interval_seconds=cycle_interval_seconds,
                 )
-                async with db_session() as db:
-                    await db.execute(
-                        update(BroadcastAttempt)
-                        .where(
-                            BroadcastAttempt.id == attempt.id,
-                            BroadcastAttempt.status == "in-flight",
-                        )
-                        .values(
-                            status="sent",
-                            sent_at=utcnow(),
-                            next_attempt_at=cycle_next_due,
-                            terminal_reason_code=None,
-                            last_error=None,
-                        )
-                    )
+                await record_outcome(
+                    attempt.id,
+                    dict(
+                        status="sent",
+                        sent_at=utcnow(),
+                        next_attempt_at=cycle_next_due,
+                        terminal_reason_code=None,
+                        last_error=None,
+                    ),
+                )
                 async with sent_count_lock:
                     sent_this_run += 1
+                if self.is_channel_peer(target) and not self.known_access_hash(
+                    target, account_id, self.peer_hashes.get(account_id)
+                ):
+                    try:
+                        await self.remember_peer_hashes(client, account_id, [target])
+                    except Exception:
+                        self.logger.warning(
+                            "remember peer hash failed account_id=%s group_id=%s",
+                            account_id,
+                            target.id,
+                        )
             except Exception as e:
                 err_msg = normalize_error_message(e)
                 classified = classify_telegram_error(
@@ -852,6 +1314,37 @@ class UserbotService:
                 retry_count = attempt.retry_count + 1
                 exhausted = self.is_retry_exhausted(retry_count, attempt.max_retries)
 
+                if bool(classified.get("is_flood_wait", False)):
+                    # The account is throttled, not the target: withdraw the account
+                    # and hand the attempt to another one without spending a retry.
+                    wait_seconds = int(
+                        classified.get("retry_after_seconds")
+                        or settings.telegram_flood_wait_default_seconds
+                    )
+                    if account_id not in flood_blocked:
+                        flood_blocked[account_id] = wait_seconds * 1000
+                        state.flood_blocked_until[account_id] = time.monotonic() + wait_seconds
+                        if account_id in live_account_ids:
+                            live_account_ids.remove(account_id)
+                        await self.mark_account_flood_wait(account_id, wait_seconds)
+                    await record_outcome(
+                        attempt.id,
+                        dict(
+                            status="pending",
+                            next_attempt_at=(
+                                utcnow()
+                                if live_account_ids
+                                else now_plus_ms(wait_seconds * 1000)
+                            ),
+                            assigned_account_id=(
+                                live_account_ids[0] if live_account_ids else account_id
+                            ),
+                            last_error=err_msg,
+                            terminal_reason_code="retriable-rate-limit",
+                        ),
+                    )
+                    return
+
                 if self.should_retry_retriable(
                     classified=classified,
                     next_retry_count=retry_count,
@@ -862,111 +1355,98 @@ class UserbotService:
                     )
                     next_account_id = account_id
                     if bool(classified.get("is_slowmode", False)):
-                        next_account_id = self.rotate_account_id(account_id, available_ids)
-                    async with db_session() as db:
-                        await db.execute(
-                            update(BroadcastAttempt)
-                            .where(
-                                BroadcastAttempt.id == attempt.id,
-                                BroadcastAttempt.status == "in-flight",
-                            )
-                            .values(
-                                status="pending",
-                                retry_count=retry_count,
-                                next_attempt_at=now_plus_ms(retry_delay_ms),
-                                assigned_account_id=next_account_id,
-                                last_error=err_msg,
-                                terminal_reason_code="retriable-rate-limit",
-                            )
-                        )
+                        next_account_id = self.rotate_account_id(account_id, live_account_ids)
+                    await record_outcome(
+                        attempt.id,
+                        dict(
+                            status="pending",
+                            retry_count=retry_count,
+                            next_attempt_at=now_plus_ms(retry_delay_ms),
+                            assigned_account_id=next_account_id,
+                            last_error=err_msg,
+                            terminal_reason_code="retriable-rate-limit",
+                        ),
+                    )
                 else:
-                    async with db_session() as db:
-                        await db.execute(
-                            update(BroadcastAttempt)
-                            .where(
-                                BroadcastAttempt.id == attempt.id,
-                                BroadcastAttempt.status == "in-flight",
-                            )
-                            .values(
-                                status="failed-terminal",
-                                retry_count=retry_count,
-                                terminal_reason_code=(
-                                    "retry-exhausted"
-                                    if exhausted
-                                    else classified["terminal_code"]
-                                ),
-                                last_error=err_msg,
-                            )
-                        )
-
-            per_group_delay_ms = random.randint(
-                per_account_delay_min_ms,
-                per_account_delay_max_ms,
-            )
-            if per_group_delay_ms > 0:
-                await asyncio.sleep(per_group_delay_ms / 1000)
+                    await record_outcome(
+                        attempt.id,
+                        dict(
+                            status="failed-terminal",
+                            retry_count=retry_count,
+                            terminal_reason_code=(
+                                "retry-exhausted"
+                                if exhausted
+                                else classified["terminal_code"]
+                            ),
+                            last_error=err_msg,
+                        ),
+                    )
 
         worker_tasks = []
+        pacing_delays_ms: list[int] = list(flood_blocked.values())
+        budget_exhausted = False
 
         async def lane(account_id: str):
-            while True:
-                reserved = await reserve_slot()
-                if not reserved:
-                    break
-
-                async with db_session() as db:
-                    attempt = (
-                        (
-                            await db.execute(
-                                select(BroadcastAttempt)
-                                .where(
-                                    BroadcastAttempt.user_id == str(user_id),
-                                    BroadcastAttempt.campaign_id == campaign_id,
-                                    BroadcastAttempt.status == "pending",
-                                    or_(
-                                        BroadcastAttempt.assigned_account_id
-                                        == account_id,
-                                        BroadcastAttempt.assigned_account_id.is_(None),
-                                        BroadcastAttempt.assigned_account_id.not_in(
-                                            available_ids
-                                        ),
-                                    ),
-                                    or_(
-                                        BroadcastAttempt.next_attempt_at.is_(None),
-                                        BroadcastAttempt.next_attempt_at <= utcnow(),
-                                    ),
-                                )
-                                .order_by(
-                                    BroadcastAttempt.sequence.asc(),
-                                    BroadcastAttempt.created_at.asc(),
-                                )
-                                .limit(1)
-                            )
+            nonlocal budget_exhausted
+            buffered: deque[BroadcastAttempt] = deque()
+            try:
+                while True:
+                    if account_id in flood_blocked:
+                        pacing_delays_ms.append(flood_blocked[account_id])
+                        await return_slots(len(buffered))
+                        break
+                    if lease_lost is not None and lease_lost.is_set():
+                        # Another worker may hold the user now; stop and hand back.
+                        await return_slots(len(buffered))
+                        break
+                    if self.draining.is_set():
+                        await return_slots(len(buffered))
+                        break
+                    if not buffered:
+                        pacing_wait_ms = await self.account_pacer.peek(account_id)
+                        if pacing_wait_ms > pacing_max_wait_ms:
+                            pacing_delays_ms.append(pacing_wait_ms)
+                            break
+                        reserved = await reserve_slots(claim_batch_size)
+                        if reserved <= 0:
+                            budget_exhausted = True
+                            break
+                        # Rows assigned to withdrawn accounts are claimable by the rest.
+                        claimed = await self.claim_attempts(
+                            user_id=user_id,
+                            campaign_id=campaign_id,
+                            account_id=account_id,
+                            available_account_ids=list(live_account_ids),
+                            limit=reserved,
+                            fence=fence,
                         )
-                        .scalars()
-                        .first()
-                    )
+                        await return_slots(reserved - len(claimed))
+                        if not claimed:
+                            break
+                        buffered.extend(claimed)
 
-                    if not attempt:
+                    granted, pacing_wait_ms = await self.account_pacer.reserve(
+                        account_id, pacing_max_wait_ms
+                    )
+                    if not granted:
+                        # Another job took this account's slots; leave the rest for later.
+                        pacing_delays_ms.append(pacing_wait_ms)
+                        await return_slots(len(buffered))
                         break
+                    if pacing_wait_ms > 0:
+                        await asyncio.sleep(pacing_wait_ms / 1000)
 
-                    result = await db.execute(
-                        update(BroadcastAttempt)
-                        .where(
-                            BroadcastAttempt.id == attempt.id,
-                            BroadcastAttempt.status == "pending",
-                        )
-                        .values(
-                            status="in-flight",
-                            started_at=utcnow(),
-                            assigned_account_id=account_id,
-                        )
+                    attempt = buffered.popleft()
+                    await run_attempt(attempt, account_id)
+            finally:
+                try:
+                    await self.outcome_sink.flush()
+                except Exception:
+                    self.logger.exception(
+                        "outcome flush on lane exit failed account_id=%s", account_id
                     )
-
-                    if (result.rowcount or 0) == 0:
-                        continue
-
-                await run_attempt(attempt, account_id)
+                if buffered:
+                    await self.release_claimed_attempts([a.id for a in buffered], fence)
 
         for account_id in available_ids:
             for _ in range(max(1, settings.broadcast_per_account_concurrency)):
@@ -974,87 +1454,14 @@ class UserbotService:
 
         await asyncio.gather(*worker_tasks, return_exceptions=True)
 
-        min_pending_next_attempt = None
-        ready_pending_count = 0
-        provider_constrained_pending = 0
-        pending_reference_now = utcnow()
-        async with db_session() as db:
-            rows = (
-                await db.execute(
-                    select(BroadcastAttempt.status, func.count(BroadcastAttempt.id))
-                    .where(
-                        BroadcastAttempt.user_id == str(user_id),
-                        BroadcastAttempt.campaign_id == campaign_id,
-                    )
-                    .group_by(BroadcastAttempt.status)
-                )
-            ).all()
-
-            min_pending_next_attempt = (
-                await db.execute(
-                    select(func.min(BroadcastAttempt.next_attempt_at)).where(
-                        BroadcastAttempt.user_id == str(user_id),
-                        BroadcastAttempt.campaign_id == campaign_id,
-                        BroadcastAttempt.status == "pending",
-                        BroadcastAttempt.next_attempt_at.is_not(None),
-                        BroadcastAttempt.next_attempt_at > pending_reference_now,
-                    )
-                )
-            ).scalar_one_or_none()
-
-            ready_pending_count = int(
-                (
-                    await db.execute(
-                        select(func.count(BroadcastAttempt.id)).where(
-                            BroadcastAttempt.user_id == str(user_id),
-                            BroadcastAttempt.campaign_id == campaign_id,
-                            BroadcastAttempt.status == "pending",
-                            or_(
-                                BroadcastAttempt.next_attempt_at.is_(None),
-                                BroadcastAttempt.next_attempt_at
-                                <= pending_reference_now,
-                            ),
-                        )
-                    )
-                ).scalar_one()
-                or 0
-            )
-
-            provider_constrained_pending = int(
-                (
-                    await db.execute(
-                        select(func.count(BroadcastAttempt.id)).where(
-                            BroadcastAttempt.user_id == str(user_id),
-                            BroadcastAttempt.campaign_id == campaign_id,
-                            BroadcastAttempt.status == "pending",
-                            BroadcastAttempt.terminal_reason_code
-                            == "retriable-rate-limit",
-                        )
-                    )
-                ).scalar_one()
-                or 0
-            )
-
-        summary = {"sent": 0, "failed": 0, "pending": 0, "inFlight": 0}
-        for status, count in rows:
-            if status == "sent":
-                summary["sent"] = count
-            elif status == "failed-terminal":
-                summary["failed"] = count
-            elif status == "pending":
-                summary["pending"] = count
-            elif status == "in-flight":
-                summary["inFlight"] = count
-
-        next_due_in_ms = 0
-        if min_pending_next_attempt is not None:
-            delta = (min_pending_next_attempt - utcnow()).total_seconds() * 1000
-            next_due_in_ms = max(0, int(delta))
-        summary["nextDueInMs"] = next_due_in_ms
-        summary["readyPendingCount"] = ready_pending_count
-        summary["providerConstrainedDelay"] = provider_constrained_pending > 0
-
+        summary = await self.campaign_progress(user_id, campaign_id)
         summary["sentThisRun"] = sent_this_run
+        summary["attemptsThisRun"] = attempts_claimed
+        # Only a run that stopped on pacing alone should wait for the next free slot.
+        summary["accountPacingDelayMs"] = (
+            min(pacing_delays_ms) if pacing_delays_ms and not budget_exhausted else 0
+        )
+        summary["floodBlockedAccounts"] = len(flood_blocked)
 
         return BroadcastExecutionResult(
             success=summary["failed"] == 0
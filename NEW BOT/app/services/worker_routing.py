@@ -0,0 +1,216 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+
+from arq.constants import in_progress_key_prefix
+
+from app.config import settings
+from app.metrics import inc_metric, metric_key, set_gauge_metric
+from app.redis_client import redis_client
+
+
+MEMBERS_KEY = "broadcast:workers:members"
+RING_VNODES = 64
+
+# Moves the jobs of a worker queue onto another queue, keeping scores.
+# KEYS: source queue, target queue. ARGV: in-progress key prefix. A job that
+# is still running stays put: moving it would only have another worker find
+# it in progress, or run it twice once the first run finishes. Returns
+# {moved, left behind}.
+MOVE_QUEUE_SCRIPT = """
+local jobs = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+local moved = 0
+for i = 1, #jobs, 2 do
+  if redis.call('EXISTS', ARGV[1] .. jobs[i]) == 0 then
+    redis.call('ZADD', KEYS[2], jobs[i + 1], jobs[i])
+    redis.call('ZREM', KEYS[1], jobs[i])
+    moved = moved + 1
+  end
+end
+return {moved, #jobs / 2 - moved}
+"""
+
+
+def default_worker_id() -> str:
+    return settings.broadcast_worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def worker_queue_name(base_queue: str, worker_id: str) -> str:
+    return f"{base_queue}:w:{worker_id}"
+
+
+def member_ttl_ms() -> int:
+    return max(3000, int(settings.broadcast_worker_member_ttl_ms))
+
+
+class HashRing:
+    """Consistent hash ring: adding or removing a member only remaps its share of keys."""
+
+    def __init__(self, members: list[str], vnodes: int = RING_VNODES):
+        points = sorted(
+            (self.hash_key(f"{member}#{index}"), member)
+            for member in set(members)
+            for index in range(max(1, int(vnodes)))
+        )
+        self._hashes = [point for point, _ in points]
+        self._members = [member for _, member in points]
+
+    @staticmethod
+    def hash_key(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> str | None:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self.hash_key(key)) % len(self._hashes)
+        return self._members[index]
+
+
+class WorkerRouter:
+    """Routes a user's jobs to the queue of the worker that owns the user.
+
+    Owners come from a hash ring over the workers heartbeating in
+    ``MEMBERS_KEY``. Routing keys on the user id because one job sends from
+    all of a user's accounts, so keeping the user on one worker keeps every
+    one of its accounts' clients, peer caches and pacers on that process.
+    With routing disabled, no live worker or Redis unavailable, jobs go to
+    the shared class queue that every worker also consumes.
+    """
+
+    members_cache_ttl_s = 1.0
+
+    def __init__(self):
+        self.logger = logging.getLogger("worker_routing")
+        self._members: list[str] = []
+        self._ring = HashRing([])
+        self._loaded_at = float("-inf")
+
+    async def live_members(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._loaded_at < self.members_cache_ttl_s:
+            return self._members
+        now_ms = int(time.time() * 1000)
+        members = sorted(
+            str(member)
+            for member in await redis_client.zrangebyscore(
+                MEMBERS_KEY, now_ms - member_ttl_ms(), "+inf"
+            )
+        )
+        if members != self._members:
+            self._ring = HashRing(members)
+            self._members = members
+        self._loaded_at = now
+        return self._members
+
+    async def queue_for(self, user_id: str, base_queue: str) -> str:
+        if not settings.broadcast_worker_routing_enabled:
+            return base_queue
+        try:
+            await self.live_members()
+        except Exception:
+            await inc_metric(metric_key("queue.routing.error", service="queue"))
+            self.logger.warning("worker routing lookup failed user_id=%s", user_id)
+            return base_queue
+        owner = self._ring.owner(str(user_id))
+        if owner is None:
+            return base_queue
+        return worker_queue_name(base_queue, owner)
+
+    async def class_queues(self, base_queue: str) -> list[str]:
+        """The shared queue plus every live worker's queue for one class."""
+        if not settings.broadcast_worker_routing_enabled:
+            return [base_queue]
+        try:
+            members = await self.live_members()
+        except Exception:
+            return [base_queue]
+        return [base_queue, *(worker_queue_name(base_queue, member) for member in members)]
+
+
+class WorkerMembership:
+    """Heartbeats a worker into the routing ring and takes over dead workers' queues.
+
+    A member whose heartbeat is older than ``broadcast_worker_member_ttl_ms``
+    drops out of routing; any live worker then moves the jobs left in its
+    queues onto the shared class queues, where every worker can steal them.
+    Jobs still running are left until they finish or their in-progress key
+    expires. The move is repeated on each heartbeat for a grace period so
+    jobs routed from a stale cache are not stranded, after which the member
+    is removed once its queues are empty. On a clean stop, after its running
+    jobs are done, a worker marks itself expired, so routing skips it at once
+    while the sweep still covers late arrivals, and hands its queues over
+    itself.
+    """
+
+    def __init__(self, worker_id: str, base_queues: list[str]):
+        self.logger = logging.getLogger("worker_routing")
+        self.worker_id = worker_id
+        self.base_queues = list(base_queues)
+
+    def own_queues(self) -> list[str]:
+        return [worker_queue_name(base, self.worker_id) for base in self.base_queues]
+
+    async def move_queues(self, worker_id: str) -> tuple[int, int]:
+        """Move a worker's waiting jobs to the shared queues; returns (moved, still running)."""
+        moved = left = 0
+        for base in self.base_queues:
+            queue_moved, queue_left = await redis_client.eval(
+                MOVE_QUEUE_SCRIPT, 2, worker_queue_name(base, worker_id), base, in_progress_key_prefix
+            )
+            moved += int(queue_moved)
+            left += int(queue_left)
+        return moved, left
+
+    async def heartbeat(self) -> int:
+        """Refresh this worker's membership; returns how many orphaned jobs were moved."""
+        now_ms = int(time.time() * 1000)
+        ttl_ms = member_ttl_ms()
+        await redis_client.zadd(MEMBERS_KEY, {self.worker_id: now_ms})
+        moved = 0
+        stale = await redis_client.zrangebyscore(
+            MEMBERS_KEY, "-inf", now_ms - ttl_ms, withscores=True
+        )
+        for member, last_seen_ms in stale:
+            member = str(member)
+            if member == self.worker_id:
+                continue
+            member_moved, left = await self.move_queues(member)
+            moved += member_moved
+            if not left and last_seen_ms < now_ms - 3 * ttl_ms:
+                await redis_client.zrem(MEMBERS_KEY, member)
+        if moved:
+            await inc_metric(metric_key("worker.routing.stolen", service="worker"), moved)
+        await set_gauge_metric(
+            metric_key("worker.routing.members", service="worker"),
+            int(await redis_client.zcount(MEMBERS_KEY, now_ms - ttl_ms, "+inf")),
+        )
+        return moved
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        interval_s = max(500, int(settings.broadcast_worker_heartbeat_ms)) / 1000
+        while not stopping.is_set():
+            try:
+                await self.heartbeat()
+            except Exception:
+                await inc_metric(metric_key("worker.routing.heartbeat_failed", service="worker"))
+                self.logger.warning("worker heartbeat failed worker_id=%s", self.worker_id)
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=interval_s)
+            except asyncio.TimeoutError:
+                pass
+        await self.leave()
+
+    async def leave(self) -> None:
+        try:
+            expired_ms = int(time.time() * 1000) - member_ttl_ms() - 1
+            await redis_client.zadd(MEMBERS_KEY, {self.worker_id: expired_ms})
+            moved, _ = await self.move_queues(self.worker_id)
+        except Exception:
+            self.logger.warning("worker membership removal failed worker_id=%s", self.worker_id)
+            return
+        if moved:
+            await inc_metric(metric_key("worker.routing.handed_off", service="worker"), moved)
@@ -35,6 +35,13 @@ def classify_telegram_error(
     msg = normalize_error_message(error).upper()
     class_name = error.__class__.__name__.upper() if isinstance(error, Exception) else ""
     is_slowmode = "SLOWMODE" in msg or "SLOWMODE" in class_name
+    # Slow mode is per chat; any other flood wait throttles the whole account.
+    is_flood_wait = not is_slowmode and (
+        "FLOOD_WAIT" in msg
+        or "FLOOD_PREMIUM_WAIT" in msg
+        or "FLOODWAIT" in class_name
+        or "FLOOD_WAIT" in class_name
+    )
     retry_after_seconds = None
 
     for attr in ("seconds", "value"):
@@ -70,6 +77,7 @@ def classify_telegram_error(
             "terminal_code": "retriable-rate-limit",
             "retry_after_seconds": retry_after_seconds,
             "is_slowmode": is_slowmode,
+            "is_flood_wait": is_flood_wait,
         }
 
     if "FLOOD_WAIT" in class_name or "SLOWMODE" in class_name:
@@ -78,6 +86,7 @@ def classify_telegram_error(
             "terminal_code": "retriable-rate-limit",
             "retry_after_seconds": retry_after_seconds,
             "is_slowmode": is_slowmode,
+            "is_flood_wait": is_flood_wait,
         }
 
     terminal = next((t for t in TERMINAL_REASON_TOKENS if t in msg), None)
@@ -87,6 +96,7 @@ def classify_telegram_error(
             "terminal_code": terminal.lower(),
             "retry_after_seconds": None,
             "is_slowmode": False,
+            "is_flood_wait": False,
         }
 
     return {
@@ -94,6 +104,7 @@ def classify_telegram_error(
         "terminal_code": "unknown",
         "retry_after_seconds": None,
         "is_slowmode": False,
+        "is_flood_wait": False,
     }
 
 
@@ -144,3 +155,14 @@ def deterministic_jitter_ms(user_id: str, run_slot: int, jitter_max_ms: int) ->
     for ch in raw:
         h = ((h * 31) + ord(ch)) & 0xFFFFFFFF
     return h % (jitter_max_ms + 1)
+
+
+def parse_weight_map(raw: str | None) -> dict[str, int]:
+    """Parse ``name:weight,name:weight`` into a dict; malformed parts are skipped."""
+    weights: dict[str, int] = {}
+    for part in str(raw or "").split(","):
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name and value.strip().isdigit():
+            weights[name] = max(1, int(value))
+    return weights
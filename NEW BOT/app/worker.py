@@ -1,11 +1,23 @@
+import asyncio
 import logging
+import math
+import signal
 
 from app.config import settings
-from app.container import processor_service
+from app.container import processor_service, userbot_service
 from app.db import engine
 from app.logging_utils import configure_json_logging, log_event
 from app.metrics import inc_metric, metric_key, set_gauge_metric
 from app.models import Base
+from app.schema_upgrades import apply_schema_upgrades
+from app.services.broadcast_queue_service import (
+    PRIORITY_CLASSES,
+    class_weights,
+    job_timeout_s,
+    queue_name_for,
+)
+from app.services.worker_routing import WorkerMembership, default_worker_id, worker_queue_name
+from arq import Worker
 from arq.connections import RedisSettings
 
 configure_json_logging()
@@ -15,12 +27,17 @@ logger = logging.getLogger("worker")
 async def startup(ctx):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await apply_schema_upgrades(conn)
     await inc_metric(metric_key("worker.startup.count", service="worker"))
     log_event(logger, logging.INFO, "worker_startup_complete")
 
 
 async def shutdown(ctx):
-    return None
+    # Jobs have finished or been cancelled by now; make sure nothing claims
+    # again, then flush outcome writes and stop the pyrogram clients.
+    processor_service.begin_drain()
+    await userbot_service.drain()
+    log_event(logger, logging.INFO, "worker_shutdown_complete")
 
 
 async def process_broadcast_job(ctx, payload: dict):
@@ -55,10 +72,181 @@ async def process_broadcast_job(ctx, payload: dict):
     return result
 
 
+def drain_timeout_s() -> int:
+    return max(1, math.ceil(settings.broadcast_worker_drain_timeout_ms / 1000))
+
+
+async def refuse_single_queue_startup(ctx):
+    # One arq Worker reads one queue, but continuation and retry jobs (and
+    # routed ones) live in others that would then never drain.
+    raise RuntimeError(
+        "arq app.worker.WorkerSettings only reads the scheduled queue; "
+        "start workers with `python -m app.worker`"
+    )
+
+
 class WorkerSettings:
+    """Shared arq settings for the workers built by ``build_workers``.
+
+    Starting it directly with ``arq app.worker.WorkerSettings`` fails at
+    startup, since a single arq worker cannot consume every class queue.
+    """
+
     functions = [process_broadcast_job]
-    on_startup = startup
+    on_startup = refuse_single_queue_startup
     on_shutdown = shutdown
     redis_settings = RedisSettings.from_dsn(settings.redis_url)
     max_jobs = max(1, settings.broadcast_concurrency)
+    job_timeout = job_timeout_s()
     poll_delay = 2.0
+    # On SIGTERM arq stops picking jobs and gives running ones this long before cancelling.
+    job_completion_wait = drain_timeout_s()
+
+
+def class_max_jobs(total: int, weights: dict[str, int]) -> dict[str, int]:
+    """Split the job slots across queues by weight, at least one each.
+
+    The slots add up to exactly ``total``, or to one per queue when ``total``
+    is smaller, since every consumed queue needs a worker.
+    """
+    total = max(1, int(total), len(weights))
+    weight_sum = sum(weights.values()) or 1
+    shares = {name: total * weight / weight_sum for name, weight in weights.items()}
+    slots = {name: max(1, int(share)) for name, share in shares.items()}
+    while sum(slots.values()) > total:
+        name = max((name for name in slots if slots[name] > 1), key=lambda name: slots[name])
+        slots[name] -= 1
+    by_remainder = sorted(slots, key=lambda name: shares[name] - slots[name], reverse=True)
+    for name in by_remainder[: total - sum(slots.values())]:
+        slots[name] += 1
+    return slots
+
+
+def build_worker(queue_name: str, max_jobs: int) -> Worker:
+    return Worker(
+        functions=[process_broadcast_job],
+        queue_name=queue_name,
+        redis_settings=WorkerSettings.redis_settings,
+        max_jobs=max(1, int(max_jobs)),
+        job_timeout=WorkerSettings.job_timeout,
+        poll_delay=WorkerSettings.poll_delay,
+        job_completion_wait=WorkerSettings.job_completion_wait,
+        handle_signals=False,
+    )
+
+
+def build_workers(worker_id: str | None = None) -> list[Worker]:
+    """One arq worker per consumed queue.
+
+    With routing on, each class gets this worker's own queue, holding the
+    users it owns, plus the shared queue for unrouted and stolen jobs. Both
+    draw on one ``broadcast_concurrency`` budget: a class's own queue gets
+    twice the weight of its shared queue.
+    """
+    weights = class_weights()
+    queue_weights = {}
+    for priority_class in PRIORITY_CLASSES:
+        queue_name = queue_name_for(priority_class)
+        if settings.broadcast_worker_routing_enabled and worker_id:
+            queue_weights[worker_queue_name(queue_name, worker_id)] = 2 * weights[priority_class]
+        queue_weights[queue_name] = weights[priority_class]
+    max_jobs = class_max_jobs(settings.broadcast_concurrency, queue_weights)
+    return [build_worker(queue_name, slots) for queue_name, slots in max_jobs.items()]
+
+
+async def supervise_workers(workers: list[Worker], drain) -> bool:
+    """Run the workers until all stop; returns True if any of them failed.
+
+    A worker that fails, e.g. because it cannot reach Redis, would leave its
+    queue unconsumed while the others carry on, so the failure is logged and
+    ``drain`` winds the rest down for the supervisor to restart the process.
+    """
+    tasks = {asyncio.create_task(worker.async_run()): worker for worker in workers}
+    pending = set(tasks)
+    failed = drained = False
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.cancelled() or task.exception() is None:
+                continue
+            failed = True
+            log_event(
+                logger,
+                logging.ERROR,
+                "worker_queue_failed",
+                queue=tasks[task].queue_name,
+                error=repr(task.exception()),
+            )
+        if failed and pending and not drained:
+            drained = True
+            drain()
+    return failed
+
+
+async def run_workers() -> None:
+    """Consume every priority class in one process, sharing clients and startup."""
+    ctx: dict = {}
+    await startup(ctx)
+    worker_id = default_worker_id()
+    membership = WorkerMembership(
+        worker_id, [queue_name_for(priority_class) for priority_class in PRIORITY_CLASSES]
+    )
+    membership_stopping = asyncio.Event()
+    membership_task = None
+    if settings.broadcast_worker_routing_enabled:
+        membership_task = asyncio.create_task(membership.run(membership_stopping))
+    workers = build_workers(worker_id)
+    log_event(
+        logger,
+        logging.INFO,
+        "worker_queues_started",
+        worker_id=worker_id,
+        max_jobs={worker.queue_name: worker.max_jobs for worker in workers},
+    )
+    loop = asyncio.get_running_loop()
+    draining = asyncio.Event()
+
+    def stop(signum: signal.Signals) -> None:
+        if draining.is_set():
+            # A second signal skips the rest of the drain.
+            for worker in workers:
+                worker.handle_sig(signum)
+            return
+        draining.set()
+        log_event(
+            logger,
+            logging.INFO,
+            "worker_drain_started",
+            signal=signal.Signals(signum).name,
+            timeout_s=WorkerSettings.job_completion_wait,
+        )
+        # Running jobs stop claiming, send what they hold and requeue the rest.
+        # The worker stays in the ring until they are done, so its running
+        # jobs are not moved; it leaves it below, handing over what is queued.
+        processor_service.begin_drain()
+        for worker in workers:
+            worker.handle_sig_wait_for_completion(signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop, signum)
+
+    def drain_after_failure() -> None:
+        if not draining.is_set():
+            stop(signal.SIGTERM)
+
+    failed = False
+    try:
+        failed = await supervise_workers(workers, drain_after_failure)
+    finally:
+        if membership_task is not None:
+            membership_stopping.set()
+            await membership_task
+        for worker in workers:
+            await worker.close()
+        await shutdown(ctx)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_workers())
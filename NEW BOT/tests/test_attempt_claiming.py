@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app.services.userbot_service import UserbotService
+
+
+def _compile(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_claim_statement_uses_skip_locked_subquery_and_returning():
+    stmt = UserbotService.build_claim_statement(
+        user_id=10,
+        campaign_id="7",
+        account_id="acc-1",
+        available_account_ids=["acc-1", "acc-2"],
+        limit=4,
+        now=datetime(2026, 3, 1, 12, 0, 0),
+    )
+    sql = _compile(stmt)
+    assert sql.startswith("UPDATE broadcast_attempts")
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "RETURNING" in sql
+    assert "LIMIT" in sql
+
+
+def test_claim_statement_limit_is_at_least_one():
+    stmt = UserbotService.build_claim_statement(
+        user_id=10,
+        campaign_id="7",
+        account_id="acc-1",
+        available_account_ids=["acc-1"],
+        limit=0,
+        now=datetime(2026, 3, 1, 12, 0, 0),
+    )
+    compiled = stmt.compile(dialect=postgresql.dialect())
+    assert 1 in compiled.params.values()
+
+
+def test_fenced_claim_stamps_and_filters_by_fence():
+    stmt = UserbotService.build_claim_statement(
+        user_id=10,
+        campaign_id="7",
+        account_id="acc-1",
+        available_account_ids=["acc-1"],
+        limit=4,
+        now=datetime(2026, 3, 1, 12, 0, 0),
+        fence=42,
+    )
+    compiled = stmt.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "coalesce(broadcast_attempts.claim_fence" in sql
+    assert "claim_fence=" in sql.replace(" ", "")
+    assert 42 in compiled.params.values()
@@ -0,0 +1,161 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import app.services.attempt_outcome_sink as sink_mod
+from app.services.attempt_outcome_sink import AttemptOutcomeSink
+
+
+@pytest.fixture(autouse=True)
+def _no_metrics(monkeypatch):
+    async def fake_inc(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(sink_mod, "inc_metric", fake_inc)
+
+
+@pytest.mark.asyncio
+async def test_record_buffers_until_batch_size(monkeypatch):
+    sink = AttemptOutcomeSink(flush_interval_ms=60000, batch_size=3)
+    writes = []
+
+    async def fake_write(batch):
+        writes.append(dict(batch))
+
+    monkeypatch.setattr(sink, "_write_batch", fake_write)
+
+    await sink.record("a1", {"status": "sent"})
+    await sink.record("a2", {"status": "sent"})
+    assert writes == []
+    assert sink.pending_count == 2
+
+    await sink.record("a3", {"status": "pending"})
+    assert len(writes) == 1
+    assert set(writes[0]) == {"a1", "a2", "a3"}
+    assert sink.pending_count == 0
+    await sink.close()
+
+
+@pytest.mark.asyncio
+async def test_last_outcome_for_attempt_wins(monkeypatch):
+    sink = AttemptOutcomeSink(flush_interval_ms=60000, batch_size=10)
+    writes = []
+
+    async def fake_write(batch):
+        writes.append(dict(batch))
+
+    monkeypatch.setattr(sink, "_write_batch", fake_write)
+
+    await sink.record("a1", {"status": "pending"})
+    await sink.record("a1", {"status": "sent"})
+    assert await sink.flush() == 1
+    assert writes[0]["a1"] == {"status": "sent"}
+    await sink.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_entries_for_retry(monkeypatch):
+    sink = AttemptOutcomeSink(flush_interval_ms=60000, batch_size=10)
+
+    async def failing_write(batch):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(sink, "_write_batch", failing_write)
+    await sink.record("a1", {"status": "sent"})
+    with pytest.raises(RuntimeError):
+        await sink.flush()
+    assert sink.pending_count == 1
+
+    written = []
+
+    async def ok_write(batch):
+        written.extend(batch)
+
+    monkeypatch.setattr(sink, "_write_batch", ok_write)
+    await sink.close()
+    assert written == ["a1"]
+    assert sink.pending_count == 0
+
+
+def test_group_batch_splits_by_column_set():
+    groups = AttemptOutcomeSink.group_batch(
+        {
+            "a1": {"status": "sent", "last_error": None},
+            "a2": {"last_error": None, "status": "sent"},
+            "a3": {"status": "failed-terminal", "terminal_reason_code": "x"},
+        }
+    )
+    assert len(groups) == 2
+    assert len(groups[("last_error", "status")]) == 2
+
+
+def test_update_statement_keeps_in_flight_guard():
+    stmt = AttemptOutcomeSink.build_update_statement(("status", "sent_at"))
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "broadcast_attempts.status = " in sql
+    assert "WHERE broadcast_attempts.id = " in sql
+
+
+def test_fenced_update_guards_on_claim_fence_without_writing_it():
+    stmt = AttemptOutcomeSink.build_update_statement(("claim_fence", "status"))
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    set_clause, where_clause = sql.split(" WHERE ")
+    assert "claim_fence" not in set_clause
+    assert "broadcast_attempts.claim_fence = " in where_clause
+
+
+@pytest.mark.asyncio
+async def test_record_carries_fence_into_batch(monkeypatch):
+    sink = AttemptOutcomeSink(flush_interval_ms=10_000, batch_size=100)
+    await sink.record("a1", {"status": "sent"}, fence=7)
+    groups = AttemptOutcomeSink.group_batch(sink._pending)
+    assert groups[("claim_fence", "status")][0]["v_claim_fence"] == 7
+
+    async def fake_write(batch):
+        return None
+
+    monkeypatch.setattr(sink, "_write_batch", fake_write)
+    await sink.close()
+    assert sink._task is None
+
+
+@pytest.mark.asyncio
+async def test_repeatedly_failing_row_is_isolated_and_dropped(monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+
+    sink = AttemptOutcomeSink(flush_interval_ms=60000, batch_size=10, max_flush_attempts=2)
+    written = []
+
+    async def write(batch):
+        if "bad" in batch:
+            raise IntegrityError("UPDATE broadcast_attempts", {}, Exception("violates check"))
+        written.extend(batch)
+
+    monkeypatch.setattr(sink, "_write_batch", write)
+    await sink.record("bad", {"status": "sent"})
+    await sink.record("good", {"status": "sent"})
+    for _ in range(2):
+        with pytest.raises(IntegrityError):
+            await sink.flush()
+    assert written == []
+
+    assert await sink.flush() == 1
+    assert written == ["good"]
+    assert sink.pending_count == 0
+    await sink.close()
+
+
+@pytest.mark.asyncio
+async def test_isolated_row_is_kept_while_the_database_is_down(monkeypatch):
+    sink = AttemptOutcomeSink(flush_interval_ms=60000, batch_size=10, max_flush_attempts=1)
+
+    async def failing_write(batch):
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(sink, "_write_batch", failing_write)
+    await sink.record("a1", {"status": "sent"})
+    with pytest.raises(ConnectionError):
+        await sink.flush()
+    assert await sink.flush() == 0
+    assert sink.pending_count == 1
+    sink._pending.clear()
+    await sink.close()
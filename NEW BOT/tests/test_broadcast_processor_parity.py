@@ -23,7 +23,7 @@ class DummyQueue:
     def continuation_delay_ms(self):
         return 500
 
-    async def enqueue_send(self, **kwargs):
+    async def enqueue_continuation(self, **kwargs):
         self.calls.append(kwargs)
         return "job-1"
 
@@ -148,9 +148,11 @@ async def test_lock_busy_returns_non_failure_outcome(monkeypatch):
     assert out["error"] == "user-lock-busy"
     assert out["outcome"] == "lock-busy"
     assert len(userbot.calls) == 0
-    assert len(queue.calls) == 1
-    assert out["continuationEnqueued"] is True
-    assert out["continuationReason"] == "lock-busy-retry"
+    # Parked behind the holder instead of requeued.
+    assert len(queue.calls) == 0
+    assert out["continuationEnqueued"] is False
+    assert out["waiterQueued"] is True
+    assert out["continuationReason"] == "lock-waiter"
 
 
 @pytest.mark.asyncio
@@ -309,6 +311,47 @@ async def test_provider_constrained_ready_pending_uses_fast_continuation(monkeyp
     assert out["continuationReason"] == "ready-pending-fast"
 
 
+@pytest.mark.asyncio
+async def test_account_pacing_delay_extends_continuation(monkeypatch):
+    monkeypatch.setattr(settings, "bot_role", "worker", raising=False)
+    result = BroadcastExecutionResult(
+        success=False,
+        count=1,
+        errors=[],
+        error=None,
+        summary={
+            "failed": 0,
+            "pending": 4,
+            "inFlight": 0,
+            "sent": 1,
+            "providerConstrainedDelay": False,
+            "readyPendingCount": 4,
+            "nextDueInMs": 0,
+            "accountPacingDelayMs": 18000,
+        },
+    )
+    queue = DummyQueue()
+    service = BroadcastProcessorService(DummyUserbot(result), queue)
+    monkeypatch.setattr(
+        service, "acquire_user_lock", lambda *args, **kwargs: _async_true()
+    )
+    monkeypatch.setattr(
+        service, "release_user_lock", lambda *args, **kwargs: _async_none()
+    )
+
+    out = await service.process(
+        {
+            "userId": "10",
+            "message": "hello",
+            "campaignId": "cmp-1",
+            "queuedAt": "2026-01-01T00:00:00Z",
+        }
+    )
+
+    assert queue.calls[0]["delay_ms"] == 18000
+    assert out["continuationReason"] == "account-pacing"
+
+
 async def _async_true():
     return True
 
@@ -330,3 +373,269 @@ def test_resolve_cycle_anchor_prefers_queued_time():
 def test_resolve_cycle_anchor_falls_back_to_started_time():
     started_at = datetime(2026, 3, 9, 9, 42, 0)
     assert BroadcastProcessorService.resolve_cycle_anchor(None, started_at) == started_at
+
+
+class _Rows:
+    def __init__(self, value):
+        self.value = value
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.value
+
+    def scalar(self):
+        return self.value
+
+
+class _ConfigSession:
+    def __init__(self, config, message, queries):
+        self.config = config
+        self.message = message
+        self.queries = queries
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query):
+        self.queries.append(query)
+        if "broadcast_configs.message" in str(query) and "broadcast_configs.is_active" not in str(query):
+            return _Rows(self.message)
+        return _Rows(self.config)
+
+
+def _versioned_service(monkeypatch, version, queries):
+    import app.services.broadcast_processor_service as processor_mod
+    from types import SimpleNamespace
+
+    config = SimpleNamespace(id=5, is_active=True, interval=300, version=version)
+    monkeypatch.setattr(settings, "bot_role", "worker", raising=False)
+    monkeypatch.setattr(settings, "broadcast_fair_share_enabled", False, raising=False)
+    monkeypatch.setattr(
+        processor_mod, "db_session", lambda: _ConfigSession(config, "current text", queries)
+    )
+    userbot = DummyUserbot(BroadcastExecutionResult(True, 0, []))
+    service = BroadcastProcessorService(userbot, DummyQueue())
+    monkeypatch.setattr(service, "acquire_user_lock", lambda *a, **k: _async_true())
+    monkeypatch.setattr(service, "release_user_lock", lambda *a, **k: _async_none())
+    return service, userbot
+
+
+@pytest.mark.asyncio
+async def test_outdated_config_version_is_stale(monkeypatch):
+    service, userbot = _versioned_service(monkeypatch, version=3, queries=[])
+
+    out = await service.process(
+        {"userId": "10", "campaignId": "5", "queuedAt": "2026-01-01T00:00:00Z", "configVersion": 2}
+    )
+
+    assert out["outcome"] == "stale-message"
+    assert userbot.calls == []
+
+
+@pytest.mark.asyncio
+async def test_message_text_is_resolved_once_per_version(monkeypatch):
+    queries = []
+    service, userbot = _versioned_service(monkeypatch, version=3, queries=queries)
+    payload = {"userId": "10", "campaignId": "5", "queuedAt": "2026-01-01T00:00:00Z", "configVersion": 3}
+
+    await service.process(dict(payload))
+    await service.process(dict(payload))
+
+    assert [call["message_text"] for call in userbot.calls] == ["current text", "current text"]
+    # Two config lookups plus a single text lookup for the version.
+    assert len(queries) == 3
+
+
+@pytest.mark.asyncio
+async def test_legacy_payload_with_text_still_detects_stale_message(monkeypatch):
+    service, userbot = _versioned_service(monkeypatch, version=1, queries=[])
+
+    out = await service.process(
+        {"userId": "10", "campaignId": "5", "queuedAt": "2026-01-01T00:00:00Z", "message": "old text"}
+    )
+
+    assert out["outcome"] == "stale-message"
+
+
+@pytest.mark.asyncio
+async def test_lease_heartbeat_flags_lost_lock(monkeypatch):
+    import asyncio
+
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), DummyQueue()
+    )
+    renewals = iter([True, False])
+
+    async def renew(user_id, token):
+        return next(renewals)
+
+    monkeypatch.setattr(service, "user_lock_ttl_ms", lambda: 30)
+    monkeypatch.setattr(service, "renew_user_lock", renew)
+    lost = asyncio.Event()
+
+    await asyncio.wait_for(service.hold_user_lock("10", "tok", lost), timeout=1)
+    assert lost.is_set()
+
+
+@pytest.mark.asyncio
+async def test_holder_absorbs_same_run_waiters_and_hands_off_others(monkeypatch):
+    queue = DummyQueue()
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), queue
+    )
+
+    handed_off = await service.hand_off_waiters(
+        "10",
+        [
+            {"campaignId": "5", "queuedAt": "t1", "configVersion": 3},
+            {"campaignId": "5", "queuedAt": "t2", "configVersion": 4, "intervalSeconds": 300},
+            {"campaignId": "adhoc", "queuedAt": "t3", "message": "hi"},
+        ],
+        campaign_id="5",
+        config_version=3,
+        message="text",
+    )
+
+    assert handed_off == 2
+    assert [call["config_version"] for call in queue.calls] == [4, None]
+    assert queue.calls[0]["delay_ms"] == 0
+    assert queue.calls[1]["message"] == "hi"
+
+
+@pytest.mark.asyncio
+async def test_waiter_for_a_later_cycle_is_handed_off_not_absorbed(monkeypatch):
+    queue = DummyQueue()
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), queue
+    )
+
+    handed_off = await service.hand_off_waiters(
+        "10",
+        [
+            # The same cycle, e.g. a duplicate of the running job.
+            {"campaignId": "5", "queuedAt": "2026-01-01T00:00:00", "configVersion": 3},
+            # The next cycle, queued while this run overran its interval.
+            {"campaignId": "5", "queuedAt": "2026-01-01T00:05:00", "configVersion": 3},
+        ],
+        campaign_id="5",
+        config_version=3,
+        message="text",
+        cycle_anchor=datetime(2026, 1, 1, 0, 0),
+    )
+
+    assert handed_off == 1
+    assert queue.calls[0]["queued_at"] == "2026-01-01T00:05:00"
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_is_stopped_before_the_lock_is_released(monkeypatch):
+    import asyncio
+
+    service, _ = _versioned_service(monkeypatch, version=1, queries=[])
+    events = []
+
+    async def hold(user_id, token, lost):
+        try:
+            await asyncio.sleep(60)
+        finally:
+            events.append("heartbeat-stopped")
+
+    async def release(user_id, token):
+        events.append("released")
+        return []
+
+    monkeypatch.setattr(service, "hold_user_lock", hold)
+    monkeypatch.setattr(service, "release_user_lock", release)
+
+    await service.process(
+        {"userId": "10", "campaignId": "5", "queuedAt": "2026-01-01T00:00:00", "configVersion": 1}
+    )
+
+    assert events == ["heartbeat-stopped", "released"]
+
+
+@pytest.mark.asyncio
+async def test_waiters_outlive_the_job_timeout_and_failed_hand_offs_are_reparked(monkeypatch):
+    from app.services.broadcast_queue_service import job_timeout_s
+
+    class FailingQueue(DummyQueue):
+        async def enqueue_continuation(self, **kwargs):
+            raise ConnectionError("redis down")
+
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), FailingQueue()
+    )
+    parked = []
+
+    async def park(user_id, waiters):
+        parked.extend(waiters)
+
+    async def release(user_id, token):
+        return [{"campaignId": "7", "queuedAt": "t", "configVersion": 2}]
+
+    monkeypatch.setattr(service, "park_user_waiters", park)
+    monkeypatch.setattr(service, "release_user_lock", release)
+
+    await service.release_and_hand_off("10", "tok", "5", 3, "text")
+
+    assert [waiter["campaignId"] for waiter in parked] == ["7"]
+    assert service.user_waiters_ttl_ms() > job_timeout_s() * 1000
+
+
+@pytest.mark.asyncio
+async def test_failed_release_does_not_raise(monkeypatch):
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), DummyQueue()
+    )
+
+    async def release(user_id, token):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(service, "release_user_lock", release)
+
+    await service.release_and_hand_off("10", "tok", "5", 3, "text")
+
+
+@pytest.mark.asyncio
+async def test_fence_resumes_above_persisted_fence_after_redis_reset(monkeypatch):
+    import app.services.broadcast_processor_service as processor_mod
+
+    class ResetRedis:
+        """Mimics the acquire script over a fence counter that Redis lost."""
+
+        def __init__(self):
+            self.counters = {}
+            self.floors = []
+
+        async def eval(self, script, numkeys, lock_key, fence_key, waiters_key, *args):
+            floor = args[5]
+            self.floors.append(floor)
+            if floor == "" and fence_key not in self.counters:
+                return -1
+            fence = self.counters.get(fence_key, 0) + 1
+            fence = max(fence, int(floor or 0) + 1)
+            self.counters[fence_key] = fence
+            return fence
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def persisted(user_id):
+        return 41
+
+    fake = ResetRedis()
+    monkeypatch.setattr(processor_mod, "redis_client", fake)
+    monkeypatch.setattr(processor_mod, "inc_metric", noop)
+    service = BroadcastProcessorService(
+        DummyUserbot(BroadcastExecutionResult(True, 0, [])), DummyQueue()
+    )
+    monkeypatch.setattr(service, "persisted_fence", persisted)
+
+    assert await service.acquire_user_lock("10", "tok") == 42
+    assert await service.acquire_user_lock("10", "tok2") == 43
+    assert fake.floors == ["", "41", ""]
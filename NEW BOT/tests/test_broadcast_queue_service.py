@@ -0,0 +1,215 @@
+import pickle
+
+import pytest
+
+import app.services.broadcast_queue_service as queue_mod
+from app.services.broadcast_queue_service import BroadcastQueueService, EnqueueSpec
+
+
+class _FakeScript:
+    def __init__(self, existing: set[str]):
+        self.existing = existing
+        self.calls = []
+
+    async def __call__(self, keys, args):
+        self.calls.append((keys, args))
+        job_count = (len(keys) - 1) // 2
+        return [0 if keys[1 + 2 * i] in self.existing else 1 for i in range(job_count)]
+
+
+class _FakePool:
+    default_queue_name = "arq:queue"
+    expires_extra_ms = 86_400_000
+    job_serializer = None
+
+    def __init__(self, existing: set[str] | None = None):
+        self.script = _FakeScript(existing or set())
+
+    def register_script(self, script):
+        return self.script
+
+
+@pytest.fixture(autouse=True)
+def no_routing(monkeypatch):
+    monkeypatch.setattr(queue_mod.settings, "broadcast_worker_routing_enabled", False)
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    calls = []
+
+    async def fake_inc(name, value=1):
+        calls.append((name, value))
+
+    async def fake_gauge(name, value):
+        return None
+
+    monkeypatch.setattr(queue_mod, "inc_metric", fake_inc)
+    monkeypatch.setattr(queue_mod, "set_gauge_metric", fake_gauge)
+    return calls
+
+
+def test_enqueue_many_call_mirrors_arq_job_layout():
+    spec = EnqueueSpec("10", "hi", "7", "2026-01-01T00:00:00", 300, delay_ms=1500)
+    keys, args = BroadcastQueueService.build_enqueue_many_call(
+        [spec], ["job-1"], "arq:queue", enqueue_time_ms=1000, expires_extra_ms=5000
+    )
+
+    assert keys == ["arq:queue", "arq:job:job-1", "arq:result:job-1"]
+    assert args[:3] == ["job-1", 2500, 6500]
+    job = pickle.loads(args[3])
+    assert job["f"] == "process_broadcast_job"
+    assert job["a"][0]["campaignId"] == "7"
+    assert job["a"][0]["intervalSeconds"] == 300
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many_reports_duplicates_per_job(metrics):
+    service = BroadcastQueueService()
+    pool = _FakePool(existing={"arq:job:dup"})
+    service.redis_pool = pool
+
+    results = await service.enqueue_many(
+        [
+            EnqueueSpec("1", "a", "1", "t", job_id="new"),
+            EnqueueSpec("2", "b", "2", "t", job_id="dup"),
+        ]
+    )
+
+    assert results == ["new", None]
+    assert len(pool.script.calls) == 1
+    assert metrics == [
+        ("queue.enqueue.result|outcome=success|service=queue", 1),
+        ("queue.enqueue.result|outcome=duplicate|service=queue", 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many_splits_large_batches(metrics, monkeypatch):
+    service = BroadcastQueueService()
+    pool = _FakePool()
+    service.redis_pool = pool
+    monkeypatch.setattr(service, "enqueue_batch_size", 2)
+
+    results = await service.enqueue_many(
+        [EnqueueSpec(str(i), "m", str(i), "t") for i in range(5)]
+    )
+
+    assert len(results) == 5 and all(results)
+    assert [len(keys) for keys, _ in pool.script.calls] == [5, 5, 3]
+
+
+@pytest.mark.asyncio
+async def test_continuation_is_coalesced_onto_pending_job(metrics):
+    service = BroadcastQueueService()
+    pool = _FakePool()
+    calls = []
+
+    async def script(keys, args):
+        calls.append((keys, args))
+        return [0, b"bc-cont-7-10-pending", b"123"]
+
+    pool.register_script = lambda source: script
+    service.redis_pool = pool
+
+    job_id = await service.enqueue_continuation("10", "hi", "7", "t", 300, delay_ms=1500)
+
+    assert job_id == "bc-cont-7-10-pending"
+    keys, args = calls[0]
+    assert keys[:2] == ["arq:queue:continuation", "broadcast:continuation:10:7"]
+    assert keys[2] == f"arq:job:{args[0]}"
+    assert args[0].startswith("bc-cont-7-10-")
+    assert args[1] - args[2] == 1500
+    assert args[7] == "arq:queue:continuation"
+    assert metrics == [
+        ("queue.continuation.result|outcome=coalesced|queue=continuation|service=queue", 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_routed_continuation_also_looks_in_the_shared_queue(metrics, monkeypatch):
+    monkeypatch.setattr(queue_mod.settings, "broadcast_worker_routing_enabled", True)
+    service = BroadcastQueueService()
+
+    async def routed(user_id, base_queue):
+        return f"{base_queue}:w:w2"
+
+    service.router.queue_for = routed
+    pool = _FakePool()
+    calls = []
+
+    async def script(keys, args):
+        calls.append((keys, args))
+        return [0, b"bc-cont-7-10-moved", b"123"]
+
+    pool.register_script = lambda source: script
+    service.redis_pool = pool
+
+    assert await service.enqueue_continuation("10", "hi", "7", "t", 300) == "bc-cont-7-10-moved"
+    keys, args = calls[0]
+    assert keys[0] == "arq:queue:continuation:w:w2"
+    assert args[7] == "arq:queue:continuation"
+
+
+def test_priority_classes_map_to_queues_and_weights():
+    assert queue_mod.queue_name_for("scheduled") == "arq:queue"
+    assert queue_mod.queue_name_for("retry") == "arq:queue:retry"
+    with pytest.raises(ValueError):
+        queue_mod.queue_name_for("bulk")
+
+    assert queue_mod.class_weights("scheduled:6, retry:0,bogus:9") == {
+        "scheduled": 6,
+        "continuation": 1,
+        "retry": 1,
+    }
+
+
+def test_worker_slots_follow_class_weights():
+    from app.worker import class_max_jobs
+
+    assert class_max_jobs(10, {"scheduled": 6, "continuation": 3, "retry": 1}) == {
+        "scheduled": 6,
+        "continuation": 3,
+        "retry": 1,
+    }
+    assert class_max_jobs(2, {"scheduled": 6, "continuation": 3, "retry": 1}) == {
+        "scheduled": 1,
+        "continuation": 1,
+        "retry": 1,
+    }
+
+
+def test_versioned_payload_omits_message_text():
+    payload = BroadcastQueueService.build_payload("1", "long text", "7", "t", 60, config_version=4)
+    assert payload["configVersion"] == 4
+    assert "message" not in payload
+
+    legacy = BroadcastQueueService.build_payload("1", "text", "adhoc", "t")
+    assert legacy["message"] == "text"
+
+
+@pytest.mark.asyncio
+async def test_single_queue_arq_entry_point_refuses_to_start():
+    from app.worker import WorkerSettings
+
+    with pytest.raises(RuntimeError, match="python -m app.worker"):
+        await WorkerSettings.on_startup({})
+
+
+@pytest.mark.asyncio
+async def test_long_running_job_does_not_count_as_ready_lag(metrics, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from arq.constants import in_progress_key_prefix
+
+    monkeypatch.setattr(queue_mod, "timestamp_ms", lambda: 1_000_000)
+    pool = fakeredis.FakeAsyncRedis()
+    # Started 10 minutes ago and still running; arq leaves it in the queue.
+    await pool.zadd("arq:queue", {"running": 400_000, "waiting": 990_000, "later": 2_000_000})
+    await pool.set(f"{in_progress_key_prefix}running", b"1")
+    service = BroadcastQueueService()
+    service.redis_pool = pool
+
+    stats = await service.queue_stats()
+
+    assert stats == queue_mod.QueueStats(depth=3, ready=1, oldest_ready_lag_ms=10_000)
@@ -62,3 +62,15 @@ def test_classifier_marks_slowmode_by_exception_class_name():
     classified = classify_telegram_error(err, slowmode_default_seconds=300)
     assert classified["retriable"] is True
     assert classified["is_slowmode"] is True
+
+
+def test_account_flood_wait_is_distinguished_from_slowmode():
+    FloodWait = type("FloodWait", (Exception,), {})
+    err = FloodWait("Telegram says: [420 FLOOD_WAIT_X] - A wait of 90 seconds is required")
+    classified = classify_telegram_error(err)
+    assert classified["is_flood_wait"] is True
+    assert classified["retry_after_seconds"] == 90
+
+    slowmode = classify_telegram_error("Telegram says: [420 SLOWMODE_WAIT_10]")
+    assert slowmode["is_flood_wait"] is False
+    assert classify_telegram_error("CHAT_WRITE_FORBIDDEN")["is_flood_wait"] is False
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+import app.services.campaign_actor as actor_mod
+from app.config import settings
+from app.services.campaign_actor import CampaignActor
+from app.services.userbot_service import BroadcastExecutionResult
+
+
+@pytest.fixture(autouse=True)
+def _no_metrics(monkeypatch):
+    async def fake_inc(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(actor_mod, "inc_metric", fake_inc)
+
+
+class DummyUserbot:
+    def __init__(self, slices):
+        self.slices = list(slices)
+        self.prepared = 0
+        self.budgets = []
+
+    async def prepare_broadcast(self, *args, **kwargs):
+        self.prepared += 1
+        return object()
+
+    async def run_broadcast_slice(self, state, max_attempts_per_run, fence=None, lease_lost=None):
+        self.budgets.append(max_attempts_per_run)
+        return self.slices.pop(0)
+
+
+def slice_result(pending, ready=0, next_due=0, sent=1, attempts=1):
+    return BroadcastExecutionResult(
+        success=pending == 0,
+        count=sent,
+        errors=[],
+        summary={
+            "pending": pending,
+            "inFlight": 0,
+            "failed": 0,
+            "readyPendingCount": ready,
+            "nextDueInMs": next_due,
+            "attemptsThisRun": attempts,
+        },
+    )
+
+
+def test_next_wait_follows_due_times():
+    assert CampaignActor.next_wait_ms({"pending": 0, "inFlight": 0}) is None
+    assert CampaignActor.next_wait_ms({"pending": 3, "readyPendingCount": 3, "accountPacingDelayMs": 700}) == 700
+    assert CampaignActor.next_wait_ms({"pending": 3, "readyPendingCount": 0, "nextDueInMs": 1200}) == 1200
+
+
+@pytest.mark.asyncio
+async def test_actor_runs_whole_cycle_with_one_setup(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_actor_max_idle_wait_ms", 1000, raising=False)
+    userbot = DummyUserbot(
+        [slice_result(2, ready=2), slice_result(1, next_due=10), slice_result(0, sent=1)]
+    )
+    actor = CampaignActor(userbot, asyncio.Event())
+
+    result = await actor.run(10, "hi", "5", None, attempts_per_slice=40)
+
+    assert userbot.prepared == 1
+    assert result.success is True
+    assert result.count == 3
+    assert result.summary["actorSlices"] == 3
+    assert result.summary["actorStopReason"] == "cycle-complete"
+
+
+@pytest.mark.asyncio
+async def test_actor_hands_back_on_long_wait_and_budget(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_actor_max_idle_wait_ms", 1000, raising=False)
+    userbot = DummyUserbot([slice_result(5, next_due=60_000)])
+    result = await CampaignActor(userbot, asyncio.Event()).run(10, "hi", "5", None, 40)
+    assert result.summary["actorStopReason"] == "long-wait"
+
+    userbot = DummyUserbot([slice_result(5, ready=5, attempts=6)])
+    result = await CampaignActor(userbot, asyncio.Event()).run(
+        10, "hi", "5", None, 40, run_budget=6
+    )
+    assert userbot.budgets == [6]
+    assert result.summary["actorStopReason"] == "budget"
+
+
+@pytest.mark.asyncio
+async def test_actor_stops_when_worker_is_stopping(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_actor_max_idle_wait_ms", 10_000, raising=False)
+    stopping = asyncio.Event()
+    userbot = DummyUserbot([slice_result(5, next_due=5_000)])
+    actor = CampaignActor(userbot, stopping)
+
+    task = asyncio.create_task(actor.run(10, "hi", "5", None, 40))
+    await asyncio.sleep(0.01)
+    stopping.set()
+    result = await asyncio.wait_for(task, timeout=1)
+
+    assert result.summary["actorStopReason"] == "stopping"
+    assert result.success is False
+
+
+@pytest.mark.asyncio
+async def test_actor_does_not_spin_when_stopping_with_ready_work(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_actor_max_idle_wait_ms", 1000, raising=False)
+    stopping = asyncio.Event()
+    stopping.set()
+    userbot = DummyUserbot([slice_result(5, ready=5, sent=0, attempts=0) for _ in range(50)])
+
+    result = await CampaignActor(userbot, stopping).run(10, "hi", "5", None, 40)
+
+    assert result.summary["actorSlices"] == 1
+    assert result.summary["actorStopReason"] == "stopping"
+
+    # A slice that claimed nothing backs off instead of re-running at once.
+    monkeypatch.setattr(settings, "broadcast_actor_max_idle_wait_ms", 100, raising=False)
+    userbot = DummyUserbot([slice_result(5, ready=5, sent=0, attempts=0) for _ in range(50)])
+    result = await CampaignActor(userbot, asyncio.Event()).run(10, "hi", "5", None, 40)
+
+    assert result.summary["actorSlices"] == 1
+    assert result.summary["actorStopReason"] == "long-wait"
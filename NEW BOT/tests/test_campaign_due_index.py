@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import BroadcastConfig, TelegramAccount
+from app.services.campaign_due_index import CampaignDueIndex
+from app.services.scheduler_service import SchedulerService
+
+
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+
+
+def _config(last_run_at=None, interval=300, is_active=True, message="hi"):
+    return BroadcastConfig(
+        id=7,
+        user_id="10",
+        message=message,
+        interval=interval,
+        is_active=is_active,
+        last_run_at=last_run_at,
+    )
+
+
+def _account(is_flood_wait=False, flood_wait_until=None):
+    return TelegramAccount(
+        id="acc",
+        user_id="10",
+        is_active=True,
+        is_flood_wait=is_flood_wait,
+        flood_wait_until=flood_wait_until,
+    )
+
+
+def test_never_run_campaign_is_due_now():
+    assert CampaignDueIndex.compute_due_at(_config(), [_account()], NOW) == NOW
+
+
+def test_due_time_follows_last_run_and_interval():
+    config = _config(last_run_at=NOW - timedelta(seconds=100))
+    assert CampaignDueIndex.compute_due_at(config, [_account()], NOW) == NOW + timedelta(seconds=200)
+
+
+def test_flood_blocked_accounts_push_due_time_out():
+    until = NOW + timedelta(minutes=10)
+    accounts = [
+        _account(is_flood_wait=True, flood_wait_until=until),
+        _account(is_flood_wait=True, flood_wait_until=until + timedelta(minutes=5)),
+    ]
+    assert CampaignDueIndex.compute_due_at(_config(), accounts, NOW) == until
+    assert CampaignDueIndex.compute_due_at(_config(), accounts + [_account()], NOW) == NOW
+
+
+def test_unschedulable_campaigns_are_left_out():
+    assert CampaignDueIndex.compute_due_at(_config(), [], NOW) is None
+    assert CampaignDueIndex.compute_due_at(_config(is_active=False), [_account()], NOW) is None
+    assert CampaignDueIndex.compute_due_at(_config(message=None), [_account()], NOW) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_database_when_nothing_is_due(monkeypatch):
+    service = SchedulerService(queue_service=None)  # type: ignore[arg-type]
+
+    async def no_due(shard, now, limit):
+        return []
+
+    def fail_session():
+        raise AssertionError("database should not be queried")
+
+    monkeypatch.setattr(service.due_index, "due_ids", no_due)
+    monkeypatch.setattr("app.services.scheduler_service.db_session", fail_session)
+
+    assert await service.get_due_configs(10, shard=3) == []
+
+
+def test_persisted_next_run_at_takes_precedence():
+    config = _config(last_run_at=NOW - timedelta(seconds=100))
+    config.next_run_at = NOW + timedelta(minutes=30)
+    assert CampaignDueIndex.compute_due_at(config, [_account()], NOW) == NOW + timedelta(minutes=30)
+
+
+def test_due_query_filters_and_orders_on_next_run_at():
+    from sqlalchemy.dialects import postgresql
+
+    stmt = SchedulerService.build_due_query(NOW, 25, config_ids=[1, 2])
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+
+    assert "broadcast_configs.next_run_at <= " in sql
+    assert "ORDER BY broadcast_configs.next_run_at ASC" in sql
+    assert "broadcast_configs.id IN" in sql
+    assert "LIMIT" in sql
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import app.main as main_mod
+from app.services.userbot_service import UserbotService
+
+
+def test_progress_statement_is_single_filtered_aggregate():
+    stmt = UserbotService.build_progress_statement(10, "7", datetime(2026, 3, 1, 12, 0, 0))
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert sql.count("FILTER (WHERE") == 7
+    assert "GROUP BY" not in sql
+
+
+def test_summarize_progress_maps_counts_and_next_due():
+    now = datetime(2026, 3, 1, 12, 0, 0)
+    summary = UserbotService.summarize_progress(
+        (5, 1, 3, 0, now + timedelta(seconds=90), 2, 1),
+        now,
+    )
+    assert summary == {
+        "sent": 5,
+        "failed": 1,
+        "pending": 3,
+        "inFlight": 0,
+        "nextDueInMs": 90000,
+        "readyPendingCount": 2,
+        "providerConstrainedDelay": True,
+    }
+
+
+def test_summarize_progress_handles_empty_campaign():
+    summary = UserbotService.summarize_progress(
+        (0, 0, 0, 0, None, 0, 0), datetime(2026, 3, 1, 12, 0, 0)
+    )
+    assert summary["nextDueInMs"] == 0
+    assert summary["providerConstrainedDelay"] is False
+
+
+@pytest.mark.asyncio
+async def test_progress_endpoint_returns_campaign_summary(monkeypatch):
+    async def fake_progress(user_id, campaign_id):
+        assert user_id == 10
+        assert campaign_id == "7"
+        return {"sent": 2, "failed": 0, "pending": 1, "inFlight": 0}
+
+    monkeypatch.setattr(main_mod.userbot_service, "campaign_progress", fake_progress)
+
+    result = await main_mod.broadcast_progress(10, "7")
+    assert result["ok"] is True
+    assert result["pending"] == 1
+    assert result["campaignId"] == "7"
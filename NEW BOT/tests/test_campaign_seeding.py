@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app.services.userbot_service import UserbotService
+
+
+class _G:
+    def __init__(self, gid: str):
+        self.id = gid
+
+
+def test_seed_rows_are_sorted_and_round_robin_assigned():
+    now = datetime(2026, 3, 1, 12, 0, 0)
+    rows = UserbotService.build_seed_rows(
+        user_id=10,
+        campaign_id="7",
+        target_groups=[_G("-1003"), _G("-1001"), _G("-1002")],
+        available_account_ids=["acc-1", "acc-2"],
+        max_retries=3,
+        now=now,
+    )
+    assert [r["target_group_id"] for r in rows] == ["-1001", "-1002", "-1003"]
+    assert [r["sequence"] for r in rows] == [1, 2, 3]
+    assert [r["assigned_account_id"] for r in rows] == ["acc-1", "acc-2", "acc-1"]
+    assert rows[0]["idempotency_key"] == "7:-1001"
+    assert all(r["status"] == "pending" and r["created_at"] == now for r in rows)
+    assert len({r["id"] for r in rows}) == 3
+
+
+def test_seed_statement_is_single_insert_on_conflict_do_nothing():
+    rows = UserbotService.build_seed_rows(
+        user_id=10,
+        campaign_id="7",
+        target_groups=[_G("-1001"), _G("-1002")],
+        available_account_ids=["acc-1"],
+        max_retries=3,
+        now=datetime(2026, 3, 1, 12, 0, 0),
+    )
+    sql = str(
+        UserbotService.build_seed_statement(rows).compile(dialect=postgresql.dialect())
+    )
+    assert sql.startswith("INSERT INTO broadcast_attempts")
+    assert "ON CONFLICT DO NOTHING" in sql
+    assert "RETURNING broadcast_attempts.id" in sql
+
+
+def test_seed_chunk_size_stays_under_bind_parameter_limit(monkeypatch):
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "broadcast_seed_chunk_size", 5000)
+    assert UserbotService.seed_chunk_size(12) == 32767 // 12
+
+    monkeypatch.setattr(settings, "broadcast_seed_chunk_size", 1000)
+    assert UserbotService.seed_chunk_size(12) == 1000
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+import app.services.client_pool as pool_mod
+from app.services.client_pool import ClientPool
+
+
+class _FakeClient:
+    def __init__(self, name: str):
+        self.name = name
+        self.stopped = False
+
+    async def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture(autouse=True)
+def _no_metrics(monkeypatch):
+    async def fake_metric(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(pool_mod, "inc_metric", fake_metric)
+    monkeypatch.setattr(pool_mod, "set_gauge_metric", fake_metric)
+
+
+def _factory(name: str, started: list):
+    async def start():
+        client = _FakeClient(name)
+        started.append(client)
+        return client
+
+    return start
+
+
+@pytest.mark.asyncio
+async def test_cached_client_is_reused():
+    pool = ClientPool(max_size=2, idle_ttl_ms=60000)
+    started = []
+
+    async with pool.lease("a", _factory("a", started)) as first:
+        pass
+    async with pool.lease("a", _factory("a", started)) as second:
+        pass
+
+    assert first is second
+    assert len(started) == 1
+    await pool.close()
+    assert first.stopped is True
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_idle_client_is_evicted():
+    evicted = []
+    pool = ClientPool(max_size=2, idle_ttl_ms=60000, on_evict=evicted.append)
+    started = []
+
+    for key in ("a", "b", "a", "c"):
+        async with pool.lease(key, _factory(key, started)):
+            pass
+
+    assert evicted == ["b"]
+    assert "a" in pool and "c" in pool
+    assert [c.stopped for c in started] == [False, True, False]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_client_in_use_is_never_evicted():
+    pool = ClientPool(max_size=1, idle_ttl_ms=60000)
+    started = []
+
+    async with pool.lease("a", _factory("a", started)) as busy:
+        async with pool.lease("b", _factory("b", started)):
+            assert len(pool) == 2
+        assert busy.stopped is False
+        assert "b" not in pool
+
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_clients_expire_after_ttl():
+    pool = ClientPool(max_size=10, idle_ttl_ms=1000)
+    started = []
+
+    async with pool.lease("a", _factory("a", started)):
+        pass
+
+    assert pool.eviction_candidates() == []
+    future = pool._entries["a"].last_used_at + 2
+    assert pool.eviction_candidates(now=future) == ["a"]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_unavailable_account_is_not_cached():
+    pool = ClientPool(max_size=2, idle_ttl_ms=60000)
+
+    async def start():
+        return None
+
+    async with pool.lease("a", start) as client:
+        assert client is None
+    assert len(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_leases_share_one_start():
+    pool = ClientPool(max_size=4, idle_ttl_ms=60000)
+    gate = asyncio.Event()
+    started = []
+
+    async def slow_start():
+        started.append(1)
+        await gate.wait()
+        return _FakeClient("a")
+
+    async def use():
+        async with pool.lease("a", slow_start) as client:
+            return client
+
+    tasks = [asyncio.create_task(use()) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    clients = await asyncio.gather(*tasks)
+
+    assert len(started) == 1
+    assert clients[0] is clients[1] is clients[2]
+    assert pool._entries["a"].refs == 0
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_different_accounts_start_in_parallel():
+    pool = ClientPool(max_size=4, idle_ttl_ms=60000)
+    running = 0
+    peak = 0
+
+    def factory(name):
+        async def start():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return _FakeClient(name)
+
+        return start
+
+    async def use(key):
+        async with pool.lease(key, factory(key)):
+            pass
+
+    await asyncio.gather(*(use(key) for key in ("a", "b", "c")))
+
+    assert peak == 3
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_are_counted_locally_and_flushed(monkeypatch):
+    calls = []
+
+    async def fake_inc(name, value=1):
+        calls.append((name, value))
+
+    monkeypatch.setattr(pool_mod, "inc_metric", fake_inc)
+    pool = ClientPool(max_size=2, idle_ttl_ms=60000)
+    started = []
+    for _ in range(3):
+        async with pool.lease("a", _factory("a", started)):
+            pass
+
+    assert ("userbot.client_pool.hit|service=userbot", 2) not in calls
+    await pool.flush_metrics()
+    assert calls[-1] == ("userbot.client_pool.hit|service=userbot", 2)
+    await pool.close()
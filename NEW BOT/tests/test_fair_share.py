@@ -0,0 +1,157 @@
+import pytest
+
+from app.config import settings
+from app.services.broadcast_processor_service import BroadcastProcessorService
+from app.services.fair_share import FairShareService
+from app.services.userbot_service import BroadcastExecutionResult
+
+
+class DummyUserbot:
+    def __init__(self, result: BroadcastExecutionResult):
+        self.result = result
+        self.calls = []
+
+    async def broadcast_message(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.result
+
+
+class DummyQueue:
+    def __init__(self):
+        self.calls = []
+
+    def continuation_delay_ms(self):
+        return 500
+
+    async def enqueue_continuation(self, **kwargs):
+        self.calls.append(kwargs)
+        return "job-1"
+
+
+class DummyFairShare:
+    def __init__(self, credit: int):
+        self.credit = credit
+        self.settled = []
+
+    async def admit(self, user_id):
+        return self.credit
+
+    async def settle(self, user_id, used, next_job_in_ms):
+        self.settled.append((user_id, used, next_job_in_ms))
+
+
+def make_service(monkeypatch, result, credit):
+    monkeypatch.setattr(settings, "bot_role", "worker", raising=False)
+    monkeypatch.setattr(settings, "broadcast_fair_share_enabled", True, raising=False)
+    monkeypatch.setattr(settings, "broadcast_attempts_per_job", 40, raising=False)
+    userbot = DummyUserbot(result)
+    queue = DummyQueue()
+    service = BroadcastProcessorService(userbot, queue)
+    service.fair_share = DummyFairShare(credit)
+
+    async def locked(*args, **kwargs):
+        return True
+
+    async def released(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(service, "acquire_user_lock", locked)
+    monkeypatch.setattr(service, "release_user_lock", released)
+    return service, userbot, queue
+
+
+PAYLOAD = {"userId": "10", "message": "hello", "campaignId": "cmp-1", "queuedAt": "2026-01-01T00:00:00Z"}
+
+
+@pytest.mark.asyncio
+async def test_user_without_credit_is_deferred(monkeypatch):
+    service, userbot, queue = make_service(
+        monkeypatch, BroadcastExecutionResult(True, 0, []), credit=0
+    )
+
+    out = await service.process(dict(PAYLOAD))
+
+    assert out["outcome"] == "fair-share-deferred"
+    assert out["continuationReason"] == "fair-share"
+    assert userbot.calls == []
+    assert queue.calls[0]["delay_ms"] == 500
+
+
+@pytest.mark.asyncio
+async def test_credit_caps_attempts_and_is_settled(monkeypatch):
+    result = BroadcastExecutionResult(
+        success=False,
+        count=1,
+        errors=[],
+        error=None,
+        summary={"pending": 2, "inFlight": 0, "failed": 0, "sent": 1, "attemptsThisRun": 7},
+    )
+    service, userbot, queue = make_service(monkeypatch, result, credit=7)
+
+    out = await service.process(dict(PAYLOAD))
+
+    assert userbot.calls[0]["max_attempts_per_run"] == 7
+    assert service.fair_share.settled == [("10", 7, out["continuationDelayMs"])]
+
+
+def test_tier_weights_default_to_one(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_tier_weights", "basic:1,premium:3", raising=False)
+
+    assert FairShareService.weight_for_tier("premium") == 3
+    assert FairShareService.weight_for_tier(None) == 1
+    assert FairShareService.weight_for_tier("unknown") == 1
+
+
+@pytest.mark.asyncio
+async def test_settier_writes_the_tier_fair_share_reads(monkeypatch):
+    import contextlib
+
+    import app.services.access_service as access_mod
+    from app.models import AllowedUser
+    from app.services.access_service import AccessService
+
+    monkeypatch.setattr(settings, "broadcast_tier_weights", "basic:1,premium:3", raising=False)
+    users = {"10": AllowedUser(id="10", username="u")}
+
+    class FakeSession:
+        async def get(self, model, key):
+            return users.get(key)
+
+    @contextlib.asynccontextmanager
+    async def fake_session():
+        yield FakeSession()
+
+    monkeypatch.setattr(access_mod, "db_session", fake_session)
+    service = AccessService()
+
+    assert service.normalize_tier("gold") is None
+    assert await service.set_tier("11", "premium") is False
+    assert await service.set_tier("10", service.normalize_tier(" premium ")) is True
+    assert FairShareService.weight_for_tier(users["10"].tier) == 3
+
+
+@pytest.mark.asyncio
+async def test_higher_tier_gets_a_larger_share_per_round(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import app.services.fair_share as fair_mod
+
+    monkeypatch.setattr(fair_mod, "redis_client", fakeredis.FakeAsyncRedis(decode_responses=True))
+    monkeypatch.setattr(settings, "broadcast_fair_quantum", 40, raising=False)
+    service = FairShareService()
+    weights = {"basic-user": 1, "premium-user": 3}
+
+    async def user_weight(user_id):
+        return weights[user_id]
+
+    monkeypatch.setattr(service, "user_weight", user_weight)
+
+    assert await service.admit("basic-user") == 40
+    assert await service.admit("premium-user") == 120
+    await service.settle("basic-user", used=40, next_job_in_ms=0)
+    # The premium user is ready and still holds credit, so the basic one waits.
+    assert await service.admit("basic-user") == 0
+    await service.settle("premium-user", used=120, next_job_in_ms=0)
+    # Nobody ready holds credit any more: a new round refills both.
+    assert await service.admit("basic-user") == 40
+    assert await service.admit("premium-user") == 120
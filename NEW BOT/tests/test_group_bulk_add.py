@@ -43,7 +43,7 @@ async def test_add_all_groups_adds_missing_groups(monkeypatch):
     async def fake_get_groups(_user_id, active_only=False):
         return [_G("-1001")]
 
-    async def fake_add_group(user_id, group_id, title, kind, access_hash):
+    async def fake_add_group(user_id, group_id, title, kind, access_hash, peer_account_id=None):
         added.append((user_id, group_id, title, kind, access_hash))
 
     async def fake_render(_message, _user_id, _page, is_edit=False):
@@ -109,7 +109,7 @@ async def test_add_all_groups_normalizes_supergroup_existing_ids(monkeypatch):
     async def fake_get_groups(_user_id, active_only=False):
         return [_G("-10012345")]
 
-    async def fake_add_group(user_id, group_id, title, kind, access_hash):
+    async def fake_add_group(user_id, group_id, title, kind, access_hash, peer_account_id=None):
         added.append((user_id, group_id, title, kind, access_hash))
 
     async def fake_render(_message, _user_id, _page, is_edit=False):
@@ -0,0 +1,61 @@
+from app.models import UserGroup
+from app.schema_upgrades import SCHEMA_UPGRADES
+from app.services.userbot_service import UserbotService
+
+
+def _group(group_id, kind, access_hash=None, peer_account_id=None):
+    return UserGroup(
+        id=group_id,
+        user_id="10",
+        title=group_id,
+        type=kind,
+        access_hash=access_hash,
+        peer_account_id=peer_account_id,
+        is_active=True,
+    )
+
+
+def test_known_channel_hashes_are_seeded_for_owning_account():
+    groups = [
+        _group("-1001234", "supergroup", "987654321", "acc-1"),
+        _group("-555", "group"),
+    ]
+
+    peers, unresolved = UserbotService.build_known_peers(groups, "acc-1")
+
+    assert peers == [(-1001234, 987654321, "supergroup", None, None)]
+    assert unresolved == []
+
+
+def test_hash_from_another_account_is_not_reused():
+    groups = [
+        _group("-1001234", "supergroup", "987654321", "acc-2"),
+        _group("-1009999", "supergroup"),
+    ]
+
+    peers, unresolved = UserbotService.build_known_peers(groups, "acc-1")
+
+    assert peers == []
+    assert [g.id for g in unresolved] == ["-1001234", "-1009999"]
+
+
+def test_schema_upgrades_are_idempotent_statements():
+    assert any("peer_account_id" in stmt for stmt in SCHEMA_UPGRADES)
+    ddl = [stmt for stmt in SCHEMA_UPGRADES if stmt.startswith(("ALTER", "CREATE"))]
+    assert all("IF NOT EXISTS" in stmt for stmt in ddl)
+    backfills = [stmt for stmt in SCHEMA_UPGRADES if stmt.startswith("UPDATE")]
+    assert all("IS NULL" in stmt for stmt in backfills)
+
+
+def test_per_account_hashes_resolve_each_account_separately():
+    channel = _group("-1001234", "supergroup", "111", "acc-1")
+    channel.pk = 5
+
+    peers_1, _ = UserbotService.build_known_peers([channel], "acc-1", {})
+    peers_2, unresolved_2 = UserbotService.build_known_peers([channel], "acc-2", {5: "222"})
+    _, unresolved_3 = UserbotService.build_known_peers([channel], "acc-3", {})
+
+    assert peers_1 == [(-1001234, 111, "supergroup", None, None)]
+    assert peers_2 == [(-1001234, 222, "supergroup", None, None)]
+    assert unresolved_2 == []
+    assert [g.id for g in unresolved_3] == ["-1001234"]
@@ -0,0 +1,90 @@
+import pytest
+
+import app.services.scheduler_service as scheduler_mod
+from app.config import settings
+from app.services.broadcast_queue_service import QueueStats
+from app.services.scheduler_service import SchedulerService
+
+
+def test_admissions_scale_with_lag_headroom():
+    admitted = SchedulerService.admitted_per_tick
+
+    assert admitted(QueueStats(depth=0, ready=0, oldest_ready_lag_ms=0), 500, 180_000) == 500
+    assert admitted(QueueStats(depth=900, ready=400, oldest_ready_lag_ms=90_000), 500, 180_000) == 250
+    assert admitted(QueueStats(depth=900, ready=400, oldest_ready_lag_ms=179_999), 500, 180_000) == 1
+    assert admitted(QueueStats(depth=900, ready=400, oldest_ready_lag_ms=200_000), 500, 180_000) == 0
+
+
+class _Queue:
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def queue_stats_by_class(self):
+        if isinstance(self.stats, Exception):
+            raise self.stats
+        return {"scheduled": self.stats}
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    calls = []
+
+    async def fake_inc(name, value=1):
+        calls.append((name, value))
+
+    async def fake_gauge(name, value):
+        return None
+
+    monkeypatch.setattr(scheduler_mod, "inc_metric", fake_inc)
+    monkeypatch.setattr(scheduler_mod, "set_gauge_metric", fake_gauge)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_overloaded_queue_defers_due_campaigns(monkeypatch, metrics):
+    monkeypatch.setattr(settings, "scheduler_max_due_per_tick", 500, raising=False)
+    monkeypatch.setattr(settings, "broadcast_queue_lag_alert_ms", 1000, raising=False)
+    service = SchedulerService(_Queue(QueueStats(depth=50, ready=50, oldest_ready_lag_ms=5000)))  # type: ignore[arg-type]
+    limits = []
+
+    async def owned():
+        service.shards.owned = {0, 1}
+        return {0, 1}
+
+    async def run_shard(shard, limit=None):
+        limits.append(limit)
+        return 0
+
+    monkeypatch.setattr(service.shards, "rebalance", owned)
+    monkeypatch.setattr(service, "run_shard", run_shard)
+
+    await service.check_and_run()
+    assert limits == [0, 0]
+    assert service._throttled is True
+    assert await service.next_wake_delay_ms() == settings.scheduler_check_interval_ms
+
+
+@pytest.mark.asyncio
+async def test_queue_stats_failure_keeps_full_admission(monkeypatch, metrics):
+    monkeypatch.setattr(settings, "scheduler_max_due_per_tick", 500, raising=False)
+    service = SchedulerService(_Queue(ConnectionError("down")))  # type: ignore[arg-type]
+
+    assert await service.admission_limit() == 500
+    assert any("stats_failed" in name for name, _ in metrics)
+
+
+@pytest.mark.asyncio
+async def test_throttled_shard_reports_deferred(monkeypatch, metrics):
+    service = SchedulerService(_Queue(None))  # type: ignore[arg-type]
+
+    async def no_rebuild(shard):
+        return None
+
+    async def due_count(shard, now):
+        return 7
+
+    monkeypatch.setattr(service, "rebuild_due_index_if_stale", no_rebuild)
+    monkeypatch.setattr(service.due_index, "due_count", due_count)
+
+    assert await service.run_shard(3, limit=0) == 0
+    assert ("scheduler.backpressure.deferred|service=scheduler", 7) in metrics
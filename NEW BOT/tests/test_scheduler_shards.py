@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import app.services.scheduler_service as scheduler_mod
+from app.config import settings
+from app.models import BroadcastConfig
+from app.services.scheduler_service import SchedulerService
+from app.services.scheduler_shards import preferred_shards, shard_clause, shard_for_user
+
+
+def test_user_shard_is_stable_modulo():
+    assert shard_for_user("1000000007", 16) == 1000000007 % 16
+    assert shard_for_user("-7", 4) == 3
+
+
+def test_non_numeric_user_ids_are_hashed_into_a_shard():
+    # md5("abc") starts with 90015098, i.e. 2415980696.
+    assert shard_for_user("abc", 16) == 2415980696 % 16
+    # Too long for a BIGINT in SQL, so it takes the hashed path on both sides.
+    too_long = "1" * 19
+    assert shard_for_user(too_long, 16) == int(hashlib.md5(too_long.encode()).hexdigest()[:8], 16) % 16
+
+
+def test_shards_are_split_evenly_across_members():
+    members = ["a", "b", "c"]
+    owned = [preferred_shards(member, members, 16) for member in members]
+
+    assert sorted(shard for shards in owned for shard in shards) == list(range(16))
+    assert max(len(shards) for shards in owned) == 6
+    assert preferred_shards("a", [], 4) == [0, 1, 2, 3]
+
+
+def test_shard_clause_matches_python_modulo():
+    sql = str(
+        shard_clause(BroadcastConfig.user_id, [1, 2], 8).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    assert "abs(CAST(broadcast_configs.user_id AS BIGINT)) %" in sql
+    assert "CASE WHEN (broadcast_configs.user_id ~" in sql
+    assert "ELSE CAST(CAST(%(param_1)s || substr(md5(broadcast_configs.user_id)" in sql
+    assert "AS BIT(32)) AS BIGINT) %" in sql
+
+
+@pytest.mark.asyncio
+async def test_slow_shard_does_not_block_others(monkeypatch):
+    service = SchedulerService(queue_service=None)  # type: ignore[arg-type]
+    finished = []
+
+    async def owned():
+        return {0, 1}
+
+    async def run_shard(shard, limit=None):
+        if shard == 0:
+            await asyncio.sleep(5)
+        finished.append(shard)
+        return 1
+
+    async def fake_metric(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(service.shards, "rebalance", owned)
+    monkeypatch.setattr(service, "run_shard", run_shard)
+    monkeypatch.setattr(scheduler_mod, "inc_metric", fake_metric)
+    monkeypatch.setattr(settings, "scheduler_shard_tick_timeout_ms", 50, raising=False)
+
+    await asyncio.wait_for(service.check_and_run(), timeout=2)
+    assert finished == [1]
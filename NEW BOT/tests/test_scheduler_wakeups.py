@@ -0,0 +1,131 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import app.services.scheduler_service as scheduler_mod
+from app.config import settings
+from app.services.scheduler_service import MIN_WAKE_INTERVAL_MS, SchedulerService
+
+
+def make_service() -> SchedulerService:
+    return SchedulerService(queue_service=None)  # type: ignore[arg-type]
+
+
+@pytest.mark.asyncio
+async def test_wake_delay_tracks_earliest_due(monkeypatch):
+    service = make_service()
+    service.shards.owned = {0, 3}
+    monkeypatch.setattr(settings, "scheduler_check_interval_ms", 5000, raising=False)
+
+    async def next_due_ms(shards):
+        assert shards == [0, 3]
+        return int(time.time() * 1000) + 1500
+
+    monkeypatch.setattr(service.due_index, "next_due_ms", next_due_ms)
+    delay = await service.next_wake_delay_ms()
+    assert 1000 < delay <= 1500
+
+
+@pytest.mark.asyncio
+async def test_idle_scheduler_sleeps_until_due_or_the_safety_cap(monkeypatch):
+    service = make_service()
+    service.shards.owned = {1}
+    monkeypatch.setattr(settings, "scheduler_check_interval_ms", 5000, raising=False)
+    monkeypatch.setattr(settings, "scheduler_idle_wake_max_ms", 60_000, raising=False)
+    due = {"value": None}
+
+    async def next_due_ms(shards):
+        return due["value"]
+
+    monkeypatch.setattr(service.due_index, "next_due_ms", next_due_ms)
+    assert await service.next_wake_delay_ms() == 60_000
+
+    due["value"] = int(time.time() * 1000) + 30_000
+    assert 25_000 < await service.next_wake_delay_ms() <= 30_000
+
+    due["value"] = int(time.time() * 1000) + 600_000
+    assert await service.next_wake_delay_ms() == 60_000
+
+    due["value"] = int(time.time() * 1000) - 10_000
+    assert await service.next_wake_delay_ms() == MIN_WAKE_INTERVAL_MS
+
+    service.shards.owned = set()
+    assert await service.next_wake_delay_ms() == 60_000
+
+
+@pytest.mark.asyncio
+async def test_due_index_unavailable_falls_back_to_check_interval(monkeypatch):
+    service = make_service()
+    service.shards.owned = {1}
+    monkeypatch.setattr(settings, "scheduler_check_interval_ms", 5000, raising=False)
+
+    async def next_due_ms(shards):
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(service.due_index, "next_due_ms", next_due_ms)
+    assert await service.next_wake_delay_ms() == 5000
+
+
+@pytest.mark.asyncio
+async def test_lease_loop_wakes_scheduler_when_shards_change(monkeypatch):
+    service = make_service()
+    service._running = True
+    monkeypatch.setattr(settings, "scheduler_shard_lease_ms", 1000, raising=False)
+
+    async def rebalance():
+        service.shards.owned = {2}
+        service._running = False
+        return {2}
+
+    monkeypatch.setattr(service.shards, "rebalance", rebalance)
+    await asyncio.wait_for(service._lease_loop(), timeout=2)
+
+    assert service._wake.is_set()
+
+
+@pytest.mark.asyncio
+async def test_config_event_wakes_sleeping_scheduler(monkeypatch):
+    service = make_service()
+    service.shards.owned = {int("1001") % settings.scheduler_shard_count}
+
+    async def delay():
+        return 10_000
+
+    monkeypatch.setattr(service, "next_wake_delay_ms", delay)
+    waiter = asyncio.create_task(service.wait_for_next_tick())
+    await asyncio.sleep(0)
+
+    assert service.handle_config_event(json.dumps({"userId": "1001"}))
+    assert await asyncio.wait_for(waiter, timeout=1) is True
+    assert not service._wake.is_set()
+
+
+def test_config_event_for_foreign_shard_is_ignored(monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_shard_count", 4, raising=False)
+    service = make_service()
+    service.shards.owned = {0}
+
+    assert service.handle_config_event(json.dumps({"userId": "5"})) is False
+    assert service.handle_config_event("not-json") is False
+    assert service.handle_config_event(json.dumps({"userId": "8"})) is True
+
+
+@pytest.mark.asyncio
+async def test_publish_failure_is_not_fatal(monkeypatch):
+    service = make_service()
+    metrics = []
+
+    class BrokenRedis:
+        async def publish(self, channel, data):
+            raise ConnectionError("down")
+
+    async def fake_metric(key, *args, **kwargs):
+        metrics.append(key)
+
+    monkeypatch.setattr(scheduler_mod, "redis_client", BrokenRedis())
+    monkeypatch.setattr(scheduler_mod, "inc_metric", fake_metric)
+
+    await service.publish_config_change("42")
+    assert any("publish_failed" in key for key in metrics)
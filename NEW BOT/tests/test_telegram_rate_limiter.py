@@ -0,0 +1,189 @@
+import pytest
+
+import app.services.telegram_rate_limiter as rl
+from app.config import settings
+from app.services.telegram_rate_limiter import (
+    ACCOUNT_PACE_KEY_PREFIX,
+    AccountPacer,
+    DC_LIMIT_KEY_PREFIX,
+    GLOBAL_LIMIT_KEY,
+    LocalTokenBucket,
+    TelegramSendLimiter,
+)
+
+
+class _FakeRedis:
+    def __init__(self, results=None, error: Exception | None = None):
+        self.results = list(results or [])
+        self.error = error
+        self.calls = []
+
+    async def eval(self, script, numkeys, key, emission_ms, burst, permits):
+        self.calls.append((key, emission_ms, burst, permits))
+        if self.error is not None:
+            raise self.error
+        return self.results.pop(0) if self.results else 0
+
+
+@pytest.fixture(autouse=True)
+def _no_metrics(monkeypatch):
+    async def fake_inc(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(rl, "inc_metric", fake_inc)
+
+
+def test_local_bucket_allows_burst_then_asks_to_wait():
+    bucket = LocalTokenBucket(rate_per_sec=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_uses_global_and_dc_keys(monkeypatch):
+    fake = _FakeRedis()
+    monkeypatch.setattr(rl, "redis_client", fake)
+    monkeypatch.setattr(settings, "telegram_global_mps", 100, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_dc_mps", 20, raising=False)
+    monkeypatch.setattr(settings, "telegram_rate_limit_permit_batch", 1, raising=False)
+
+    await TelegramSendLimiter().acquire(dc_id=2)
+
+    assert [c[0] for c in fake.calls] == [GLOBAL_LIMIT_KEY, f"{DC_LIMIT_KEY_PREFIX}2"]
+    assert fake.calls[0][1] == pytest.approx(10.0)
+
+
+@pytest.mark.asyncio
+async def test_batched_permits_save_round_trips(monkeypatch):
+    fake = _FakeRedis()
+    monkeypatch.setattr(rl, "redis_client", fake)
+    monkeypatch.setattr(settings, "telegram_global_mps", 100, raising=False)
+    monkeypatch.setattr(settings, "telegram_rate_limit_permit_batch", 3, raising=False)
+
+    limiter = TelegramSendLimiter()
+    for _ in range(3):
+        await limiter.acquire()
+
+    assert len(fake.calls) == 1
+    assert fake.calls[0][3] == 3
+
+
+@pytest.mark.asyncio
+async def test_remote_wait_is_honoured(monkeypatch):
+    fake = _FakeRedis(results=[5, 0])
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(rl, "redis_client", fake)
+    monkeypatch.setattr(rl.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(settings, "telegram_rate_limit_permit_batch", 1, raising=False)
+
+    await TelegramSendLimiter().acquire()
+    assert sleeps == [0.005]
+    assert len(fake.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_redis_failure_falls_back_to_local_bucket(monkeypatch):
+    monkeypatch.setattr(rl, "redis_client", _FakeRedis(error=ConnectionError("down")))
+    monkeypatch.setattr(settings, "telegram_global_mps", 100, raising=False)
+    monkeypatch.setattr(settings, "telegram_rate_limit_fallback_ratio", 0.25, raising=False)
+
+    monkeypatch.setattr(settings, "telegram_rate_limit_fallback_workers", 4, raising=False)
+
+    limiter = TelegramSendLimiter()
+    await limiter.acquire()
+    assert limiter._local_buckets[GLOBAL_LIMIT_KEY].rate_per_sec == pytest.approx(6.25)
+
+    # Once a live worker count is known, the fallback is split by it instead.
+    limiter._worker_count = 10
+    await limiter.acquire()
+    assert limiter._local_buckets[GLOBAL_LIMIT_KEY].rate_per_sec == pytest.approx(2.5)
+
+
+@pytest.mark.asyncio
+async def test_timed_out_reservation_counts_as_spent(monkeypatch):
+    fake = _FakeRedis(error=TimeoutError())
+    monkeypatch.setattr(rl, "redis_client", fake)
+    monkeypatch.setattr(settings, "telegram_global_mps", 100, raising=False)
+    monkeypatch.setattr(settings, "telegram_rate_limit_permit_batch", 1, raising=False)
+
+    await TelegramSendLimiter().acquire()
+
+    assert len(fake.calls) == 1
+
+
+class _FakePaceRedis:
+    def __init__(self, results=None, error: Exception | None = None):
+        self.results = list(results or [])
+        self.error = error
+        self.calls = []
+
+    async def eval(self, script, numkeys, key, gap_ms, max_wait_ms):
+        self.calls.append((key, gap_ms, max_wait_ms))
+        if self.error is not None:
+            raise self.error
+        return self.results.pop(0) if self.results else [1, 0]
+
+
+def test_account_gap_uses_slower_of_mpm_and_delay(monkeypatch):
+    monkeypatch.setattr(settings, "telegram_per_account_mpm", 20, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_min_delay_ms", 1000, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_max_delay_ms", 1000, raising=False)
+    assert AccountPacer.gap_ms() == 3000
+
+    monkeypatch.setattr(settings, "telegram_per_account_min_delay_ms", 5000, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_max_delay_ms", 5000, raising=False)
+    assert AccountPacer.gap_ms() == 5000
+
+
+@pytest.mark.asyncio
+async def test_account_reserve_reports_wait_from_redis(monkeypatch):
+    fake = _FakePaceRedis(results=[[1, 1200]])
+    monkeypatch.setattr(rl, "redis_client", fake)
+    monkeypatch.setattr(settings, "telegram_per_account_mpm", 20, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_min_delay_ms", 0, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_max_delay_ms", 0, raising=False)
+
+    granted, wait_ms = await AccountPacer().reserve("acc-1", 15000)
+
+    assert (granted, wait_ms) == (True, 1200)
+    assert fake.calls == [(f"{ACCOUNT_PACE_KEY_PREFIX}acc-1", 3000, 15000)]
+
+
+@pytest.mark.asyncio
+async def test_account_peek_does_not_reserve(monkeypatch):
+    fake = _FakePaceRedis(results=[[0, 700]])
+    monkeypatch.setattr(rl, "redis_client", fake)
+
+    assert await AccountPacer().peek("acc-1") == 700
+    assert fake.calls[0][1:] == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_account_pacer_falls_back_to_local_schedule(monkeypatch):
+    monkeypatch.setattr(rl, "redis_client", _FakePaceRedis(error=ConnectionError("down")))
+    monkeypatch.setattr(settings, "telegram_per_account_mpm", 0, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_min_delay_ms", 10000, raising=False)
+    monkeypatch.setattr(settings, "telegram_per_account_max_delay_ms", 10000, raising=False)
+
+    pacer = AccountPacer()
+    assert await pacer.reserve("acc-1", 5000) == (True, 0)
+    granted, wait_ms = await pacer.reserve("acc-1", 5000)
+    assert granted is False
+    assert wait_ms > 5000
+
+
+@pytest.mark.asyncio
+async def test_account_block_holds_back_local_reservations(monkeypatch):
+    monkeypatch.setattr(rl, "redis_client", _FakePaceRedis(error=ConnectionError("down")))
+
+    pacer = AccountPacer()
+    await pacer.block_for("acc-1", 60000)
+    granted, wait_ms = await pacer.reserve("acc-1", 15000)
+
+    assert granted is False
+    assert wait_ms > 55000
@@ -0,0 +1,163 @@
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import settings
+from app.services.userbot_service import BroadcastRunState, UserbotService
+
+
+class DummyPacer:
+    async def peek(self, account_id):
+        return 0
+
+    async def reserve(self, account_id, max_wait_ms):
+        return True, 0
+
+
+class DummySink:
+    def __init__(self, on_record):
+        self.recorded = []
+        self.on_record = on_record
+        self.closed = False
+
+    async def record(self, attempt_id, values, fence=None):
+        self.recorded.append(attempt_id)
+        self.on_record()
+
+    async def flush(self):
+        return 0
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_draining_lane_stops_claiming_and_releases_held_rows(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_per_account_concurrency", 1)
+    service = UserbotService()
+    service.account_pacer = DummyPacer()
+    service.outcome_sink = DummySink(on_record=service.draining.set)
+    claims = []
+    released = []
+
+    async def claim_attempts(**kwargs):
+        claims.append(kwargs["limit"])
+        return [SimpleNamespace(id=f"a{index}", target_group_id="g") for index in range(3)]
+
+    async def release_claimed_attempts(attempt_ids, fence=None):
+        released.extend(attempt_ids)
+        return len(attempt_ids)
+
+    async def campaign_progress(user_id, campaign_id):
+        return {"failed": 0, "pending": 2, "inFlight": 0}
+
+    @contextlib.asynccontextmanager
+    async def no_client():
+        yield None
+
+    monkeypatch.setattr(service, "claim_attempts", claim_attempts)
+    monkeypatch.setattr(service, "release_claimed_attempts", release_claimed_attempts)
+    monkeypatch.setattr(service, "campaign_progress", campaign_progress)
+    monkeypatch.setattr(service, "connected_client", lambda user_id, account_id: no_client())
+    state = BroadcastRunState(1, "hi", "7", None, 60, ["acc-1"], [])
+
+    result = await service.run_broadcast_slice(state, max_attempts_per_run=10, fence=3)
+
+    assert len(claims) == 1
+    assert service.outcome_sink.recorded == ["a0"]
+    assert released == ["a1", "a2"]
+    assert result.summary["attemptsThisRun"] == 1
+    assert not result.success
+
+
+@pytest.mark.asyncio
+async def test_processor_drain_stops_actors_and_lanes():
+    from app.services.broadcast_processor_service import BroadcastProcessorService
+
+    userbot = UserbotService()
+    processor = BroadcastProcessorService(userbot, queue_service=None)
+
+    processor.begin_drain()
+
+    assert processor.stopping.is_set()
+    assert userbot.draining.is_set()
+
+
+@pytest.mark.asyncio
+async def test_failed_queue_worker_drains_the_others_and_is_reported():
+    import asyncio
+
+    from app.worker import supervise_workers
+
+    stopped = asyncio.Event()
+
+    class CrashingWorker:
+        queue_name = "arq:queue:retry"
+
+        async def async_run(self):
+            raise ConnectionError("redis unreachable")
+
+    class DrainableWorker:
+        queue_name = "arq:queue"
+
+        async def async_run(self):
+            await stopped.wait()
+
+    failed = await asyncio.wait_for(
+        supervise_workers([CrashingWorker(), DrainableWorker()], stopped.set), timeout=1
+    )
+
+    assert failed
+    assert stopped.is_set()
+
+
+@pytest.mark.asyncio
+async def test_flood_blocked_account_stays_out_of_later_slices(monkeypatch):
+    monkeypatch.setattr(settings, "broadcast_per_account_concurrency", 1)
+    service = UserbotService()
+    service.account_pacer = DummyPacer()
+    service.outcome_sink = DummySink(on_record=lambda: None)
+    claims = []
+
+    class FloodWait(Exception):
+        pass
+
+    class FloodedClient:
+        async def send_message(self, chat_id, text):
+            raise FloodWait("FLOOD_WAIT_X")
+
+    async def claim_attempts(**kwargs):
+        claims.append((kwargs["account_id"], kwargs["available_account_ids"]))
+        if kwargs["account_id"] == "acc-1":
+            return [SimpleNamespace(id="a0", target_group_id="-100", retry_count=0, max_retries=3)]
+        return []
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def campaign_progress(user_id, campaign_id):
+        return {"failed": 0, "pending": 1, "inFlight": 0}
+
+    @contextlib.asynccontextmanager
+    async def flooded_client():
+        yield FloodedClient()
+
+    monkeypatch.setattr(service, "claim_attempts", claim_attempts)
+    monkeypatch.setattr(service, "campaign_progress", campaign_progress)
+    monkeypatch.setattr(service, "mark_account_flood_wait", noop)
+    monkeypatch.setattr(service, "_client_dc_id", noop)
+    monkeypatch.setattr(service.send_limiter, "acquire", noop)
+    monkeypatch.setattr(service, "connected_client", lambda user_id, account_id: flooded_client())
+    target = SimpleNamespace(id="-100")
+    state = BroadcastRunState(1, "hi", "7", None, 60, ["acc-1"], [target])
+
+    await service.run_broadcast_slice(state, max_attempts_per_run=10)
+    claims.clear()
+    state.account_ids.append("acc-2")
+    result = await service.run_broadcast_slice(state, max_attempts_per_run=10)
+
+    assert "acc-1" in state.flood_blocked_until
+    assert claims == [("acc-2", ["acc-2"])]
+    assert result.summary["floodBlockedAccounts"] == 1
+    assert result.summary["accountPacingDelayMs"] > 0
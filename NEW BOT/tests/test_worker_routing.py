@@ -0,0 +1,142 @@
+import pytest
+
+import app.services.broadcast_queue_service as queue_mod
+import app.services.worker_routing as routing_mod
+from app.services.broadcast_queue_service import BroadcastQueueService, EnqueueSpec
+from app.services.worker_routing import HashRing, WorkerRouter, worker_queue_name
+
+
+class _FakeScript:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, keys, args):
+        self.calls.append((keys, args))
+        return [1] * ((len(keys) - 1) // 2)
+
+
+class _FakePool:
+    expires_extra_ms = 86_400_000
+    job_serializer = None
+
+    def __init__(self):
+        self.script = _FakeScript()
+
+    def register_script(self, script):
+        return self.script
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(routing_mod.settings, "broadcast_worker_routing_enabled", True)
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(queue_mod, "inc_metric", noop)
+    monkeypatch.setattr(queue_mod, "set_gauge_metric", noop)
+
+
+def _router_with(members: list[str]) -> WorkerRouter:
+    router = WorkerRouter()
+    router._members = sorted(members)
+    router._ring = HashRing(members)
+    router._loaded_at = float("inf")
+    return router
+
+
+def test_ring_only_remaps_the_joining_members_share():
+    users = [str(user_id) for user_id in range(2000)]
+    before = HashRing(["w1", "w2", "w3"])
+    after = HashRing(["w1", "w2", "w3", "w4"])
+
+    moved = [user for user in users if before.owner(user) != after.owner(user)]
+
+    assert all(after.owner(user) == "w4" for user in moved)
+    assert 0.15 < len(moved) / len(users) < 0.35
+    assert HashRing([]).owner("1") is None
+
+
+@pytest.mark.asyncio
+async def test_router_targets_owner_queue_and_falls_back_to_shared(routing, monkeypatch):
+    router = _router_with(["w1", "w2"])
+    owner = router._ring.owner("42")
+
+    assert await router.queue_for("42", "arq:queue") == f"arq:queue:w:{owner}"
+    assert await router.class_queues("arq:queue:retry") == [
+        "arq:queue:retry",
+        "arq:queue:retry:w:w1",
+        "arq:queue:retry:w:w2",
+    ]
+    assert await _router_with([]).queue_for("42", "arq:queue") == "arq:queue"
+
+    monkeypatch.setattr(routing_mod.settings, "broadcast_worker_routing_enabled", False)
+    assert await router.queue_for("42", "arq:queue") == "arq:queue"
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many_groups_jobs_by_owner_queue(routing):
+    service = BroadcastQueueService()
+    pool = _FakePool()
+    service.redis_pool = pool
+    service.router = _router_with(["w1", "w2", "w3"])
+    specs = [EnqueueSpec(str(user_id), None, str(user_id), "t") for user_id in range(30)]
+
+    results = await service.enqueue_many(specs)
+
+    assert all(results)
+    queued = {}
+    for keys, args in pool.script.calls:
+        for index in range(0, len(args), 4):
+            queued[args[index]] = keys[0]
+    for spec, job_id in zip(specs, results):
+        owner = service.router._ring.owner(spec.user_id)
+        assert queued[job_id] == worker_queue_name("arq:queue", owner)
+    assert len(pool.script.calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_owner_and_shared_queues_share_one_concurrency_budget(routing, monkeypatch):
+    from app.worker import build_workers
+
+    monkeypatch.setattr(routing_mod.settings, "broadcast_concurrency", 8)
+    workers = build_workers("w1")
+
+    slots = {worker.queue_name: worker.max_jobs for worker in workers}
+    assert len(slots) == 6
+    assert sum(slots.values()) == 8
+    assert slots[worker_queue_name("arq:queue", "w1")] > slots["arq:queue"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_sweep_leaves_running_jobs_and_keeps_their_member(routing, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import time
+
+    from arq.constants import in_progress_key_prefix
+
+    from app.services.worker_routing import MEMBERS_KEY, WorkerMembership
+
+    async def noop(*args, **kwargs):
+        return None
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(routing_mod, "redis_client", redis)
+    monkeypatch.setattr(routing_mod, "inc_metric", noop)
+    monkeypatch.setattr(routing_mod, "set_gauge_metric", noop)
+    dead_queue = worker_queue_name("arq:queue", "dead")
+    long_gone_ms = int(time.time() * 1000) - 10 * routing_mod.member_ttl_ms()
+    await redis.zadd(MEMBERS_KEY, {"dead": long_gone_ms})
+    await redis.zadd(dead_queue, {"running": 1, "waiting": 2})
+    await redis.set(f"{in_progress_key_prefix}running", "1")
+    membership = WorkerMembership("w1", ["arq:queue"])
+
+    assert await membership.heartbeat() == 1
+    assert await redis.zrange(dead_queue, 0, -1) == ["running"]
+    assert await redis.zrange("arq:queue", 0, -1) == ["waiting"]
+    assert await redis.zscore(MEMBERS_KEY, "dead") is not None
+
+    await redis.delete(f"{in_progress_key_prefix}running")
+    assert await membership.heartbeat() == 1
+    assert await redis.zscore(MEMBERS_KEY, "dead") is None